@@ -0,0 +1,305 @@
+"""
+Local ACS classifier trained on the vision table history.
+
+Activity class and criticality are predicted from the image description with
+TF-IDF features and logistic regression; activity and surrounding are copied
+from the most similar stored description. Frames the model is unsure about are
+routed to the LLM through get_acs.
+
+Usage (agreement and latency against the stored LLM labels):
+
+    python acs_classifier.py task.db --llm-sample 20
+"""
+
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from acs_detection import get_acs
+from crud_db import read_from_table
+
+# Fewest LLM-labelled frames to train on
+MIN_TRAINING_FRAMES = 50
+# Below either value the frame is sent to the LLM
+MIN_CONFIDENCE = 0.7
+MIN_SIMILARITY = 0.3
+MAX_TRAINING_FRAMES = 5000
+
+
+def load_acs_history(db_path, limit=MAX_TRAINING_FRAMES):
+    """
+    Most recent vision rows labelled by the LLM or VLM, oldest first.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        limit (int): Maximum number of rows.
+
+    Returns:
+        list: (image_desp, activity, activity_class, criticality, surrounding) rows.
+    """
+    rows = read_from_table(
+        """
+        SELECT image_desp, activity, activity_class, criticality, surrounding
+        FROM vision
+        WHERE (acs_source IS NULL OR acs_source != 'local')
+          AND image_desp IS NOT NULL AND activity_class IS NOT NULL
+          AND criticality IS NOT NULL
+        ORDER BY id DESC LIMIT ?;
+        """,
+        db_path,
+        (limit,),
+    )
+    return list(reversed(rows or []))
+
+
+class LocalACSClassifier:
+    """
+    TF-IDF + logistic regression over image descriptions.
+
+    Any object with the same `predict(img_desp)` method can be plugged into
+    HybridACS instead.
+    """
+
+    def __init__(self, max_features=20000, min_similarity=MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.vectorizer = TfidfVectorizer(
+            ngram_range=(1, 2), sublinear_tf=True, max_features=max_features
+        )
+        self.class_model = LogisticRegression(max_iter=1000)
+        self.criticality_model = LogisticRegression(max_iter=1000)
+        self.features = None
+        self.rows = []
+
+    def fit(self, rows):
+        """
+        Train on labelled vision rows.
+
+        Args:
+            rows (list): (image_desp, activity, activity_class, criticality, surrounding) rows.
+
+        Returns:
+            LocalACSClassifier: self.
+
+        Raises:
+            ValueError: If the rows hold fewer than two activity classes or
+                        criticality levels.
+        """
+        descriptions, _, classes, criticalities, _ = zip(*rows)
+        if len(set(classes)) < 2 or len(set(criticalities)) < 2:
+            raise ValueError(
+                "need at least two activity classes and criticality levels"
+            )
+        self.features = self.vectorizer.fit_transform(descriptions)
+        self.class_model.fit(self.features, classes)
+        self.criticality_model.fit(self.features, criticalities)
+        self.rows = list(rows)
+        return self
+
+    @classmethod
+    def from_db(cls, db_path, min_frames=MIN_TRAINING_FRAMES):
+        """
+        Train on the vision table.
+
+        Returns:
+            LocalACSClassifier or None if there is not enough history yet.
+        """
+        rows = load_acs_history(db_path)
+        if len(rows) < min_frames:
+            return None
+        try:
+            return cls().fit(rows)
+        except ValueError as e:
+            print(f"Local ACS classifier not trained: {e}")
+            return None
+
+    def predict(self, img_desp):
+        """
+        Predict the ACS of one description.
+
+        Args:
+            img_desp (str): Description of the frame.
+
+        Returns:
+            tuple: (ACS dict shaped like the output of get_acs, confidence in [0, 1])
+        """
+        features = self.vectorizer.transform([img_desp])
+        class_proba = self.class_model.predict_proba(features)[0]
+        criticality_proba = self.criticality_model.predict_proba(features)[0]
+        # Rows are L2-normalised, so the dot product is the cosine similarity
+        similarity = (self.features @ features.T).toarray().ravel()
+        nearest = int(np.argmax(similarity))
+
+        _, activity, _, _, surrounding = self.rows[nearest]
+        result = {
+            "timestamp": datetime.now(),
+            "activity": activity,
+            "activity_class": str(self.class_model.classes_[np.argmax(class_proba)]),
+            "criticality": str(
+                self.criticality_model.classes_[np.argmax(criticality_proba)]
+            ),
+            "surrounding": surrounding,
+        }
+        confidence = min(class_proba.max(), criticality_proba.max())
+        if similarity[nearest] < self.min_similarity:
+            # No stored frame is close enough to copy activity and surrounding from
+            confidence = 0.0
+        return result, float(confidence)
+
+
+class HybridACS:
+    """
+    Answers ACS with the local classifier and falls back to the LLM (or a given
+    fallback) when it is unsure or not trained yet. Local answers carry
+    "source": "local" so that they are left out of later training.
+    """
+
+    def __init__(
+        self, client, classifier=None, min_confidence=MIN_CONFIDENCE, cache=None
+    ):
+        self.client = client
+        self.cache = cache
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self.predictions = 0
+        self.local_calls = 0
+        self.llm_calls = 0
+        self.local_seconds = 0.0
+        self.llm_seconds = 0.0
+
+    def __call__(self, img_desp, fallback=None):
+        """
+        Args:
+            img_desp (str): Description of the frame.
+            fallback (callable): Returns the ACS dict when the classifier is
+                                 unsure, e.g. a fused VLM call on the frame;
+                                 get_acs on the description by default.
+
+        Returns:
+            dict: ACS shaped like the output of get_acs.
+        """
+        if self.classifier is not None:
+            start = time.perf_counter()
+            result, confidence = self.classifier.predict(img_desp)
+            self.local_seconds += time.perf_counter() - start
+            self.predictions += 1
+            if confidence >= self.min_confidence:
+                self.local_calls += 1
+                result["source"] = "local"
+                return result
+
+        start = time.perf_counter()
+        if fallback is not None:
+            result = fallback()
+        else:
+            result = get_acs(self.client, img_desp, self.cache)
+        self.llm_seconds += time.perf_counter() - start
+        self.llm_calls += 1
+        return result
+
+    def retrain(self, db_path):
+        """Replace the classifier with one trained on the current history."""
+        classifier = LocalACSClassifier.from_db(db_path)
+        if classifier is not None:
+            self.classifier = classifier
+
+    def report(self):
+        """Log the share of frames answered locally and the mean latencies."""
+        total = self.local_calls + self.llm_calls
+        if not total:
+            return
+        print(
+            f"ACS: {self.local_calls / total:.0%} local "
+            f"({self.local_seconds * 1000 / max(self.predictions, 1):.1f} ms), "
+            f"{self.llm_calls} LLM calls "
+            f"({self.llm_seconds * 1000 / max(self.llm_calls, 1):.0f} ms)"
+        )
+
+
+def evaluate(
+    db_path, test_fraction=0.2, min_confidence=MIN_CONFIDENCE, client=None, llm_sample=0
+):
+    """
+    Train on the older part of the history and compare with the stored LLM labels
+    of the newer part.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        test_fraction (float): Share of the most recent rows held out.
+        min_confidence (float): Routing threshold to report coverage at.
+        client: Optional API client to time get_acs on held-out descriptions.
+        llm_sample (int): Number of held-out descriptions to time on the LLM.
+
+    Returns:
+        dict: Agreement, coverage and latency figures.
+    """
+    rows = load_acs_history(db_path)
+    split = int(len(rows) * (1 - test_fraction))
+    train, test = rows[:split], rows[split:]
+    if len(train) < MIN_TRAINING_FRAMES or not test:
+        raise ValueError(f"not enough labelled frames ({len(rows)})")
+    classifier = LocalACSClassifier().fit(train)
+
+    latencies, confident, agree_class, agree_criticality = [], [], [], []
+    for description, _, activity_class, criticality, _ in test:
+        start = time.perf_counter()
+        result, confidence = classifier.predict(description)
+        latencies.append(time.perf_counter() - start)
+        confident.append(confidence >= min_confidence)
+        agree_class.append(result["activity_class"] == activity_class)
+        agree_criticality.append(result["criticality"] == criticality)
+
+    confident = np.array(confident)
+    agree_class = np.array(agree_class)
+    report = {
+        "train": len(train),
+        "test": len(test),
+        "class_agreement": float(agree_class.mean()),
+        "criticality_agreement": float(np.mean(agree_criticality)),
+        "coverage": float(confident.mean()),
+        "class_agreement_when_local": (
+            float(agree_class[confident].mean()) if confident.any() else float("nan")
+        ),
+        "local_ms": float(np.mean(latencies) * 1000),
+    }
+
+    if client is not None and llm_sample:
+        llm_latencies = []
+        for description, *_ in test[:llm_sample]:
+            start = time.perf_counter()
+            get_acs(client, description)
+            llm_latencies.append(time.perf_counter() - start)
+        report["llm_ms"] = float(np.mean(llm_latencies) * 1000)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Agreement and latency of the local ACS classifier against the LLM labels."
+    )
+    parser.add_argument("db_path", help="Database with the vision table (task.db)")
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument(
+        "--llm-sample",
+        type=int,
+        default=0,
+        help="Held-out descriptions to time on the LLM (needs GROQ_API_KEY)",
+    )
+    args = parser.parse_args()
+
+    client = None
+    if args.llm_sample:
+        from groq import Groq
+        from llm_client import RateLimitedClient
+
+        # Same rate limits and retries as the pipeline; no retries in Groq itself
+        client = RateLimitedClient(Groq(max_retries=0))
+    results = evaluate(
+        args.db_path, args.test_fraction, args.min_confidence, client, args.llm_sample
+    )
+    for key, value in results.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
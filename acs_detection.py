@@ -2,12 +2,132 @@
 Pipeline to detect Action, Criticality, and Surrounding (ACS). Making Live-Timetable.
 """
 
-from datetime import datetime
+import time
+import json
 import base64
-from prompts import IMG_DESCRIPTION_PROMPT, ACS_PROMPT, SCREEN_CAPTURE_PROMPT
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from prompts import (
+    IMG_DESCRIPTION_PROMPT,
+    ACS_PROMPT,
+    SCREEN_CAPTURE_PROMPT,
+    BATCH_DESCRIPTION_PROMPT,
+    FUSED_ACS_PROMPT,
+    FUSED_BATCH_ACS_PROMPT,
+)
+
+VLM_MODEL = "llama-3.2-11b-vision-preview"
+# Images the VLM accepts in one request
+MAX_BATCH_IMAGES = 5
+ACTIVITY_CLASSES = ("Desk_Work", "Commuting", "Eating", "In_Meeting", "Other")
+CRITICALITY_LEVELS = ("Low", "Mid", "High")
+
+
+def frame_hash(frame, hash_size=8):
+    """
+    Difference hash (dHash) of a frame: one bit per horizontally adjacent pair of
+    pixels in a (hash_size + 1) x hash_size grayscale thumbnail.
+
+    Args:
+        frame (np.ndarray): BGR or BGRA image.
+        hash_size (int): Rows of the thumbnail; the hash has hash_size**2 bits.
+
+    Returns:
+        int: The hash.
+    """
+    if frame.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if frame.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        frame = cv2.cvtColor(frame, code)
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
 
 
-def get_img_desp(client, img, pre_frame_act, is_screen=False):
+class FrameCache:
+    """
+    Cache of VLM results for near-identical frames, keyed on frame_hash.
+
+    A lookup hits when a stored hash is within `max_distance` differing bits and
+    younger than `ttl` seconds. Beyond `capacity` entries the least recently used
+    one is evicted.
+    """
+
+    def __init__(self, capacity=32, ttl=600, max_distance=4):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.entries = OrderedDict()  # hash -> (store time, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Return the value cached for a similar frame, or None."""
+        now = time.monotonic()
+        with self.lock:
+            for cached_key in [
+                k for k, (stored, _) in self.entries.items() if now - stored > self.ttl
+            ]:
+                del self.entries[cached_key]
+
+            best_key, best_distance = None, self.max_distance + 1
+            for cached_key in self.entries:
+                distance = (cached_key ^ key).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = cached_key, distance
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best_key)
+            return self.entries[best_key][1]
+
+    def store(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def _complete(client, cache, **request):
+    """
+    Run a chat completion, answering from `cache` when it already holds the
+    same request.
+
+    Returns:
+        tuple: (answer text, cache key to pass to _remember once the answer has
+               been parsed, or None if it came from the cache or no cache is used)
+    """
+    key = None
+    if cache is not None:
+        params = {k: v for k, v in request.items() if k not in ("model", "messages")}
+        key = cache.key(request["model"], request["messages"], **params)
+        content = cache.get(key)
+        if content is not None:
+            return content, None
+    output = client.chat.completions.create(**request)
+    return output.choices[0].message.content, key
+
+
+def _remember(cache, key, content, model):
+    """Store a parsed answer fetched by _complete."""
+    if key is not None:
+        cache.put(key, content, model)
+
+
+def get_img_desp(client, img, pre_frame_act, is_screen=False, cache=None):
     """
     VLM (Vision-Language Model) calls to describe the POV (point-of-view) view in detail.
 
@@ -15,24 +135,27 @@ def get_img_desp(client, img, pre_frame_act, is_screen=False):
         client: The API client used to communicate with the VLM.
         img_path (str): The path to the image file.
         pre_frame_act (str): Description of the activity from the previous frame.
+        cache (ResponseCache): Optional cache of earlier answers.
 
     Returns:
         str: A detailed description of the image, combining the POV information
              and pre-frame context.
     """
-    
+
     try:
         img = base64.b64encode(img).decode("utf-8")
     except Exception as e:
         raise ValueError("Error: couldn't encode the image correctly") from e
-    
+
     if is_screen:
         query = SCREEN_CAPTURE_PROMPT
     else:
         query = IMG_DESCRIPTION_PROMPT.format(pre_frame_act=pre_frame_act)
-    
-    output = client.chat.completions.create(
-        model="llama-3.2-11b-vision-preview",
+
+    content, key = _complete(
+        client,
+        cache,
+        model=VLM_MODEL,
         messages=[
             {
                 "role": "user",
@@ -54,18 +177,90 @@ def get_img_desp(client, img, pre_frame_act, is_screen=False):
         stop=None,
     )
 
+    _remember(cache, key, content, VLM_MODEL)
     if is_screen:
-        print('Screen Description',output.choices[0].message.content)
-    return output.choices[0].message.content
+        print("Screen Description", content)
+    return content
+
+
+def get_img_desp_batch(client, frames, pre_frame_act, cache=None):
+    """
+    Describe several frames with a single VLM request.
+
+    Every image is preceded by a SCREEN or WEBCAM label and the model answers with
+    one description per image as JSON. If the request fails or the answer does not
+    hold exactly one description per frame, every frame is described with its own
+    get_img_desp call instead.
 
+    Args:
+        client: The API client used to communicate with the VLM.
+        frames (list): (encoded image, is_screen) pairs, at most MAX_BATCH_IMAGES.
+        pre_frame_act (str): Description of the activity from the previous frame.
+        cache (ResponseCache): Optional cache of earlier answers.
 
-def get_acs(client, img_desp):
+    Returns:
+        list: One description per frame, in order.
+    """
+    if len(frames) == 1:
+        img, is_screen = frames[0]
+        return [get_img_desp(client, img, pre_frame_act, is_screen, cache)]
+
+    content = [
+        {
+            "type": "text",
+            "text": BATCH_DESCRIPTION_PROMPT.format(
+                n_frames=len(frames), pre_frame_act=pre_frame_act
+            ),
+        }
+    ]
+    for i, (img, is_screen) in enumerate(frames, start=1):
+        img = base64.b64encode(img).decode("utf-8")
+        label = "SCREEN" if is_screen else "WEBCAM"
+        content.append({"type": "text", "text": f"Image {i}: {label}"})
+        content.append(
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}}
+        )
+
+    try:
+        answer, key = _complete(
+            client,
+            cache,
+            model=VLM_MODEL,
+            messages=[{"role": "user", "content": content}],
+            temperature=0,
+            max_tokens=1024 * len(frames),
+            top_p=1,
+            stream=False,
+            response_format={"type": "json_object"},
+            stop=None,
+        )
+        descriptions = json.loads(answer)["descriptions"]
+        if len(descriptions) != len(frames) or not all(
+            isinstance(d, str) and d.strip() for d in descriptions
+        ):
+            raise ValueError(f"expected {len(frames)} descriptions")
+        _remember(cache, key, answer, VLM_MODEL)
+    except Exception as e:
+        print(f"Batched description failed ({e}), describing frames one by one")
+        return [
+            get_img_desp(client, img, pre_frame_act, is_screen, cache)
+            for img, is_screen in frames
+        ]
+
+    for (_, is_screen), description in zip(frames, descriptions):
+        if is_screen:
+            print("Screen Description", description)
+    return descriptions
+
+
+def get_acs(client, img_desp, cache=None):
     """
     LLM (Large Language Model) call to extract activity, criticality, and surrounding.
 
     Args:
         client: The API client used to communicate with the LLM.
         img_desp (str): The detailed description of the image generated by the VLM.
+        cache (ResponseCache): Optional cache of earlier answers.
 
     Returns:
         dict: A dictionary with the keys:
@@ -75,7 +270,9 @@ def get_acs(client, img_desp):
     """
 
     query = ACS_PROMPT.format(img_desp=img_desp)
-    output = client.chat.completions.create(
+    content, key = _complete(
+        client,
+        cache,
         messages=[
             {"role": "user", "content": query},
         ],
@@ -88,17 +285,187 @@ def get_acs(client, img_desp):
     )
 
     try:
-        parts = output.choices[0].message.content.strip("[]").split(" | ")
+        parts = content.strip("[]").split(" | ")
         result = {
             "timestamp": datetime.now(),
             "activity": parts[0].strip(),
             "activity_class": parts[1].strip(),
             "criticality": parts[2].strip(),
             "surrounding": parts[3].strip(),
+            "source": "llm",
         }
     except IndexError as e:
         raise ValueError(
             "Response format error: expected '[activity | activity_class | criticality | surrounding]'."
         ) from e
 
+    _remember(cache, key, content, "llama3-8b-8192")
     return result
+
+
+def validate_acs(answer):
+    """
+    Check a fused VLM answer against the ACS schema.
+
+    Args:
+        answer (dict): Parsed JSON answer of the model.
+
+    Returns:
+        tuple: (description, ACS dict shaped like the output of get_acs)
+
+    Raises:
+        ValueError: If a key is missing or empty, or a class or level is unknown.
+    """
+    keys = ("description", "activity", "activity_class", "criticality", "surrounding")
+    if not isinstance(answer, dict):
+        raise ValueError("expected a JSON object")
+    for key in keys:
+        if not isinstance(answer.get(key), str) or not answer[key].strip():
+            raise ValueError(f"missing or empty '{key}'")
+    # Accept the spelling used by the few-shot examples of ACS_PROMPT
+    activity_class = answer["activity_class"].strip().replace("-", "_")
+    if activity_class not in ACTIVITY_CLASSES:
+        raise ValueError(f"unknown activity_class '{activity_class}'")
+    criticality = answer["criticality"].strip().capitalize()
+    if criticality not in CRITICALITY_LEVELS:
+        raise ValueError(f"unknown criticality '{criticality}'")
+
+    result = {
+        "timestamp": datetime.now(),
+        "activity": answer["activity"].strip(),
+        "activity_class": activity_class,
+        "criticality": criticality,
+        "surrounding": answer["surrounding"].strip(),
+        "source": "vlm",
+    }
+    return answer["description"].strip(), result
+
+
+def get_img_acs(client, img, pre_frame_act, cache=None):
+    """
+    Single VLM call returning the description and the ACS of a frame as JSON.
+
+    Falls back to get_img_desp followed by get_acs if the request fails or the
+    answer does not pass validate_acs.
+
+    Args:
+        client: The API client used to communicate with the VLM.
+        img (np.ndarray | bytes): The encoded JPEG image.
+        pre_frame_act (str): Description of the activity from the previous frame.
+        cache (ResponseCache): Optional cache of earlier answers.
+
+    Returns:
+        tuple: (description, ACS dict shaped like the output of get_acs)
+    """
+    encoded = base64.b64encode(img).decode("utf-8")
+    try:
+        answer, key = _complete(
+            client,
+            cache,
+            model=VLM_MODEL,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": FUSED_ACS_PROMPT.format(
+                                pre_frame_act=pre_frame_act
+                            ),
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{encoded}"},
+                        },
+                    ],
+                }
+            ],
+            temperature=0,
+            max_tokens=1024,
+            top_p=1,
+            stream=False,
+            response_format={"type": "json_object"},
+            stop=None,
+        )
+        result = validate_acs(json.loads(answer))
+        _remember(cache, key, answer, VLM_MODEL)
+        return result
+    except Exception as e:
+        print(f"Fused ACS failed ({e}), using description then ACS")
+    img_desp = get_img_desp(client, img, pre_frame_act, cache=cache)
+    return img_desp, get_acs(client, img_desp, cache)
+
+
+def get_img_acs_batch(client, screens, img, pre_frame_act, cache=None):
+    """
+    Single VLM call returning the descriptions of screen frames together with the
+    description and the ACS of a webcam frame, as JSON.
+
+    Falls back to get_img_desp_batch for the screens and get_img_acs for the
+    webcam frame if the request fails or the answer does not pass validation.
+
+    Args:
+        client: The API client used to communicate with the VLM.
+        screens (list): Encoded screen frames, at most MAX_BATCH_IMAGES - 1.
+        img (np.ndarray | bytes): The encoded webcam JPEG image.
+        pre_frame_act (str): Description of the activity from the previous frame.
+        cache (ResponseCache): Optional cache of earlier answers.
+
+    Returns:
+        list: One description per screen, in order, followed by the (description,
+              ACS dict) of the webcam frame.
+    """
+    if not screens:
+        return [get_img_acs(client, img, pre_frame_act, cache)]
+
+    content = [
+        {
+            "type": "text",
+            "text": FUSED_BATCH_ACS_PROMPT.format(
+                n_screens=len(screens), pre_frame_act=pre_frame_act
+            ),
+        }
+    ]
+    for label, frame in [("WEBCAM", img)] + [("SCREEN", screen) for screen in screens]:
+        encoded = base64.b64encode(frame).decode("utf-8")
+        content.append({"type": "text", "text": label})
+        content.append(
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{encoded}"},
+            }
+        )
+
+    try:
+        answer, key = _complete(
+            client,
+            cache,
+            model=VLM_MODEL,
+            messages=[{"role": "user", "content": content}],
+            temperature=0,
+            max_tokens=1024 * (len(screens) + 1),
+            top_p=1,
+            stream=False,
+            response_format={"type": "json_object"},
+            stop=None,
+        )
+        parsed = json.loads(answer)
+        webcam = validate_acs(parsed)
+        descriptions = parsed.get("screen_descriptions")
+        if (
+            not isinstance(descriptions, list)
+            or len(descriptions) != len(screens)
+            or not all(isinstance(d, str) and d.strip() for d in descriptions)
+        ):
+            raise ValueError(f"expected {len(screens)} screen descriptions")
+        _remember(cache, key, answer, VLM_MODEL)
+    except Exception as e:
+        print(f"Fused batch failed ({e}), describing screens and webcam separately")
+        descriptions = get_img_desp_batch(
+            client, [(screen, True) for screen in screens], pre_frame_act, cache
+        )
+        return descriptions + [get_img_acs(client, img, pre_frame_act, cache)]
+
+    for description in descriptions:
+        print("Screen Description", description)
+    return descriptions + [webcam]
@@ -13,8 +13,29 @@ from ics import Calendar, Event
 from langchain_groq import ChatGroq
 from langchain.schema import SystemMessage, HumanMessage
 
+from llm_client import RateLimitedChatModel
+from response_cache import get_response_cache
 
-def extract_meeting_details(transcription, llm):
+
+def _ask(llm, messages, cache=None):
+    """
+    LLM answer text, taken from `cache` when the same messages were asked before.
+
+    Returns:
+        tuple: (answer text, cache key to store the answer under once it has been
+               parsed, or None if it came from the cache or no cache is used)
+    """
+    if cache is None:
+        return llm(messages).content, None
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+    key = cache.key(model, messages)
+    content = cache.get(key)
+    if content is not None:
+        return content, None
+    return llm(messages).content, key
+
+
+def extract_meeting_details(transcription, llm, cache=None):
     """Uses LLM to extract recipient email, meeting subject, time, and location."""
     messages = [
         SystemMessage(
@@ -38,8 +59,7 @@ def extract_meeting_details(transcription, llm):
         ),
     ]
 
-    response = llm(messages)
-    content = response.content
+    content, key = _ask(llm, messages, cache)
     start = content.find("{")
 
     if start != -1:
@@ -56,9 +76,12 @@ def extract_meeting_details(transcription, llm):
         if end != -1:
             json_block = re.sub(r"//.*", "", content[start : end + 1])
             try:
-                return json.loads(json_block)
+                details = json.loads(json_block)
             except json.JSONDecodeError as e:
                 raise ValueError(f"Invalid JSON format: {e}")
+            if key is not None:
+                cache.put(key, content)
+            return details
 
     return {
         "recipient_email": "default@example.com",
@@ -69,7 +92,7 @@ def extract_meeting_details(transcription, llm):
     }
 
 
-def decide_action(transcription, llm):
+def decide_action(transcription, llm, cache=None):
     """Determines the necessary action based on transcription."""
     messages = [
         SystemMessage(
@@ -88,8 +111,10 @@ def decide_action(transcription, llm):
         ),
     ]
 
-    response = llm(messages)
-    return response.content.strip().lower()
+    content, key = _ask(llm, messages, cache)
+    if key is not None:
+        cache.put(key, content)
+    return content.strip().lower()
 
 
 def send_calendar_invite(
@@ -174,15 +199,28 @@ def send_email(to_email, subject, body, smtp_user, smtp_password):
 
 def agent_process(transcription, api_key, smtp_user, smtp_password):
     """Processes a meeting transcript and performs necessary actions."""
-    llm = ChatGroq(api_key=api_key, model_name="llama3-70b-8192")
+    llm = RateLimitedChatModel(
+        ChatGroq(api_key=api_key, model_name="llama3-70b-8192", max_retries=0)
+    )
+    # Deterministic copy for the extraction and classification calls, whose
+    # answers are cached
+    classifier_llm = RateLimitedChatModel(
+        ChatGroq(
+            api_key=api_key,
+            model_name="llama3-70b-8192",
+            temperature=0,
+            max_retries=0,
+        )
+    )
+    cache = get_response_cache()
 
     print(f"Transcript: {transcription[:200]}...", end="\n")
     print("Extracting meeting details...", end="\n")
-    details = extract_meeting_details(transcription, llm)
+    details = extract_meeting_details(transcription, classifier_llm, cache)
     print(f"Extracted: {details}", end="\n")
 
     print("Deciding action...", end="\n")
-    action = decide_action(transcription, llm)
+    action = decide_action(transcription, classifier_llm, cache)
     print(f"Decided action: {action}", end="\n")
 
     if action == "summarize":
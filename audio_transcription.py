@@ -1,91 +1,462 @@
 """
 Pipeline to detect Task and its Urgency
+
+Audio is resampled to 16 kHz, encoded in memory (FLAC when the optional
+soundfile package is installed, WAV otherwise) and split by sample index when
+the upload would be too large, so nothing is written to disk. Split audio is
+cut into overlapping chunks that are transcribed concurrently and stitched
+back together on their timestamps.
 """
 
+import io
 import os
 import wave
+from math import gcd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import signal
+
+from crud_db import push_transcript
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
 
+TRANSCRIPTION_MODEL = "whisper-large-v3-turbo"
+# Whisper works on 16 kHz audio; anything above is resampled before upload
+TRANSCRIPTION_SAMPLERATE = 16000
+AUDIO_CODEC = "flac" if soundfile is not None else "wav"
+# Seconds shared by consecutive chunks, so no word is cut at a seam
+CHUNK_OVERLAP = 2.0
+# Chunks transcribed at once; the shared gateway in llm_client also bounds this
+TRANSCRIPTION_WORKERS = 4
+# Longest repeat merge_overlap looks for at a seam (~2 s of speech)
+MAX_OVERLAP_WORDS = 8
+# Seconds of transcript RollingTranscript keeps in memory
+TRANSCRIPT_KEEP_SECONDS = 3600
+# Extension the API needs for encoded files passed in memory, by magic bytes
+CONTAINER_EXTENSIONS = {b"RIFF": "wav", b"fLaC": "flac", b"OggS": "ogg"}
 
-def split_audio_file(input_file, chunk_duration=15):
+
+def to_int16(samples):
     """
-    Split an audio file into smaller chunks if the file is too large.
+    Convert samples to 16-bit PCM.
 
     Args:
-        input_file (str): Path to the input audio file (WAV format).
-        chunk_duration (int): Duration of each chunk in seconds.
+        samples (np.ndarray): Integer PCM or float samples in [-1, 1].
+
+    Returns:
+        np.ndarray: int16 samples of the same shape.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        return samples
+    if np.issubdtype(samples.dtype, np.floating):
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    shift = 8 * samples.dtype.itemsize - 16
+    return (samples >> shift if shift > 0 else samples).astype(np.int16)
+
+
+def resample(samples, samplerate, target=TRANSCRIPTION_SAMPLERATE):
+    """
+    Downsample to `target` Hz with a polyphase filter; lower rates are kept.
+
+    Args:
+        samples (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        target (int): Sample rate wanted.
+
+    Returns:
+        tuple: (int16 samples, sample rate)
+    """
+    if samplerate <= target:
+        return to_int16(samples), samplerate
+    factor = gcd(int(samplerate), int(target))
+    resampled = signal.resample_poly(
+        np.asarray(samples, dtype=np.float32),
+        target // factor,
+        int(samplerate) // factor,
+        axis=0,
+    )
+    return np.clip(resampled, -32768, 32767).astype(np.int16), target
+
+
+def encode_audio(samples, samplerate, codec=AUDIO_CODEC):
+    """
+    Encode samples into an in-memory audio file.
+
+    Args:
+        samples (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        codec (str): "flac" (needs soundfile) or "wav".
+
+    Returns:
+        tuple: (file name with the codec extension, encoded bytes)
+    """
+    samples = to_int16(samples)
+    buffer = io.BytesIO()
+    if codec == "flac" and soundfile is not None:
+        soundfile.write(buffer, samples, samplerate, format="FLAC", subtype="PCM_16")
+    else:
+        codec = "wav"
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(samples.shape[1] if samples.ndim == 2 else 1)
+            wav.setsampwidth(2)
+            wav.setframerate(samplerate)
+            wav.writeframes(np.ascontiguousarray(samples).tobytes())
+    return f"audio.{codec}", buffer.getvalue()
+
+
+def decode_wav(data):
+    """
+    Decode a 16-bit WAV file held in memory.
+
+    Args:
+        data (bytes): Content of the WAV file.
 
     Returns:
-        List[str]: List of file paths for the audio chunks.
+        tuple: (samples as np.ndarray of shape (n, channels), sample rate)
     """
-    chunks = []
-    with wave.open(input_file, "rb") as wav:
-        frame_rate = wav.getframerate()
+    with wave.open(io.BytesIO(data), "rb") as wav:
         channels = wav.getnchannels()
-        sample_width = wav.getsampwidth()
-        total_frames = wav.getnframes()
+        samplerate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).reshape(-1, channels), samplerate
+
+
+def split_samples(samples, samplerate, chunk_duration=15, overlap=0):
+    """
+    Split samples into chunks of `chunk_duration` seconds, each starting
+    `overlap` seconds before the previous one ends.
+
+    Args:
+        samples (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        chunk_duration (int): Duration of each chunk in seconds.
+        overlap (float): Seconds shared by consecutive chunks.
+
+    Returns:
+        List[tuple]: (start sample, view of the chunk) per chunk.
+    """
+    size = int(chunk_duration * samplerate)
+    step = size - int(overlap * samplerate)
+    if step <= 0:
+        raise ValueError("overlap must be shorter than chunk_duration")
+    starts = range(0, max(len(samples) - size, 0) + step, step)
+    return [(i, samples[i : i + size]) for i in starts if i < len(samples)]
 
-        frames_per_chunk = chunk_duration * frame_rate
 
-        for i in range(0, total_frames, frames_per_chunk):
-            wav.setpos(i)
-            chunk_data = wav.readframes(frames_per_chunk)
+def _field(item, name):
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
 
-            chunk_file = f"{input_file}_chunk_{i // frames_per_chunk + 1}.wav"
-            with wave.open(chunk_file, "wb") as chunk_wav:
-                chunk_wav.setnchannels(channels)
-                chunk_wav.setsampwidth(sample_width)
-                chunk_wav.setframerate(frame_rate)
-                chunk_wav.writeframes(chunk_data)
 
-            chunks.append(chunk_file)
+def transcribe_payload(client, name, payload, timestamps=False):
+    """
+    Send one encoded audio file to the transcription model.
+
+    Args:
+        client: The transcription client (e.g., Groq API client).
+        name (str): File name, whose extension tells the API the format.
+        payload (bytes): Encoded audio.
+        timestamps (bool): Ask for verbose_json and return its segments.
 
-    return chunks
+    Returns:
+        str: Transcribed text, or with `timestamps` a tuple (text, list of
+             (start, end, text) segments in seconds from the start of the
+             payload, or None if the response has no segments).
+    """
+    transcription = client.audio.transcriptions.create(
+        file=(name, payload),
+        model=TRANSCRIPTION_MODEL,
+        response_format="verbose_json" if timestamps else "json",
+        language="en",
+        temperature=0.0,
+    )
+    if not timestamps:
+        return transcription.text
+    segments = _field(transcription, "segments")
+    if segments:
+        segments = [
+            (
+                float(_field(segment, "start")),
+                float(_field(segment, "end")),
+                _field(segment, "text").strip(),
+            )
+            for segment in segments
+        ]
+    return _field(transcription, "text") or "", segments or None
+
+
+def _words(text):
+    return [word.strip(".,!?;:\"'").lower() for word in text.split()]
+
+
+def merge_overlap(previous, text, max_words=MAX_OVERLAP_WORDS):
+    """
+    Drop the start of `text` that repeats the end of `previous`.
+
+    Used when no timestamps are available: the longest run of words (up to
+    `max_words`, ignoring case and punctuation) that ends `previous` and
+    starts `text` is assumed to come from the shared audio.
+
+    Args:
+        previous (str): Text of the earlier chunk.
+        text (str): Text of the next chunk.
+        max_words (int): Longest repeat considered.
+
+    Returns:
+        str: `text` without the repeated words.
+    """
+    before, after = _words(previous), _words(text)
+    for n in range(min(max_words, len(before), len(after)), 0, -1):
+        if before[-n:] == after[:n]:
+            return " ".join(text.split()[n:])
+    return text
+
+
+def transcribe_chunks(
+    client,
+    samples,
+    samplerate,
+    chunk_duration=15,
+    overlap=CHUNK_OVERLAP,
+    max_workers=TRANSCRIPTION_WORKERS,
+):
+    """
+    Transcribe overlapping chunks concurrently and stitch the results.
+
+    With timestamps, each chunk keeps the segments centred before the middle
+    of its overlap with the next chunk and after the middle of its overlap with
+    the previous one. Chunks without timestamps are joined with merge_overlap.
+
+    Args:
+        client: The transcription client (e.g., Groq API client).
+        samples (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        chunk_duration (int): Duration of each chunk in seconds.
+        overlap (float): Seconds shared by consecutive chunks.
+        max_workers (int): Chunks in flight at once.
+
+    Returns:
+        list: (start, end, text) segments in seconds from the start of `samples`;
+              a chunk without timestamps is one segment spanning the chunk.
+    """
+    chunks = split_samples(samples, samplerate, chunk_duration, overlap)
+
+    def transcribe(index, chunk):
+        name, payload = encode_audio(chunk, samplerate)
+        print(
+            f"Transcribing chunk {index + 1}/{len(chunks)} ({len(payload) / 1024:.0f} kB)"
+        )
+        text, segments = transcribe_payload(client, name, payload, timestamps=True)
+        return segments, text
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(transcribe, range(len(chunks)), [c for _, c in chunks])
+        )
+
+    stitched = []
+    half_overlap = overlap / 2
+    for index, ((start_sample, chunk), (segments, text)) in enumerate(
+        zip(chunks, results)
+    ):
+        offset = start_sample / samplerate
+        end = offset + len(chunk) / samplerate
+        if segments is None:
+            # No timestamps in the response; fall back to the text
+            if stitched:
+                text = merge_overlap(stitched[-1][2], text)
+            stitched.append((offset, end, text.strip()))
+            continue
+        low = offset + half_overlap if index > 0 else float("-inf")
+        high = end - half_overlap if index < len(chunks) - 1 else float("inf")
+        for segment_start, segment_end, segment_text in segments:
+            middle = offset + (segment_start + segment_end) / 2
+            if low <= middle < high and segment_text:
+                stitched.append(
+                    (offset + segment_start, offset + segment_end, segment_text)
+                )
+    return stitched
+
+
+def transcribe_segments(
+    client,
+    samples,
+    samplerate,
+    channels=1,
+    max_file_size=10 * 1024 * 1024,
+    chunk_duration=15,
+):
+    """
+    Transcribe samples into timestamped segments, in one request if the encoded
+    audio fits `max_file_size` and with transcribe_chunks otherwise.
+
+    Args:
+        client: The transcription client (e.g., Groq API client).
+        samples (np.ndarray): Samples, interleaved if `channels` > 1.
+        samplerate (int): Sample rate in Hz.
+        channels (int): Interleaved channels of 1-D samples.
+        max_file_size (int): Maximum upload size in bytes. Defaults to 10 MB.
+        chunk_duration (int): Duration of each chunk in seconds for splitting large audio.
+
+    Returns:
+        list: (start, end, text) segments in seconds from the start of `samples`,
+              or None if the transcription failed. A response without
+              timestamps is one segment spanning the audio.
+    """
+    try:
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples.reshape(-1, channels)
+        samples, samplerate = resample(samples, samplerate)
+        name, payload = encode_audio(samples, samplerate)
+        if len(payload) > max_file_size:
+            return transcribe_chunks(client, samples, samplerate, chunk_duration)
+        text, segments = transcribe_payload(client, name, payload, timestamps=True)
+        if segments is None:
+            segments = [(0.0, len(samples) / samplerate, text.strip())]
+        return [segment for segment in segments if segment[2]]
+
+    except Exception as e:
+        print(f"Error occurred while transcribing audio: {e}")
+        return None
+
+
+class RollingTranscript:
+    """
+    Timestamped transcript of a live recording, built from overlapping windows.
+
+    Segments centred before the end of what is already transcribed come from
+    the overlap and are dropped; a segment without timestamps that reaches back
+    into it loses its repeated words through merge_overlap. Segments at the end
+    of a window are held back as pending until the next window: they are
+    replaced if it hears them again and committed otherwise, including when
+    the next window is silent or fails (add([]) or flush()). The last
+    `keep_seconds` stay in memory and every new segment is appended to the
+    transcript table of `db_path`.
+    """
+
+    def __init__(self, db_path=None, keep_seconds=TRANSCRIPT_KEEP_SECONDS):
+        self.db_path = db_path
+        self.keep_seconds = keep_seconds
+        self.segments = deque()
+        self.pending = []
+        self.end = 0.0
+
+    def add(self, segments, until=None, since=None):
+        """
+        Add the segments of a new window.
+
+        Args:
+            segments (list): (start, end, text) tuples in epoch seconds; empty
+                             for a window without speech or whose
+                             transcription failed.
+            until (float): Segments centred at or after this time are held back,
+                           because the next window, which overlaps this one,
+                           hears them with more context.
+            since (float): Start of the new window. Held-back segments centred
+                           after it were heard again and are replaced; without
+                           it, or with no segments, they are all committed.
+
+        Returns:
+            list: The segments added, in time order.
+        """
+        carried = self.pending
+        if segments and since is not None:
+            carried = [held for held in carried if (held[0] + held[1]) / 2 < since]
+        self.pending = []
+        added = []
+        for start, end, text in sorted(carried + list(segments)):
+            middle = (start + end) / 2
+            if middle < self.end:
+                continue
+            if until is not None and middle >= until:
+                self.pending.append((start, end, text))
+                continue
+            if start < self.end and self.segments:
+                text = merge_overlap(self.segments[-1][2], text)
+            text = text.strip()
+            if not text:
+                continue
+            added.append((start, end, text))
+            self.segments.append((start, end, text))
+            self.end = max(self.end, end)
+
+        while self.segments and self.segments[0][1] < self.end - self.keep_seconds:
+            self.segments.popleft()
+        if added and self.db_path is not None:
+            push_transcript(self.db_path, added)
+        return added
+
+    def flush(self):
+        """Commit the held-back tail, e.g. when the recording stops."""
+        return self.add([])
+
+    def text(self, since=None):
+        """Text of the segments in memory that start at or after `since`."""
+        return " ".join(
+            text for start, _, text in self.segments if since is None or start >= since
+        )
 
 
 def audio_transcription(
-    client, filename, max_file_size=10 * 1024 * 1024, chunk_duration=15
+    client,
+    audio,
+    samplerate=None,
+    channels=1,
+    max_file_size=10 * 1024 * 1024,
+    chunk_duration=15,
 ):
     """
-    Transcribe an audio file using the Groq API. Splits into smaller chunks if too large.
+    Transcribe audio using the Groq API. Splits into overlapping chunks if too large.
 
     Args:
         client: The transcription client (e.g., Groq API client).
-        filename (str): Path to the input audio file.
-        max_file_size (int): Maximum file size in bytes. Defaults to 10 MB.
-        chunk_duration (int): Duration of each chunk in seconds for splitting large files.
+        audio (np.ndarray | bytes | str): Samples (interleaved if `channels` > 1),
+                                          an encoded audio file in memory, or the
+                                          path of one.
+        samplerate (int): Sample rate in Hz, required for samples.
+        channels (int): Interleaved channels of 1-D samples.
+        max_file_size (int): Maximum upload size in bytes. Defaults to 10 MB.
+        chunk_duration (int): Duration of each chunk in seconds for splitting large audio.
 
     Returns:
-        str: Transcribed text from the audio file.
+        str: Transcribed text from the audio.
     """
     try:
-        if os.path.getsize(filename) > max_file_size:
-            print(
-                f"File {filename} exceeds {max_file_size / (1024 * 1024):.2f} MB. Splitting into chunks..."
-            )
-            chunks = split_audio_file(filename, chunk_duration)
-        else:
-            chunks = [filename]
-
-        transcription_text = ""
-
-        for chunk in chunks:
-            print(f"Transcribing chunk: {chunk}")
-            with open(chunk, "rb") as file:
-                transcription = client.audio.transcriptions.create(
-                    file=(chunk, file.read()),
-                    model="whisper-large-v3-turbo",
-                    response_format="json",
-                    language="en",
-                    temperature=0.0,
-                )
-                transcription_text += transcription.text + " "
+        name = None
+        if isinstance(audio, str):
+            name = os.path.basename(audio)
+            with open(audio, "rb") as file:
+                audio = file.read()
 
-            # Optionally, delete temporary chunk files after use
-            if chunk != filename:
-                os.remove(chunk)
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            payload = bytes(audio)
+            if len(payload) <= max_file_size:
+                if name is None:
+                    name = f"audio.{CONTAINER_EXTENSIONS.get(payload[:4], 'wav')}"
+                return transcribe_payload(client, name, payload).strip()
+            # Only WAV can be split without a decoder for the codec
+            samples, samplerate = resample(*decode_wav(payload))
+        else:
+            samples = np.asarray(audio)
+            if samples.ndim == 1:
+                samples = samples.reshape(-1, channels)
+            samples, samplerate = resample(samples, samplerate)
+            name, payload = encode_audio(samples, samplerate)
+            if len(payload) <= max_file_size:
+                return transcribe_payload(client, name, payload).strip()
 
-        return transcription_text.strip()
+        print(
+            f"Audio exceeds {max_file_size / (1024 * 1024):.2f} MB. Splitting into chunks..."
+        )
+        segments = transcribe_chunks(client, samples, samplerate, chunk_duration)
+        return " ".join(text for _, _, text in segments if text)
 
     except Exception as e:
-        print(f"Error occurred while transcribing audio file: {e}")
+        print(f"Error occurred while transcribing audio: {e}")
         return None
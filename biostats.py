@@ -1,77 +1,518 @@
+"""
+HRV statistics from ECG: live window stats, a streaming R-peak engine and an
+offline batch mode that recomputes windowed HRV over a whole recording.
+
+Usage (batch mode):
+    python biostats.py sensor_data.db --out task.db --window 60 --step 60
+"""
+
+import os
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+from scipy import signal
 from biosppy.signals import ecg
 
+from crud_db import create_table, iter_ecg, push_hrv_history
+
+
+# Thresholds (ms) for NNxx / pNNxx
+NN_THRESHOLDS = (20, 30, 50)
+# Lomb-Scargle frequency grid (Hz) and bands for LF/HF power
+LS_FREQS = np.arange(0.01, 0.4 + 1e-9, 0.005)
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+# Rows of a batch evaluated together in the Lomb-Scargle periodogram
+LS_BATCH_ROWS = 64
+
+
+def rr_metrics(rr_intervals):
+    """
+    Compute time- and frequency-domain HRV metrics from RR intervals.
+    Args:
+        - rr_intervals: RR intervals in ms, either 1-D or a 2-D batch with one
+          series per row (shorter series padded with NaN)
+    Returns:
+        - dict with mean_rr, sdnn, rmssd, pnn20/30/50, lf, hf, lf_hf and hr;
+          floats for 1-D input, arrays with one value per row for a batch
+    """
+    rr = np.asarray(rr_intervals, dtype=float)
+    batch = rr.ndim == 2
+    rr = np.atleast_2d(rr)
+    valid = ~np.isnan(rr)
+    rr_zeroed = np.where(valid, rr, 0.0)
+    n = valid.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_rr = rr_zeroed.sum(axis=1) / n
+        centered = np.where(valid, rr - mean_rr[:, None], 0.0)
+        sdnn = np.sqrt((centered**2).sum(axis=1) / n)
+
+        # Successive differences, computed once for RMSSD and every pNNxx
+        diffs = np.abs(np.diff(rr, axis=1))
+        n_diffs = (~np.isnan(diffs)).sum(axis=1)
+        rmssd = np.sqrt(np.nansum(diffs**2, axis=1) / n_diffs)
+        nn_counts = (diffs[:, :, None] > np.array(NN_THRESHOLDS)).sum(axis=1)
+        # No successive differences means no data, not zero variability
+        pnn = np.where(n_diffs[:, None] > 0, nn_counts / n_diffs[:, None] * 100, np.nan)
+
+        lf, hf = _lf_hf_power(rr_zeroed, centered, valid, n)
+        metrics = {
+            "pnn50": pnn[:, 2],
+            "pnn30": pnn[:, 1],
+            "pnn20": pnn[:, 0],
+            "mean_rr": mean_rr,
+            "sdnn": sdnn,
+            "rmssd": rmssd,
+            "lf": lf,
+            "hf": hf,
+            "lf_hf": lf / hf,
+            "hr": 60000 / mean_rr,
+        }
+
+    if batch:
+        return metrics
+    return {key: value[0] for key, value in metrics.items()}
+
+
+def _lf_hf_power(rr_zeroed, centered, valid, n):
+    """
+    LF and HF power (ms^2) from a Lomb-Scargle periodogram of the unevenly
+    sampled RR series, evaluated for all rows of the batch at once.
+    """
+    lf = np.full(len(n), np.nan)
+    hf = np.full(len(n), np.nan)
+    w = 2 * np.pi * LS_FREQS
+    lf_mask = (LS_FREQS >= LF_BAND[0]) & (LS_FREQS < LF_BAND[1])
+    hf_mask = (LS_FREQS >= HF_BAND[0]) & (LS_FREQS <= HF_BAND[1])
+    # Beat times in seconds
+    t = np.cumsum(rr_zeroed, axis=1) / 1000
+
+    for start in range(0, len(n), LS_BATCH_ROWS):
+        rows = slice(start, start + LS_BATCH_ROWS)
+        mask = valid[rows][:, None, :]
+        wt = w[None, :, None] * t[rows][:, None, :]
+        tau = np.arctan2(
+            (mask * np.sin(2 * wt)).sum(axis=2), (mask * np.cos(2 * wt)).sum(axis=2)
+        ) / (2 * w)
+        phase = wt - w[None, :, None] * tau[:, :, None]
+        cos, sin = mask * np.cos(phase), mask * np.sin(phase)
+        y = centered[rows][:, None, :]
+        power = 0.5 * (
+            (y * cos).sum(axis=2) ** 2 / (cos**2).sum(axis=2)
+            + (y * sin).sum(axis=2) ** 2 / (sin**2).sum(axis=2)
+        )
+        # Scale to a density whose integral over frequency is the RR variance
+        # initial= keeps series without beats (no columns) from raising; they
+        # are masked out below anyway
+        duration = t[rows].max(axis=1, initial=0.0)
+        psd = power * (2 * duration / n[rows])[:, None]
+        enough = n[rows] >= 3
+        lf[rows] = np.where(
+            enough, np.trapezoid(psd[:, lf_mask], LS_FREQS[lf_mask]), np.nan
+        )
+        hf[rows] = np.where(
+            enough, np.trapezoid(psd[:, hf_mask], LS_FREQS[hf_mask]), np.nan
+        )
+    return lf, hf
 
-def hrv_metrics(rpeaks):
+
+def hrv_metrics(rpeaks, sampling_rate=200):
     """
     Compute heart rate variability (HRV) metrics from ECG data.
     Args:
         - rpeaks: list of R-peak indices
+        - sampling_rate: ECG sampling rate in Hz
     Returns:
-        - dict with HRV metrics (mean RR interval, SDNN, NN50, pNN50, LF power, HF power, LF/HF ratio, heart rate)9
-    """
-    sampling_rate = 200  # Hz
-    rr_intervals = np.diff(rpeaks) * (1000 / sampling_rate)
-    # Time-domain metrics
-    mean_rr = np.mean(rr_intervals)
-    sdnn = np.std(rr_intervals)
-    nn50 = np.sum(
-        np.abs(np.diff(rr_intervals)) > 50
-    )  # Number of pairs of successive RR intervals > 50ms
-    pnn50 = (nn50 / len(rr_intervals)) * 100 if len(rr_intervals) > 0 else 0.0
-
-    nn20 = np.sum(
-        np.abs(np.diff(rr_intervals)) > 20
-    )  # Number of pairs of successive RR intervals > 20ms
-    nn30 = np.sum(
-        np.abs(np.diff(rr_intervals)) > 30
-    )  # Number of pairs of successive RR intervals > 30ms
-
-    pnn20 = (nn20 / len(rr_intervals)) * 100 if len(rr_intervals) > 0 else 0.0
-    pnn30 = (nn30 / len(rr_intervals)) * 100 if len(rr_intervals) > 0 else 0.0
-
-    # heart rate
-    heart_rate = 60000 / mean_rr
-
+        - dict with HRV metrics (mean RR interval, SDNN, RMSSD, pNN20/30/50, LF power, HF power, LF/HF ratio, heart rate)
+    """
+    rr_intervals = np.diff(np.asarray(rpeaks, dtype=float)) * (1000 / sampling_rate)
     result = {
-        "metrics": {
-            "pnn50": pnn50,
-            "pnn30": pnn30,
-            "pnn20": pnn20,
-            "mean_rr": mean_rr,
-            "hr": heart_rate,
-        },
+        "metrics": rr_metrics(rr_intervals),
         "start_interval": None,
         "end_interval": None,
     }
     return result
 
 
-def short_instance_stats(buffer_ecg, tsec=60):
+def short_instance_stats(buffer_ecg, tsec=60, sampling_rate=200):
     """
     Compute HRV metrics from last tsec seconds of ECG data.
     Args:
-        - buffer_ecg: list of ECG data points
+        - buffer_ecg: array of ECG samples (mV)
         - tsec: time window in seconds
+        - sampling_rate: ECG sampling rate in Hz
     Returns:
         - dict with HRV metrics
     """
     # TODO this can throw an error if the buffer_ecg is too small
-    ecg_signal = np.array([row[3] for row in buffer_ecg])
-    output = ecg.ecg(signal=ecg_signal, sampling_rate=200, show=False)
-    return hrv_metrics(output[2])
+    ecg_signal = np.asarray(buffer_ecg, dtype=float)
+    output = ecg.ecg(signal=ecg_signal, sampling_rate=sampling_rate, show=False)
+    return hrv_metrics(output[2], sampling_rate)
 
 
-def long_instance_stats(buffer_ecg, tsec=60):
+def long_instance_stats(buffer_ecg, tsec=60, sampling_rate=200):
     """
     Compute HRV metrics from last tsec seconds of ECG data.
     Args:
-        - buffer_ecg: list of ECG data points
+        - buffer_ecg: array of ECG samples (mV)
         - tsec: time window in seconds
+        - sampling_rate: ECG sampling rate in Hz
     Returns:
         - dict with HRV metrics
     """
     # TODO edit to long form
-    ecg_signal = np.array([row[3] for row in buffer_ecg])
-    output = ecg.ecg(signal=ecg_signal, sampling_rate=200, show=False)
-    return hrv_metrics(output[2])
+    ecg_signal = np.asarray(buffer_ecg, dtype=float)
+    output = ecg.ecg(signal=ecg_signal, sampling_rate=sampling_rate, show=False)
+    return hrv_metrics(output[2], sampling_rate)
+
+
+class StreamingHRV:
+    """
+    Incremental R-peak detector and RR-interval history for a live ECG stream.
+
+    Pan-Tompkins style detection (band-pass, derivative, squaring, moving-window
+    integration) with the filter state carried between calls, so each update only
+    processes the new samples. QRS regions are found against an adaptive threshold
+    and the R-peak is placed at the band-passed maximum of each region.
+    """
+
+    def __init__(self, sampling_rate=200, history_sec=600):
+        """
+        Args:
+            - sampling_rate: ECG sampling rate in Hz
+            - history_sec: how long R-peaks are kept for trailing windows
+        """
+        self.sampling_rate = sampling_rate
+        self.history = int(history_sec * sampling_rate)
+        self.sos = signal.butter(
+            2, [5, 15], btype="bandpass", fs=sampling_rate, output="sos"
+        )
+        self.mwi_len = int(0.15 * sampling_rate)
+        self.refractory = int(0.25 * sampling_rate)
+        self.max_region = int(1.0 * sampling_rate)
+        self.learn_len = int(2 * sampling_rate)
+
+        self.n_samples = 0  # samples consumed so far
+        self.peaks = deque()  # absolute sample indices of R-peaks
+
+        self._bp_zi = None
+        self._prev_bp = 0.0
+        self._mwi_zi = np.zeros(self.mwi_len - 1)
+        self._bp_tail = np.empty(0)  # last second of band-passed signal
+        self._learn = []  # raw samples held until the threshold is initialised
+        self._spk = None  # running QRS level of the integrated signal
+        self._above = False
+        self._region_start = 0
+        self._region_max = 0.0
+
+    def update(self, samples):
+        """
+        Consume new ECG samples.
+
+        Args:
+            - samples: array of new ECG samples, oldest first
+        """
+        x = np.asarray(samples, dtype=float)
+        if self._spk is None:
+            # Hold the first seconds back to set the detection threshold
+            self._learn.append(x)
+            x = np.concatenate(self._learn)
+            if len(x) < self.learn_len:
+                return
+            self._learn = []
+            self._bp_zi = signal.sosfilt_zi(self.sos) * x[0]
+        if len(x) == 0:
+            return
+
+        bp, self._bp_zi = signal.sosfilt(self.sos, x, zi=self._bp_zi)
+        derivative = np.diff(bp, prepend=self._prev_bp)
+        self._prev_bp = bp[-1]
+        mwi, self._mwi_zi = signal.lfilter(
+            np.full(self.mwi_len, 1.0 / self.mwi_len),
+            [1.0],
+            derivative * derivative,
+            zi=self._mwi_zi,
+        )
+        if self._spk is None:
+            self._spk = np.max(mwi)
+
+        start = self.n_samples
+        tail = np.concatenate((self._bp_tail, bp))
+        tail_start = start + len(bp) - len(tail)
+        self._detect(mwi, start, tail, tail_start)
+
+        self.n_samples += len(x)
+        self._bp_tail = tail[-self.sampling_rate :]
+        while self.peaks and self.peaks[0] < self.n_samples - self.history:
+            self.peaks.popleft()
+
+        # Let the threshold fall if the signal amplitude dropped
+        last_peak = self.peaks[-1] if self.peaks else 0
+        if not self._above and self.n_samples - last_peak > 3 * self.sampling_rate:
+            self._spk *= 0.5
+
+    def _detect(self, mwi, start, tail, tail_start):
+        """Find QRS regions in a block of the integrated signal and record R-peaks."""
+        above = mwi > 0.35 * self._spk
+        edges = np.flatnonzero(np.diff(above.astype(np.int8), prepend=self._above))
+        bounds = np.append(edges, len(mwi))
+
+        # Regions already open at the start of the block continue from before
+        segment_start = 0
+        for edge in bounds:
+            if self._above:
+                self._region_max = max(
+                    self._region_max, np.max(mwi[segment_start:edge], initial=0.0)
+                )
+                if edge < len(mwi):
+                    self._close_region(start + edge, tail, tail_start)
+            elif edge < len(mwi):
+                self._region_start = start + edge
+                self._region_max = 0.0
+            if edge < len(mwi):
+                self._above = not self._above
+            segment_start = edge
+
+    def _close_region(self, end, tail, tail_start):
+        """Place the R-peak of the QRS region that ended at absolute index `end`."""
+        if end - self._region_start > self.max_region:
+            return
+        # The integrated signal lags the QRS by up to one window length
+        lo = max(self._region_start - self.mwi_len - tail_start, 0)
+        hi = max(end - tail_start, lo + 1)
+        peak = tail_start + lo + int(np.argmax(np.abs(tail[lo:hi])))
+        if self.peaks and peak - self.peaks[-1] < self.refractory:
+            return
+        self.peaks.append(peak)
+        self._spk = 0.125 * self._region_max + 0.875 * self._spk
+
+    def rpeaks(self, tsec):
+        """R-peak indices within the trailing tsec seconds."""
+        first = self.n_samples - int(tsec * self.sampling_rate)
+        return np.array([peak for peak in self.peaks if peak >= first])
+
+    def stats(self, tsec=60):
+        """
+        Compute HRV metrics from the R-peaks of the last tsec seconds.
+        Args:
+            - tsec: time window in seconds
+        Returns:
+            - dict with HRV metrics
+        """
+        return hrv_metrics(self.rpeaks(tsec), self.sampling_rate)
+
+
+def _segment_rpeaks(segment):
+    """
+    Detect R-peaks in one contiguous ECG segment (runs in a worker process).
+
+    Args:
+        - segment: (t0 in epoch ms, samples, number of leading warm-up samples,
+          sampling_rate)
+    Returns:
+        - array of R-peak times in epoch ms, excluding the warm-up
+    """
+    t0, samples, lead, sampling_rate = segment
+    engine = StreamingHRV(sampling_rate, history_sec=len(samples) / sampling_rate + 1)
+    engine.update(samples)
+    peaks = np.array(engine.peaks, dtype=float)
+    peaks = peaks[peaks >= lead]
+    return t0 + (peaks - lead) * (1000 / sampling_rate)
+
+
+def iter_segments(blocks, sampling_rate=200, segment_sec=600, warmup_sec=10):
+    """
+    Group streamed ECG blocks into contiguous segments for parallel R-peak detection.
+
+    Args:
+        - blocks: iterable of (sensor timestamps in ms, samples, epoch ms at which
+          the block was stored), e.g. crud_db.iter_ecg
+        - sampling_rate: ECG sampling rate in Hz
+        - segment_sec: length of each segment
+        - warmup_sec: samples of the previous segment prepended so detection is settled
+    Yields:
+        - (run id, segment) where run id changes after a sensor dropout or reboot
+          and segment is the argument of _segment_rpeaks, with t0 in epoch ms
+    """
+    max_gap_ms = 1000
+    segment_len = int(segment_sec * sampling_rate)
+    warmup_len = int(warmup_sec * sampling_rate)
+    run, t0, last_t, offset = 0, None, None, None
+    pending, lead = [], np.empty(0)
+
+    def emit():
+        samples = np.concatenate(pending)
+        return samples, (
+            run,
+            (t0, np.concatenate((lead, samples)), len(lead), sampling_rate),
+        )
+
+    for block_timestamps, block_samples, stored_at in blocks:
+        if len(block_samples) == 0:
+            continue
+        # Sensor time restarts at zero on a reboot, so going back ends a run too
+        steps = np.diff(block_timestamps)
+        cuts = np.flatnonzero((steps <= 0) | (steps > max_gap_ms)) + 1
+        for timestamps, samples in zip(
+            np.split(block_timestamps, cuts), np.split(block_samples, cuts)
+        ):
+            if last_t is not None and not 0 < timestamps[0] - last_t <= max_gap_ms:
+                # Flush and start a new run without warm-up from before the break
+                if pending:
+                    yield emit()[1]
+                run, pending, lead, t0 = run + 1, [], np.empty(0), None
+                offset = None
+            if offset is None:
+                # Sensor to wall-clock time for the whole run; blocks are
+                # stamped when stored, just after their last sample
+                offset = stored_at - block_timestamps[-1]
+            if t0 is None:
+                t0 = timestamps[0] + offset
+            pending.append(samples)
+            last_t = timestamps[-1]
+
+            if sum(len(p) for p in pending) >= segment_len:
+                segment_samples, item = emit()
+                yield item
+                lead = segment_samples[-warmup_len:]
+                t0 = last_t + offset + 1000 / sampling_rate
+                pending = []
+    if pending:
+        yield emit()[1]
+
+
+def windowed_rr(peak_times, runs, window_sec=60, step_sec=60):
+    """
+    Build a NaN-padded batch of RR series, one row per sliding window.
+
+    Args:
+        - peak_times: R-peak times in ms, sorted
+        - runs: run id of each peak; RR intervals are not taken across runs
+        - window_sec, step_sec: window length and hop
+    Returns:
+        - (window start times in ms, 2-D RR batch in ms)
+    """
+    rr = np.diff(peak_times)
+    rr[np.diff(runs) != 0] = np.nan
+    rr_end = peak_times[1:]
+
+    first = np.floor(peak_times[0] / (step_sec * 1000)) * step_sec * 1000
+    starts = np.arange(first, peak_times[-1], step_sec * 1000)
+    lo = np.searchsorted(rr_end, starts, side="left")
+    hi = np.searchsorted(rr_end, starts + window_sec * 1000, side="left")
+
+    width = int((hi - lo).max(initial=0))
+    columns = np.arange(width)
+    index = lo[:, None] + columns
+    inside = columns < (hi - lo)[:, None]
+    batch = np.where(inside, rr[np.minimum(index, len(rr) - 1)], np.nan)
+    return starts, batch
+
+
+def backfill_hrv(
+    sensor_db_path,
+    out_db_path,
+    window_sec=60,
+    step_sec=60,
+    sampling_rate=200,
+    workers=None,
+    min_beats=10,
+):
+    """
+    Recompute sliding-window HRV over an entire sensor recording.
+
+    ECG is streamed from the sensor database in segments, R-peaks are detected
+    in parallel across processes, and the metrics of every window are computed in
+    one vectorized rr_metrics call and bulk-written to the hrv_history table,
+    keyed on the wall-clock start of each window.
+
+    Args:
+        - sensor_db_path: sensor database with ecg_chunks or ecg_data
+        - out_db_path: database receiving the hrv_history rows
+        - window_sec, step_sec: window length and hop in seconds
+        - sampling_rate: ECG sampling rate in Hz
+        - workers: worker processes (defaults to the number of cores)
+        - min_beats: windows with fewer RR intervals are skipped
+    Returns:
+        - number of windows written
+    """
+    workers = workers or os.cpu_count()
+    peak_chunks, run_chunks = [], []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        segments = iter_segments(iter_ecg(sensor_db_path), sampling_rate)
+        for run, segment in segments:
+            in_flight.append((run, executor.submit(_segment_rpeaks, segment)))
+            # Bound the number of segments held in memory
+            while len(in_flight) > 2 * workers:
+                run_id, future = in_flight.popleft()
+                peak_chunks.append(future.result())
+                run_chunks.append(np.full(len(peak_chunks[-1]), run_id))
+        for run_id, future in in_flight:
+            peak_chunks.append(future.result())
+            run_chunks.append(np.full(len(peak_chunks[-1]), run_id))
+
+    if not peak_chunks:
+        return 0
+    peak_times, runs = np.concatenate(peak_chunks), np.concatenate(run_chunks)
+    # Runs without a readable system time cannot be placed on the wall clock
+    placed = np.isfinite(peak_times)
+    peak_times, runs = peak_times[placed], runs[placed]
+    if len(peak_times) < 2:
+        return 0
+    order = np.argsort(peak_times, kind="stable")
+    starts, batch = windowed_rr(peak_times[order], runs[order], window_sec, step_sec)
+    n_beats = (~np.isnan(batch)).sum(axis=1)
+    keep = n_beats >= min_beats
+    metrics = rr_metrics(batch[keep])
+
+    rows = zip(
+        (starts[keep] // 1000).astype(int).tolist(),
+        [window_sec] * int(keep.sum()),
+        n_beats[keep].tolist(),
+        *(
+            metrics[key].tolist()
+            for key in (
+                "mean_rr",
+                "sdnn",
+                "rmssd",
+                "pnn50",
+                "pnn30",
+                "pnn20",
+                "lf",
+                "hf",
+                "lf_hf",
+                "hr",
+            )
+        ),
+    )
+    create_table(out_db_path)
+    push_hrv_history(out_db_path, list(rows))
+    return int(keep.sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute sliding-window HRV over a full sensor_data.db recording."
+    )
+    parser.add_argument("sensor_db", nargs="?", default="sensor_data.db")
+    parser.add_argument(
+        "--out", default="task.db", help="database to write hrv_history to"
+    )
+    parser.add_argument(
+        "--window", type=int, default=60, help="window length in seconds"
+    )
+    parser.add_argument("--step", type=int, default=60, help="window hop in seconds")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    count = backfill_hrv(
+        args.sensor_db, args.out, args.window, args.step, workers=args.workers
+    )
+    print(f"Wrote {count} HRV windows to '{args.out}' in {time.time() - start:.1f} s.")
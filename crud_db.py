@@ -1,164 +1,660 @@
 import csv
+import time
+import queue
 import sqlite3
+import threading
+from datetime import datetime
+from itertools import groupby
+from contextlib import contextmanager
+
+import numpy as np
+
+ECG_SAMPLING_RATE = 200  # Hz
+# Trailing ECG window (ms) for each fetch_ecg instance
+ECG_WINDOWS_MS = {"short": 60000, "long": 180000}
+
+
+HRV_HISTORY_COLUMNS = (
+    "window_start",
+    "window_sec",
+    "n_beats",
+    "mean_rr",
+    "sdnn",
+    "rmssd",
+    "pnn50",
+    "pnn30",
+    "pnn20",
+    "lf",
+    "hf",
+    "lf_hf",
+    "heart_rate",
+)
+CREATE_HRV_HISTORY_TABLE = """
+CREATE TABLE IF NOT EXISTS hrv_history (
+    window_start INTEGER,  -- Unix epoch seconds at the start of the window
+    window_sec INTEGER,
+    n_beats INTEGER,
+    mean_rr REAL,
+    sdnn REAL,
+    rmssd REAL,
+    pnn50 REAL,
+    pnn30 REAL,
+    pnn20 REAL,
+    lf REAL,
+    hf REAL,
+    lf_hf REAL,
+    heart_rate REAL,
+    PRIMARY KEY (window_start, window_sec)
+);
+"""
+
+CREATE_TRANSCRIPT_TABLE = """
+CREATE TABLE IF NOT EXISTS transcript (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_time REAL NOT NULL,  -- Unix epoch seconds
+    end_time REAL NOT NULL,
+    text TEXT
+);
+"""
+CREATE_TRANSCRIPT_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_transcript_start_time ON transcript (start_time);"
+)
+
+
+class ConnectionManager:
+    """
+    Long-lived connections to one SQLite database file: a single writer
+    connection serialised by a lock, and a small pool of reader connections.
+
+    The database is switched to WAL so readers never block the writer (or each
+    other), and every connection keeps its own prepared-statement cache, so
+    repeated queries skip the SQL compile step.
+    """
+
+    def __init__(self, db_path, max_readers=4, cached_statements=256):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.cached_statements = cached_statements
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA synchronous=NORMAL;")
+        return connection
+
+    @contextmanager
+    def writer(self):
+        """Yield the writer connection; commits on success and rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Yield a pooled reader connection, opening one if the pool is not full."""
+        try:
+            connection = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self.max_readers
+                if create:
+                    self._reader_count += 1
+            connection = self._connect() if create else self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    def execute(self, query, params=()):
+        """Run one write statement."""
+        with self.writer() as connection:
+            connection.execute(query, params)
+
+    def executemany(self, query, rows):
+        """Run one write statement for every row, in a single transaction."""
+        with self.writer() as connection:
+            connection.executemany(query, rows)
+
+    def fetchall(self, query, params=()):
+        """Run a read query and return all rows."""
+        with self.reader() as connection:
+            return connection.execute(query, params).fetchall()
 
 
-def get_live_timetable(db_lock, db_path):
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path):
+    """Return the process-wide ConnectionManager for a database file."""
+    with _managers_lock:
+        if db_path not in _managers:
+            _managers[db_path] = ConnectionManager(db_path)
+        return _managers[db_path]
+
+
+def _start_of_today():
+    """Unix epoch seconds of the most recent local midnight."""
+    now = time.localtime()
+    return int(time.mktime((now.tm_year, now.tm_mon, now.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+
+def stress_level(pnn50):
+    """Stress level from pNN50, "unknown" when there is no HRV data (None or NaN)."""
+    if pnn50 is None or pnn50 != pnn50:
+        return "unknown"
+    return "high" if pnn50 < 20 else "moderate" if 20 <= pnn50 < 50 else "low"
+
+
+def get_live_timetable(db_path, since=None):
+    """
+    Fetches the timetable rows starting at or after `since` and formats them as CSV.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        since (int): Unix epoch seconds, defaults to the start of today.
+    """
     table = read_from_table(
-        db_lock,
-        "SELECT time_interval, Desk_Work, Commuting, Eating, In_Meeting FROM timetable",
+        "SELECT time_interval, Desk_Work, Commuting, Eating, In_Meeting FROM timetable "
+        "WHERE start_time >= ? ORDER BY start_time",
         db_path,
+        (_start_of_today() if since is None else since,),
     )
     header = "time_interval,Desk_Work,Commuting,Eating,In_Meeting\n"
-    rows = [",".join(map(str, row)) for row in table]
+    rows = [",".join(map(str, row)) for row in table or []]
 
     return header + "\n".join(rows)
 
 
-def get_timetable_w_stress_lvl(db_path):
-    """Fetches timetable data from the database, calculates stress level, and formats it as CSV."""
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
+TIMETABLE_STRESS_HEADER = (
+    "time_interval,Desk_Work,Commuting,Eating,In_Meeting,stress_level\n"
+)
+
+
+def _timetable_stress_line(row):
+    """CSV line of a (time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50) row."""
+    time_interval, desk_work, commuting, eating, in_meeting, pnn50 = row
+    level = stress_level(pnn50)
+    return f"{time_interval},{desk_work},{commuting},{eating},{in_meeting},{level}"
+
+
+def get_timetable_w_stress_lvl(db_path, since=None):
+    """
+    Fetches timetable data from the database, calculates stress level, and formats it as CSV.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        since (int): Unix epoch seconds, defaults to the start of today.
+    """
+    tables = get_connection_manager(db_path).fetchall(
+        "SELECT time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50 FROM timetable "
+        "WHERE start_time >= ? ORDER BY start_time",
+        (_start_of_today() if since is None else since,),
+    )
+
+    rows = [_timetable_stress_line(row) for row in tables]
+    return TIMETABLE_STRESS_HEADER + "\n".join(rows)
+
+
+def get_timetable_last_id(db_path):
+    """Id of the newest timetable row, 0 if there is none; an index-only lookup."""
+    rows = read_from_table("SELECT MAX(id) FROM timetable;", db_path)
+    return (rows[0][0] or 0) if rows else 0
+
+
+def get_timetable_stress_lines(db_path, after_id=0, since=None):
+    """
+    Timetable rows added after `after_id`, for refreshing a cached
+    get_timetable_w_stress_lvl result incrementally.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        after_id (int): Id of the last row already seen.
+        since (int): Unix epoch seconds, defaults to the start of today.
+
+    Returns:
+        tuple: (id of the last row returned or `after_id`, list of CSV lines
+               without the header)
+    """
+    rows = get_connection_manager(db_path).fetchall(
+        "SELECT id, time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50 "
+        "FROM timetable WHERE id > ? AND start_time >= ? ORDER BY id",
+        (after_id, _start_of_today() if since is None else since),
+    )
+    if not rows:
+        return after_id, []
+    return rows[-1][0], [_timetable_stress_line(row[1:]) for row in rows]
+
+
+def _table_columns(cursor, table):
+    """Column names of a table, empty if it does not exist."""
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table});")]
+
+
+# Numeric text from the legacy VARCHAR columns, NULL for "No data" and the like
+_LEGACY_REAL = (
+    "CASE WHEN {0} GLOB '*[0-9]*' AND {0} NOT GLOB '*[^0-9.eE+-]*' "
+    "THEN CAST({0} AS REAL) END"
+)
+
+
+def _local_time_at_or_after(hour, minute, bound):
+    """Unix epoch seconds of the first local `hour`:`minute` at or after `bound`."""
+    day = time.localtime(bound)
+    for offset in (0, 1):
+        moment = time.mktime(
+            (day.tm_year, day.tm_mon, day.tm_mday + offset, hour, minute, 0, 0, 0, -1)
+        )
+        if moment >= bound:
+            break
+    return int(moment)
+
+
+def _legacy_interval_times(intervals, anchor):
+    """
+    Start and end of legacy "HH:MM - HH:MM" timetable intervals.
+
+    The legacy tables were dropped on every start, so all rows belong to the
+    session whose first vision frame was at `anchor`. The first interval is
+    placed at the latest matching time before it, each following one at the
+    first matching time after the previous start (a day later after midnight).
+
+    Args:
+        intervals (list): time_interval strings in insertion order.
+        anchor (int): Unix epoch seconds of the first legacy vision frame.
+
+    Returns:
+        list: (start_time, end_time) per interval, (None, None) if unparseable.
+    """
+    times = []
+    # Minutes are truncated, so the first start may read up to a minute late
+    previous = anchor + 60 - 24 * 3600
+    for interval in intervals:
+        try:
+            start, end = (
+                tuple(int(part) for part in bound.strip().split(":"))
+                for bound in interval.split(" - ")
+            )
+            start_time = _local_time_at_or_after(*start, previous)
+            end_time = _local_time_at_or_after(*end, start_time)
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            times.append((None, None))
+            continue
+        times.append((start_time, end_time))
+        previous = start_time
+    return times
+
+
+def _migrate_v1(cursor):
+    """
+    Typed columns, integer epoch timestamps and time indexes. Rows of the
+    legacy VARCHAR vision and timetable tables are converted and kept.
+    """
+    legacy_vision = bool(_table_columns(cursor, "vision"))
+    legacy_timetable = bool(_table_columns(cursor, "timetable"))
+    if legacy_vision:
+        cursor.execute("ALTER TABLE vision RENAME TO vision_legacy;")
+    if legacy_timetable:
+        cursor.execute("ALTER TABLE timetable RENAME TO timetable_legacy;")
+
+    cursor.execute(
+        """
+        CREATE TABLE vision (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL,  -- Unix epoch seconds
+            image_desp TEXT,
+            activity TEXT,
+            activity_class TEXT,
+            criticality TEXT,
+            surrounding TEXT
+        );
+        """
+    )
+    cursor.execute("CREATE INDEX idx_vision_timestamp ON vision (timestamp);")
+
     cursor.execute(
-        "SELECT time_interval, Desk_Work, Commuting, Eating, In_Meeting, pnn50 FROM timetable"
+        """
+        CREATE TABLE timetable (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_time INTEGER,  -- Unix epoch seconds
+            end_time INTEGER,
+            time_interval TEXT,
+            Desk_Work INTEGER,
+            Commuting INTEGER,
+            Eating INTEGER,
+            In_Meeting INTEGER,
+            pNN50 REAL,
+            heart_rate REAL
+        );
+        """
     )
-    tables = cursor.fetchall()
-
-    header = "time_interval,Desk_Work,Commuting,Eating,In_Meeting,stress_level\n"
-    rows = []
-    for row in tables:
-        time_interval, desk_work, commuting, eating, in_meeting, pnn50 = row
-        stress_level = (
-            "high" if pnn50 < 20 else "moderate" if 20 <= pnn50 < 50 else "low"
+    cursor.execute("CREATE INDEX idx_timetable_start_time ON timetable (start_time);")
+
+    if legacy_vision:
+        # Legacy timestamps are str(datetime) in local time
+        cursor.execute(
+            """
+            INSERT INTO vision (timestamp, image_desp, activity, activity_class, criticality, surrounding)
+            SELECT CAST(strftime('%s', timestamp, 'utc') AS INTEGER), image_desp, activity,
+                   activity_class, criticality, surrounding
+            FROM vision_legacy WHERE strftime('%s', timestamp, 'utc') IS NOT NULL;
+            """
         )
-        rows.append(
-            f"{time_interval},{desk_work},{commuting},{eating},{in_meeting},{stress_level}"
+        cursor.execute("DROP TABLE vision_legacy;")
+    if legacy_timetable:
+        cursor.execute(
+            f"""
+            INSERT INTO timetable (time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50, heart_rate)
+            SELECT time_interval, CAST(Desk_Work AS INTEGER), CAST(Commuting AS INTEGER),
+                   CAST(Eating AS INTEGER), CAST(In_Meeting AS INTEGER),
+                   {_LEGACY_REAL.format("pNN50")}, {_LEGACY_REAL.format("heart_rate")}
+            FROM timetable_legacy ORDER BY rowid;
+            """
         )
+        cursor.execute("DROP TABLE timetable_legacy;")
+        # Legacy intervals are "HH:MM - HH:MM" without a date; it is taken from
+        # the vision frames of the same session. Rows left without a start time
+        # (no legacy frames, unparseable interval) are kept but, like any row
+        # with a NULL start_time, never match the since-bounded readers
+        anchor = cursor.execute("SELECT MIN(timestamp) FROM vision;").fetchone()[0]
+        if anchor is not None:
+            rows = cursor.execute(
+                "SELECT id, time_interval FROM timetable ORDER BY id;"
+            ).fetchall()
+            times = _legacy_interval_times([row[1] for row in rows], anchor)
+            cursor.executemany(
+                "UPDATE timetable SET start_time = ?, end_time = ? WHERE id = ?;",
+                [(start, end, row[0]) for row, (start, end) in zip(rows, times)],
+            )
 
-    return header + "\n".join(rows)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS hrv_data (
+            mean_rr REAL,
+            pnn50 REAL,
+            pnn30 REAL,
+            pnn20 REAL,
+            heart_rate REAL
+        );
+        """
+    )
+    cursor.execute("ALTER TABLE hrv_data ADD COLUMN timestamp INTEGER;")
+    cursor.execute("CREATE INDEX idx_hrv_data_timestamp ON hrv_data (timestamp);")
+
+    cursor.execute(CREATE_HRV_HISTORY_TABLE)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT
+        );
+        """
+    )
+
+
+def _migrate_v2(cursor):
+    """
+    Record which path produced each vision row's ACS ("llm", "vlm" or "local"),
+    so the local classifier only trains on model labels. NULL rows predate it.
+    """
+    cursor.execute("ALTER TABLE vision ADD COLUMN acs_source TEXT;")
+
+
+def _migrate_v3(cursor):
+    """Rolling transcript of the audio pipeline, one row per timestamped segment."""
+    cursor.execute(CREATE_TRANSCRIPT_TABLE)
+    cursor.execute(CREATE_TRANSCRIPT_INDEX)
+
+
+def _migrate_v4(cursor):
+    """
+    hrv_history windows start at wall-clock (epoch) seconds instead of
+    boot-relative sensor ms. Earlier rows cannot be converted and are dropped;
+    re-run the biostats batch mode to recompute them.
+    """
+    cursor.execute("DELETE FROM hrv_history;")
+
+
+# Applied in order; PRAGMA user_version records how many have run
+SCHEMA_MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4]
 
 
 def create_table(db_path):
     """
-    Creates necessary tables in the SQLite database.
+    Creates the tables, or brings an existing database up to the latest schema.
+    Pending migrations run in one transaction and existing rows are kept.
 
     Args:
         db_path (str): Path to the SQLite database file.
     """
     try:
-        with sqlite3.connect(db_path) as connection:
+        with get_connection_manager(db_path).writer() as connection:
             cursor = connection.cursor()
+            version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+            if version >= len(SCHEMA_MIGRATIONS):
+                return
+
+            cursor.execute("BEGIN;")
+            for number in range(version, len(SCHEMA_MIGRATIONS)):
+                SCHEMA_MIGRATIONS[number](cursor)
+                cursor.execute(f"PRAGMA user_version = {number + 1};")
+            print(
+                f"Database '{db_path}' migrated to schema version {len(SCHEMA_MIGRATIONS)}."
+            )
 
-            cursor.execute("DROP TABLE IF EXISTS vision;")
-            cursor.execute("DROP TABLE IF EXISTS timetable;")
-
-            create_image_query = """
-            CREATE TABLE vision (
-                timestamp VARCHAR(255),
-                image_desp VARCHAR(255),
-                activity VARCHAR(255),
-                activity_class VARCHAR(255),
-                criticality VARCHAR(255),
-                surrounding VARCHAR(255)
-            );
-            """
-            cursor.execute(create_image_query)
-
-            create_live_timetable = """
-            CREATE TABLE timetable(
-                time_interval VARCHAR(255),
-                Desk_Work VARCHAR(255),
-                Commuting VARCHAR(255),
-                Eating VARCHAR(255),
-                In_Meeting VARCHAR(255),
-                pNN50 VARCHAR(255),
-                heart_rate VARCHAR(255)
-            );
-            """
-            cursor.execute(create_live_timetable)
-
-            create_ecg_query = """
-            CREATE TABLE IF NOT EXISTS hrv_data (
-                mean_rr REAL,
-                pnn50 REAL,
-                pnn30 REAL,
-                pnn20 REAL,
-                heart_rate REAL
-            );
-            """
-            cursor.execute(create_ecg_query)
+    except Exception as e:
+        print(f"An error occurred: {e}")
 
-            create_task_table = """
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                task TEXT
-            );
-            """
-            cursor.execute(create_task_table)
 
+def fetch_ecg(db_path, instance, storage="auto"):
+    """
+    Fetch the most recent ECG window from the sensor database.
+
+    Args:
+        db_path (str): Path to the sensor SQLite database.
+        instance (str): "short" (last 60 s) or "long" (last 180 s).
+        storage (str): "chunks", "rows" or "auto" to use ecg_chunks when it has data.
+
+    Returns:
+        np.ndarray: ECG samples in mV, oldest first (empty on error).
+    """
+    window_ms = ECG_WINDOWS_MS[instance]
+    try:
+        with get_connection_manager(db_path).reader() as connection:
+            cursor = connection.cursor()
+            if storage == "auto":
+                storage = "chunks" if _has_ecg_chunks(cursor) else "rows"
+
+            if storage == "chunks":
+                # Newest chunks first by rowid (insertion order), since sensor
+                # time restarts after a device reboot; rows are stepped lazily
+                window_samples = int(window_ms * ECG_SAMPLING_RATE / 1000)
+                cursor.execute("SELECT samples FROM ecg_chunks ORDER BY rowid DESC;")
+                chunks, n_samples = [], 0
+                for (blob,) in cursor:
+                    chunks.append(np.frombuffer(blob, dtype="<f4"))
+                    n_samples += len(chunks[-1])
+                    if n_samples >= window_samples:
+                        break
+                if not chunks:
+                    return np.empty(0)
+                samples = np.concatenate(chunks[::-1]).astype(np.float64)
+                # Chunks start up to one chunk before the window, trim to its length
+                return samples[-window_samples:]
+
+            query = """
+            SELECT value FROM ecg_data
+            WHERE timestamp_sensor >= (SELECT MAX(timestamp_sensor) FROM ecg_data) - ?
+            ORDER BY timestamp_sensor;
+            """
+            cursor.execute(query, (window_ms,))
+            return np.fromiter((row[0] for row in cursor), dtype=np.float64)
     except Exception as e:
         print(f"An error occurred: {e}")
+        return np.empty(0)
 
 
-def fetch_ecg(db_path, instance):
-    """Fetch ECG data from the database."""
-    if instance == "short":
-        try:
-            with sqlite3.connect(db_path) as connection:
-                cursor = connection.cursor()
-                query = """
-                SELECT * FROM ecg_data 
-                WHERE timestamp_sensor >= (SELECT MAX(timestamp_sensor) FROM ecg_data) - 60000
-                AND timestamp_sensor <= (SELECT MAX(timestamp_sensor) FROM ecg_data);
-                """
-                cursor.execute(query)
-                return cursor.fetchall()
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return []
-
-    elif instance == "long":
-        try:
-            with sqlite3.connect(db_path) as connection:
-                cursor = connection.cursor()
-                query = """
-                SELECT * FROM ecg_data 
-                WHERE timestamp_sensor >= (SELECT MAX(timestamp_sensor) FROM ecg_data) - 180000
-                AND timestamp_sensor <= (SELECT MAX(timestamp_sensor) FROM ecg_data);
-                """
-                cursor.execute(query)
-                return cursor.fetchall()
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return []
-
-
-def read_from_table(db_lock, query, db_path):
-    """Thread-safe function to read data from the database."""
-    with db_lock:
-        try:
-            with sqlite3.connect(db_path) as connection:
-                cursor = connection.cursor()
-                cursor.execute(query)
-                results = cursor.fetchall()
-                return results
-        except Exception as e:
-            print(f"An error occurred while reading data: {e}")
-            return None
+def _has_ecg_chunks(cursor):
+    """Check whether the sensor database has chunked ECG data."""
+    try:
+        cursor.execute("SELECT 1 FROM ecg_chunks LIMIT 1;")
+    except sqlite3.OperationalError:
+        return False
+    return cursor.fetchone() is not None
+
+
+def _epoch_ms(timestamp_system):
+    """Unix epoch ms of a sensor-database system timestamp, NaN if it is unreadable."""
+    try:
+        return datetime.fromisoformat(timestamp_system).timestamp() * 1000
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def iter_ecg(db_path, storage="auto", batch_rows=5000):
+    """
+    Stream the whole ECG recording from the sensor database in insertion order.
+    Sensor time restarts at zero when the device reboots, so it is not sorted
+    across sessions; iter_segments splits the runs.
+
+    Args:
+        db_path (str): Path to the sensor SQLite database.
+        storage (str): "chunks", "rows" or "auto" to use ecg_chunks when it has data.
+        batch_rows (int): Rows fetched from the database at a time.
+
+    Yields:
+        tuple: (sensor timestamps in ms, ECG samples in mV as NumPy arrays,
+                Unix epoch ms at which the block was stored or NaN).
+    """
+    with get_connection_manager(db_path).reader() as connection:
+        cursor = connection.cursor()
+        if storage == "auto":
+            storage = "chunks" if _has_ecg_chunks(cursor) else "rows"
+
+        if storage == "chunks":
+            cursor.execute(
+                "SELECT timestamp_sensor, timestamp_end, timestamp_system, samples "
+                "FROM ecg_chunks ORDER BY rowid;"
+            )
+            while rows := cursor.fetchmany(batch_rows):
+                for start, end, stored_at, blob in rows:
+                    samples = np.frombuffer(blob, dtype="<f4").astype(np.float64)
+                    timestamps = np.linspace(start, end, len(samples))
+                    yield timestamps, samples, _epoch_ms(stored_at)
+        else:
+            cursor.execute(
+                "SELECT timestamp_system, timestamp_sensor, value FROM ecg_data ORDER BY rowid;"
+            )
+            while rows := cursor.fetchmany(batch_rows):
+                # The rows of one flush share their system timestamp
+                for stored_at, group in groupby(rows, key=lambda row: row[0]):
+                    block = np.array([row[1:] for row in group], dtype=np.float64)
+                    yield block[:, 0], block[:, 1], _epoch_ms(stored_at)
+
+
+def push_hrv_history(db_path, rows):
+    """
+    Bulk-write windowed HRV metrics, replacing earlier results for the same windows.
+    The hrv_history table comes from create_table, which must have run first.
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        rows (list): Tuples in HRV_HISTORY_COLUMNS order.
+    """
+    query = f"""
+    INSERT OR REPLACE INTO hrv_history ({", ".join(HRV_HISTORY_COLUMNS)})
+    VALUES ({", ".join("?" * len(HRV_HISTORY_COLUMNS))});
+    """
+    try:
+        with get_connection_manager(db_path).writer() as connection:
+            connection.executemany(query, rows)
+    except Exception as e:
+        print(f"An error occurred while inserting data: {e}")
+
+
+def push_transcript(db_path, segments):
+    """
+    Append transcript segments. The transcript table comes from create_table,
+    which must have run first.
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        segments (list): (start_time, end_time, text) tuples, epoch seconds.
+    """
+    try:
+        with get_connection_manager(db_path).writer() as connection:
+            connection.executemany(
+                "INSERT INTO transcript (start_time, end_time, text) VALUES (?, ?, ?);",
+                segments,
+            )
+    except Exception as e:
+        print(f"An error occurred while inserting data: {e}")
+
 
+def get_transcript(db_path, since=None):
+    """
+    Transcript segments starting at or after `since`.
 
-def push_to_table(db_lock, query, params, db_path):
+    Args:
+        db_path (str): Path to the SQLite database file.
+        since (float): Unix epoch seconds, defaults to the start of today.
+
+    Returns:
+        list: (start_time, end_time, text) rows in time order.
+    """
+    return (
+        read_from_table(
+            "SELECT start_time, end_time, text FROM transcript "
+            "WHERE start_time >= ? ORDER BY start_time;",
+            db_path,
+            (_start_of_today() if since is None else since,),
+        )
+        or []
+    )
+
+
+def read_from_table(query, db_path, params=()):
+    """Read data from the database through a pooled reader connection."""
+    try:
+        return get_connection_manager(db_path).fetchall(query, params)
+    except Exception as e:
+        print(f"An error occurred while reading data: {e}")
+        return None
+
+
+def push_to_table(query, params, db_path):
     """Thread-safe function to push data to the database."""
-    with db_lock:
-        try:
-            with sqlite3.connect(db_path) as connection:
-                cursor = connection.cursor()
-                cursor.execute(query, params)
-                connection.commit()
-        except Exception as e:
-            print(f"An error occurred while inserting data: {e}")
+    try:
+        get_connection_manager(db_path).execute(query, params)
+    except Exception as e:
+        print(f"An error occurred while inserting data: {e}")
 
 
-def input_csv(db_lock, db_path):
+def push_many_to_table(query, rows, db_path):
+    """Thread-safe function to push a batch of rows to the database in one transaction."""
+    try:
+        get_connection_manager(db_path).executemany(query, rows)
+    except Exception as e:
+        print(f"An error occurred while inserting data: {e}")
+
+
+def input_csv(db_path):
     """
     Reads data from the 'input.csv' file and inserts it into the 'timetable' table in the database.
     For testing purposes.
@@ -184,24 +680,26 @@ def input_csv(db_lock, db_path):
             # Prepare the SQL query for insertion
             query = """
             INSERT INTO timetable (
-                time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50, heart_rate
-            ) VALUES (?, ?, ?, ?, ?, ?, ?);
+                start_time, time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50, heart_rate
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?);
             """
 
-            # Iterate through rows in the CSV file and insert them into the database
-            for row in reader:
-                params = (
+            # Collect the rows in the CSV file and insert them in one batch
+            start_time = int(time.time())
+            rows = [
+                (
+                    start_time,
                     row["time_interval"],
-                    row["Desk_Work"],
-                    row["Commuting"],
-                    row["Eating"],
-                    row["In_Meeting"],
-                    "No data",
-                    "No data",
+                    int(row["Desk_Work"]),
+                    int(row["Commuting"]),
+                    int(row["Eating"]),
+                    int(row["In_Meeting"]),
+                    None,
+                    None,
                 )
-
-                # Push data to the database using the utility function
-                push_to_table(db_lock, query, params, db_path)
+                for row in reader
+            ]
+            push_many_to_table(query, rows, db_path)
 
         print(
             "Data from the CSV file has been successfully inserted into the 'timetable' table."
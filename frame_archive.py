@@ -0,0 +1,235 @@
+"""
+Background archiver for the JPEG frames the vision pipeline uploads.
+
+The capture loop hands over the already-encoded buffers through a bounded queue
+and a worker thread writes them to disk, either one file per frame or packed
+into append-only segment files with a fixed-size index, and removes the oldest
+archive files once the archive grows past a size or age limit.
+"""
+
+import os
+import time
+import queue
+import struct
+import threading
+
+ARCHIVE_QUEUE_SIZE = 32
+ARCHIVE_MAX_BYTES = 2 * 1024**3
+ARCHIVE_MAX_AGE = 7 * 24 * 3600
+SEGMENT_MAX_BYTES = 64 * 1024**2
+SEGMENT_MAX_AGE = 3600
+PRUNE_INTERVAL = 60
+CLOSE_TIMEOUT = 30
+
+# Index record per frame: frame number, capture time, offset and length in the segment
+INDEX_RECORD = struct.Struct("<qdqq")
+# Local capture time in archive file names
+NAME_TIME_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def _name_time(path):
+    """Capture time in an archive file name, None for names without one."""
+    parts = os.path.basename(path).split("_")
+    try:
+        return time.mktime(time.strptime("_".join(parts[1:3]), NAME_TIME_FORMAT))
+    except ValueError:
+        return None
+
+
+class FrameArchiver:
+    """
+    Writes encoded frames on a worker thread so disk I/O stays off the capture path.
+
+    With `segments=False` every frame becomes `<stream>/frame_<time>_<n>.jpg`. With
+    `segments=True` frames are appended to `<stream>/segment_<time>_<n>.bin`, and an
+    INDEX_RECORD per frame goes to the matching `.idx` file; a segment is closed
+    once it reaches `segment_bytes` or `segment_age` seconds. <time> is the local
+    capture time of the (first) frame, so runs, whose frame numbers restart at 1,
+    never overwrite each other. Either way the oldest files of a stream, by that
+    time, are deleted while the stream holds more than `max_bytes` or they are
+    older than `max_age`.
+
+    When the queue is full a frame is dropped rather than blocking the caller.
+    """
+
+    def __init__(
+        self,
+        root=".",
+        segments=False,
+        max_bytes=ARCHIVE_MAX_BYTES,
+        max_age=ARCHIVE_MAX_AGE,
+        segment_bytes=SEGMENT_MAX_BYTES,
+        segment_age=SEGMENT_MAX_AGE,
+        queue_size=ARCHIVE_QUEUE_SIZE,
+    ):
+        self.root = root
+        self.segments = segments
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.open_segments = {}  # stream -> (data file, index file, start time)
+        self.streams = set()
+        self.written = 0
+        self.dropped = 0
+        self.last_prune = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, stream, frame_number, timestamp, buffer):
+        """
+        Queue an encoded frame for writing.
+
+        Args:
+            stream (str): Sub-directory of the archive, e.g. "frames".
+            frame_number (int): Tick number of the frame.
+            timestamp (float): Epoch time of the capture.
+            buffer (np.ndarray | bytes): Encoded JPEG, written as is.
+
+        Returns:
+            bool: False if the queue was full and the frame was dropped.
+        """
+        try:
+            self.queue.put_nowait((stream, frame_number, timestamp, buffer))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Write out the queued frames, close open segments and stop the worker.
+
+        Args:
+            timeout (float): Seconds to wait for the queue to accept the stop
+                             marker and again for the worker to finish; frames
+                             still queued after that are abandoned.
+        """
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            print(f"Frame archive queue still full after {timeout} s, not waiting")
+            return
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            print(f"Frame archiver still writing after {timeout} s, not waiting")
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+                self.written += 1
+                if time.time() - self.last_prune > PRUNE_INTERVAL:
+                    self._prune()
+            except Exception as e:
+                # Keep the worker alive, or the queue fills up and close() waits
+                print(f"Error archiving frame {item[1]} of {item[0]}: {e}")
+        for data_file, index_file, _ in self.open_segments.values():
+            data_file.close()
+            index_file.close()
+        self.open_segments.clear()
+
+    def _write(self, stream, frame_number, timestamp, buffer):
+        directory = os.path.join(self.root, stream)
+        if stream not in self.streams:
+            os.makedirs(directory, exist_ok=True)
+            self.streams.add(stream)
+        data = memoryview(buffer).cast("B")
+        if not self.segments:
+            captured = time.strftime(NAME_TIME_FORMAT, time.localtime(timestamp))
+            path = os.path.join(directory, f"frame_{captured}_{frame_number:04d}.jpg")
+            with open(path, "wb") as f:
+                f.write(data)
+            return
+
+        data_file, index_file, started = self._segment(
+            stream, directory, frame_number, timestamp
+        )
+        offset = data_file.tell()
+        data_file.write(data)
+        data_file.flush()
+        # The index is written last so every record points at complete data
+        index_file.write(INDEX_RECORD.pack(frame_number, timestamp, offset, len(data)))
+        index_file.flush()
+        if (
+            offset + len(data) >= self.segment_bytes
+            or timestamp - started >= self.segment_age
+        ):
+            data_file.close()
+            index_file.close()
+            del self.open_segments[stream]
+
+    def _segment(self, stream, directory, frame_number, timestamp):
+        if stream not in self.open_segments:
+            started = time.strftime(NAME_TIME_FORMAT, time.localtime(timestamp))
+            name = f"segment_{started}_{frame_number:04d}"
+            base = os.path.join(directory, name)
+            self.open_segments[stream] = (
+                open(base + ".bin", "ab"),
+                open(base + ".idx", "ab"),
+                timestamp,
+            )
+        return self.open_segments[stream]
+
+    def _prune(self):
+        self.last_prune = time.time()
+        open_paths = {
+            os.path.abspath(f.name)
+            for files in self.open_segments.values()
+            for f in files[:2]
+        }
+        for stream in self.streams:
+            directory = os.path.join(self.root, stream)
+            # A segment's .bin and .idx are one unit, so they go together
+            units = {}
+            for entry in os.scandir(directory):
+                base, extension = os.path.splitext(entry.path)
+                if entry.is_file() and extension in (".jpg", ".bin", ".idx"):
+                    key = entry.path if extension == ".jpg" else base
+                    units.setdefault(key, []).append((entry.path, entry.stat()))
+            files = []
+            for key, paths in units.items():
+                # Capture time of the (first) frame; files named before it was
+                # in the name fall back to their modification time
+                captured = _name_time(key)
+                if captured is None:
+                    captured = max(stat.st_mtime for _, stat in paths)
+                size = sum(stat.st_size for _, stat in paths)
+                files.append((captured, key, size, [path for path, _ in paths]))
+            files.sort()
+            total = sum(size for _, _, size, _ in files)
+            for captured, _, size, paths in files:
+                if (
+                    total <= self.max_bytes
+                    and self.last_prune - captured <= self.max_age
+                ):
+                    break
+                if any(os.path.abspath(path) in open_paths for path in paths):
+                    continue
+                for path in paths:
+                    os.remove(path)
+                total -= size
+
+
+def read_segment(path):
+    """
+    Iterate over the frames of a segment written by FrameArchiver.
+
+    Args:
+        path (str): Path of the `.bin` segment; its `.idx` file must sit next to it.
+
+    Yields:
+        tuple: (frame number, capture time, encoded JPEG bytes)
+    """
+    with open(os.path.splitext(path)[0] + ".idx", "rb") as index_file:
+        index = index_file.read()
+    with open(path, "rb") as data_file:
+        for frame_number, timestamp, offset, length in INDEX_RECORD.iter_unpack(
+            index[: len(index) - len(index) % INDEX_RECORD.size]
+        ):
+            data_file.seek(offset)
+            yield frame_number, timestamp, data_file.read(length)
@@ -0,0 +1,178 @@
+"""
+Frame preprocessing before VLM upload: crop to the active window or to the
+region that changed, downscale to a max side and pick the JPEG quality that
+fits a byte budget.
+"""
+
+import sys
+
+import cv2
+import numpy as np
+
+# Upload limits per stream
+SCREEN_MAX_SIDE = 1568
+SCREEN_BYTE_BUDGET = 300_000
+WEBCAM_MAX_SIDE = 768
+WEBCAM_BYTE_BUDGET = 80_000
+JPEG_QUALITY_RANGE = (40, 90)
+
+
+def resize_max_side(frame, max_side):
+    """
+    Downscale a frame so that its longer side is at most `max_side` pixels.
+
+    Args:
+        frame (np.ndarray): Image.
+        max_side (int): Longest side allowed; None keeps the frame as is.
+
+    Returns:
+        np.ndarray: The frame, resized with area interpolation if it was larger.
+    """
+    height, width = frame.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return frame
+    scale = max_side / max(height, width)
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg(frame, byte_budget=None, quality_range=JPEG_QUALITY_RANGE):
+    """
+    JPEG-encode a frame at the highest quality that fits the byte budget.
+
+    Binary search over the quality range; if even the lowest quality is over
+    budget that encoding is returned anyway.
+
+    Args:
+        frame (np.ndarray): BGR or BGRA image.
+        byte_budget (int): Maximum size of the encoded image; None uses the
+                           top of the quality range.
+        quality_range (tuple): (lowest, highest) JPEG quality to consider.
+
+    Returns:
+        tuple: (encoded buffer as np.ndarray of uint8, quality used)
+    """
+    if frame.ndim == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    low, high = quality_range
+
+    def encode(quality):
+        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer
+
+    best = encode(high)
+    if byte_budget is None or best.nbytes <= byte_budget:
+        return best, high
+
+    best, best_quality = None, low
+    while low <= high:
+        quality = (low + high) // 2
+        buffer = encode(quality)
+        if buffer.nbytes <= byte_budget:
+            best, best_quality = buffer, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        best = encode(best_quality)
+    return best, best_quality
+
+
+def changed_region(frame, previous, threshold=8, margin=32, grid=160):
+    """
+    Bounding box of the pixels that differ between two frames of equal size.
+
+    The comparison runs on a grayscale thumbnail at most `grid` cells wide, so it
+    costs little even on a full virtual screen.
+
+    Args:
+        frame (np.ndarray): Current image.
+        previous (np.ndarray): Earlier image; None means everything changed.
+        threshold (int): Per-cell grayscale difference counted as a change.
+        margin (int): Pixels of context added around the box.
+        grid (int): Width of the comparison thumbnail.
+
+    Returns:
+        tuple: (x, y, width, height) in frame pixels, or None if nothing changed.
+    """
+    height, width = frame.shape[:2]
+    if previous is None or previous.shape != frame.shape:
+        return (0, 0, width, height)
+    scale = min(grid / width, 1.0)
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    thumbs = []
+    for image in (frame, previous):
+        if image.ndim == 3:
+            code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+            image = cv2.cvtColor(image, code)
+        thumbs.append(cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+    diff = cv2.absdiff(thumbs[0], thumbs[1]) > threshold
+    rows, cols = np.nonzero(diff)
+    if not len(rows):
+        return None
+
+    cell_x, cell_y = width / size[0], height / size[1]
+    x0 = max(int(cols.min() * cell_x) - margin, 0)
+    y0 = max(int(rows.min() * cell_y) - margin, 0)
+    x1 = min(int((cols.max() + 1) * cell_x) + margin, width)
+    y1 = min(int((rows.max() + 1) * cell_y) + margin, height)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def active_window_rect(monitor):
+    """
+    Rectangle of the foreground window relative to an `mss` monitor.
+
+    Only available on Windows; elsewhere there is no portable way to ask.
+
+    Args:
+        monitor (dict): `mss` monitor with left, top, width and height.
+
+    Returns:
+        tuple: (x, y, width, height) clipped to the monitor, or None.
+    """
+    if sys.platform != "win32":
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    user32 = ctypes.windll.user32
+    hwnd = user32.GetForegroundWindow()
+    rect = wintypes.RECT()
+    if not hwnd or not user32.GetWindowRect(hwnd, ctypes.byref(rect)):
+        return None
+
+    x0 = max(rect.left - monitor["left"], 0)
+    y0 = max(rect.top - monitor["top"], 0)
+    x1 = min(rect.right - monitor["left"], monitor["width"])
+    y1 = min(rect.bottom - monitor["top"], monitor["height"])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def prepare_frame(
+    frame,
+    max_side,
+    byte_budget,
+    crop=None,
+    quality_range=JPEG_QUALITY_RANGE,
+):
+    """
+    Crop, downscale and JPEG-encode a frame for upload.
+
+    Args:
+        frame (np.ndarray): BGR or BGRA image.
+        max_side (int): Longest side after resizing.
+        byte_budget (int): Maximum size of the encoded image.
+        crop (tuple): Optional (x, y, width, height) to keep.
+        quality_range (tuple): (lowest, highest) JPEG quality to consider.
+
+    Returns:
+        tuple: (encoded buffer as np.ndarray of uint8, quality used)
+    """
+    if crop is not None:
+        x, y, width, height = crop
+        frame = frame[y : y + height, x : x + width]
+    frame = resize_max_side(frame, max_side)
+    return encode_jpeg(frame, byte_budget, quality_range)
@@ -0,0 +1,397 @@
+"""
+Shared layer in front of every Groq call: per-model token-bucket rate limits,
+bounded concurrency, retries with jittered exponential backoff and per-call
+latency and token metrics.
+
+Raw Groq clients are wrapped with RateLimitedClient, which keeps the
+`client.chat.completions.create` and `client.audio.transcriptions.create`
+interface; LangChain chat models are wrapped with RateLimitedChatModel. All
+wrappers in a process share the limits of get_gateway().
+"""
+
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+# (requests per minute, tokens per minute) per model, Groq free-tier limits
+MODEL_LIMITS = {
+    "llama-3.2-11b-vision-preview": (30, 7000),
+    "llama3-8b-8192": (30, 30000),
+    "llama3-70b-8192": (30, 6000),
+    "llama-3.3-70b-versatile": (30, 6000),
+    "whisper-large-v3-turbo": (20, None),
+}
+DEFAULT_LIMITS = (30, 6000)
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+REQUEST_TIMEOUT = 60.0
+# Rough prompt size used to reserve tokens before the real usage is known
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1500
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APITimeoutError", "APIConnectionError", "Timeout", "TimeoutError"}
+
+
+class TokenBucket:
+    """
+    Refills at `rate` units per second up to `capacity`. acquire() waits for the
+    units it asks for; charge() settles the difference once the real cost is known
+    and may leave the bucket in debt, which delays the next caller.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """
+        Take `amount` units, waiting until they are available.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def charge(self, amount):
+        """Take (or give back, if negative) units without waiting."""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class LLMMetrics:
+    """Per-model call counts, latencies, retries and token usage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def record(self, model, latency, waited, retries, tokens=None, error=False):
+        """
+        Args:
+            model (str): Model name.
+            latency (float): Seconds from the first attempt to the answer.
+            waited (float): Seconds spent waiting on the rate limit.
+            retries (int): Attempts beyond the first.
+            tokens (tuple): (prompt tokens, completion tokens) if reported.
+            error (bool): True if the call failed after all retries.
+        """
+        with self.lock:
+            stats = self.models.setdefault(
+                model,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "latency": 0.0,
+                    "max_latency": 0.0,
+                    "waited": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["retries"] += retries
+            stats["latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            stats["waited"] += waited
+            if tokens:
+                stats["prompt_tokens"] += tokens[0] or 0
+                stats["completion_tokens"] += tokens[1] or 0
+
+    def snapshot(self):
+        """Copy of the per-model statistics."""
+        with self.lock:
+            return {model: dict(stats) for model, stats in self.models.items()}
+
+    def report(self):
+        """Log one line per model."""
+        for model, stats in self.snapshot().items():
+            print(
+                f"LLM {model}: {stats['calls']} calls, {stats['errors']} errors, "
+                f"{stats['retries']} retries, "
+                f"mean {stats['latency'] / stats['calls']:.2f} s "
+                f"(max {stats['max_latency']:.2f} s, "
+                f"{stats['waited']:.1f} s rate-limited), "
+                f"{stats['prompt_tokens']}+{stats['completion_tokens']} tokens"
+            )
+
+
+def is_retryable(error):
+    """True for rate limits, server errors, timeouts and dropped connections."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def _retry_after(error):
+    """Seconds asked for by a Retry-After header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """Rate limits, concurrency bound, retry policy and metrics shared by the wrappers."""
+
+    def __init__(
+        self,
+        limits=None,
+        max_concurrency=MAX_CONCURRENCY,
+        max_retries=MAX_RETRIES,
+    ):
+        self.limits = dict(MODEL_LIMITS if limits is None else limits)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.metrics = LLMMetrics()
+
+    def _buckets(self, model):
+        with self.lock:
+            if model not in self.buckets:
+                rpm, tpm = self.limits.get(model, DEFAULT_LIMITS)
+                self.buckets[model] = (
+                    TokenBucket(rpm / 60.0, rpm),
+                    TokenBucket(tpm / 60.0, tpm) if tpm else None,
+                )
+            return self.buckets[model]
+
+    def acquire(self, model, estimated_tokens):
+        """Wait for one request and the estimated tokens of `model`."""
+        requests, tokens = self._buckets(model)
+        waited = requests.acquire(1)
+        if tokens is not None:
+            waited += tokens.acquire(estimated_tokens)
+        return waited
+
+    def settle(self, model, estimated_tokens, used_tokens):
+        """Correct the token bucket once the real usage is known."""
+        _, tokens = self._buckets(model)
+        if tokens is not None and used_tokens is not None:
+            tokens.charge(used_tokens - estimated_tokens)
+
+    def release(self):
+        """Return a concurrency permit kept by call(keep_permit=True)."""
+        self.semaphore.release()
+
+    def backoff(self, attempt, error):
+        """Seconds to sleep before retry number `attempt` (from 0)."""
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+        # Jitter keeps threads that failed together from retrying together
+        return delay * random.uniform(0.5, 1.5)
+
+    def call(self, model, estimated_tokens, fn, usage=None, keep_permit=False):
+        """
+        Run `fn()` under the rate limit and concurrency bound, retrying
+        transient failures.
+
+        Args:
+            model (str): Model name, selects the rate limit.
+            estimated_tokens (int): Tokens reserved before the call.
+            fn (callable): Makes the request.
+            usage (callable): Maps the response to (prompt, completion) tokens.
+            keep_permit (bool): On success, keep the concurrency permit; the
+                                caller releases it with release() once the
+                                response is consumed, e.g. the end of a stream.
+
+        Returns:
+            The response of `fn`.
+        """
+        waited, retries, start = 0.0, 0, time.perf_counter()
+        while True:
+            waited += self.acquire(model, estimated_tokens)
+            self.semaphore.acquire()
+            try:
+                response = fn()
+            except Exception as e:
+                self.semaphore.release()
+                self.settle(model, estimated_tokens, 0)
+                if retries >= self.max_retries or not is_retryable(e):
+                    self.metrics.record(
+                        model, time.perf_counter() - start, waited, retries, error=True
+                    )
+                    raise
+                delay = self.backoff(retries, e)
+                retries += 1
+                print(f"{model}: {type(e).__name__}, retry {retries} in {delay:.1f} s")
+                time.sleep(delay)
+                continue
+
+            if not keep_permit:
+                self.semaphore.release()
+            tokens = usage(response) if usage else None
+            if tokens:
+                self.settle(model, estimated_tokens, sum(t or 0 for t in tokens))
+            self.metrics.record(
+                model, time.perf_counter() - start, waited, retries, tokens
+            )
+            return response
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide LLMGateway."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def _estimate_chat_tokens(messages):
+    tokens = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else None
+        if content is None:
+            content = getattr(message, "content", "")
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, dict):
+                if part.get("type") == "image_url":
+                    tokens += IMAGE_TOKENS
+                else:
+                    tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+            else:
+                tokens += len(str(part)) // CHARS_PER_TOKEN
+    return tokens
+
+
+def _completion_usage(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return (
+        getattr(usage, "prompt_tokens", None),
+        getattr(usage, "completion_tokens", None),
+    )
+
+
+class RateLimitedClient:
+    """
+    Groq client wrapper with the same chat.completions.create and
+    audio.transcriptions.create interface.
+    """
+
+    def __init__(self, client, gateway=None, timeout=REQUEST_TIMEOUT):
+        """
+        Args:
+            client: Groq client, best created with max_retries=0 so that retries
+                    happen here.
+            gateway (LLMGateway): Defaults to get_gateway().
+            timeout (float): Per-request timeout in seconds.
+        """
+        self.client = client
+        self.gateway = gateway or get_gateway()
+        self.timeout = timeout
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.audio = SimpleNamespace(
+            transcriptions=SimpleNamespace(create=self._transcribe)
+        )
+
+    def _chat(self, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        estimate = _estimate_chat_tokens(kwargs.get("messages", []))
+        return self.gateway.call(
+            kwargs["model"],
+            estimate,
+            lambda: self.client.chat.completions.create(**kwargs),
+            usage=_completion_usage,
+        )
+
+    def _transcribe(self, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.gateway.call(
+            kwargs["model"],
+            0,
+            lambda: self.client.audio.transcriptions.create(**kwargs),
+        )
+
+
+def _message_usage(message):
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    return usage.get("input_tokens"), usage.get("output_tokens")
+
+
+class RateLimitedChatModel:
+    """
+    LangChain chat model wrapper (e.g. ChatGroq) exposing invoke, stream and the
+    legacy call syntax through the shared gateway.
+    """
+
+    def __init__(self, llm, gateway=None):
+        self.llm = llm
+        self.gateway = gateway or get_gateway()
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+
+    def invoke(self, messages, **kwargs):
+        return self.gateway.call(
+            self.model,
+            _estimate_chat_tokens(messages),
+            lambda: self.llm.invoke(messages, **kwargs),
+            usage=_message_usage,
+        )
+
+    def __call__(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+    def stream(self, messages, **kwargs):
+        """
+        Yield the chunks of a streamed answer. Only failures before the first
+        chunk are retried, and the recorded latency is the time to that chunk.
+        The concurrency permit is held until the stream is exhausted or closed.
+        """
+
+        def start():
+            chunks = iter(self.llm.stream(messages, **kwargs))
+            return next(chunks, None), chunks
+
+        estimate = _estimate_chat_tokens(messages)
+        first, chunks = self.gateway.call(self.model, estimate, start, keep_permit=True)
+        try:
+            if first is None:
+                return
+            yield first
+            completion = 1
+            for chunk in chunks:
+                completion += 1
+                yield chunk
+            # Chunks are roughly one token each
+            self.gateway.settle(self.model, 0, completion)
+        finally:
+            self.gateway.release()
@@ -5,7 +5,9 @@ Main python file to orchastrate all pipelines real-time.
 import os
 import time
 import threading
+from functools import partial
 from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import mss
 import cv2
@@ -13,23 +15,50 @@ import numpy as np
 from groq import Groq
 import sounddevice as sd
 from win10toast import ToastNotifier
-from scipy.io.wavfile import write, read
 
 from intervent import intervention_gen
-from acs_detection import get_img_desp, get_acs
-from audio_transcription import audio_transcription
+from acs_detection import (
+    get_img_desp,
+    get_img_desp_batch,
+    get_img_acs,
+    get_img_acs_batch,
+    get_acs,
+    frame_hash,
+    FrameCache,
+    MAX_BATCH_IMAGES,
+)
+from audio_transcription import (
+    audio_transcription,
+    transcribe_segments,
+    RollingTranscript,
+)
 from audio_agent import agent_process
-from biostats import short_instance_stats, long_instance_stats
+from voice_activity import VoiceActivityGate
+from biostats import short_instance_stats, long_instance_stats, StreamingHRV
+from ring_buffer import RingBuffer, SharedRingBuffer, ECG_RING_NAME
+from frame_archive import FrameArchiver
+from acs_classifier import HybridACS
+from llm_client import RateLimitedClient, get_gateway
+from response_cache import get_response_cache
+from frame_prep import (
+    prepare_frame,
+    changed_region,
+    active_window_rect,
+    SCREEN_MAX_SIDE,
+    SCREEN_BYTE_BUDGET,
+    WEBCAM_MAX_SIDE,
+    WEBCAM_BYTE_BUDGET,
+)
 from crud_db import (
     create_table,
     push_to_table,
     fetch_ecg,
     get_live_timetable,
+    stress_level,
+    ECG_SAMPLING_RATE,
+    ECG_WINDOWS_MS,
 )
 
-# Lock for thread-safe database access
-db_lock = threading.Lock()
-
 # Replace with your device index (e.g., Realtek Microphone Array)
 DEVICE_INDEX = 28
 sd.default.device = DEVICE_INDEX
@@ -42,7 +71,7 @@ SMPT_PASS = "your-smpt-pass"
 
 def get_client():
     """
-    Set up Groq Client
+    Set up Groq Client behind the shared rate limits and retry policy
 
     Returns:
         groq client
@@ -50,8 +79,10 @@ def get_client():
     os.environ["GROQ_API_KEY"] = GROQ_API_KEY
     client = Groq(
         api_key=os.environ.get("GROQ_API_KEY"),
+        # Retries happen in llm_client, with jitter and the shared limits
+        max_retries=0,
     )
-    return client
+    return RateLimitedClient(client)
 
 
 def show_intervention_popup(intervention):
@@ -89,163 +120,591 @@ def intervent_pipeline(
         print("No intervention generated")
 
 
-def vision_pipeline(client, db_path):
-    """Thread function to handle vision pipeline."""
+class EcgMonitor:
+    """
+    HRV metrics on the latest ECG windows.
 
-    create_table(db_path)
-    pre_frame_act = ""
-    activity_class_data = []
-    last_timetable_push_time = time.time()
-    frame_number = 0
-    live_timetable = None
-
-    cap = cv2.VideoCapture(1, cv2.CAP_DSHOW)
-    if not cap.isOpened():
-        print("Error: Unable to open video capture device.")
-        return
-    pre_frame_act = ""
-    activity_class_data = []
-    last_timetable_push_time = time.time()
-    frame_number = 0
-    frames_dir = "frames"
-    os.makedirs(frames_dir, exist_ok=True)
-
-    # Capture the screen
-    frame_screen_number = 0
-    screen_capture_data = []
-    frames_screen_dir = "frames_screen"
-    os.makedirs(frames_dir, exist_ok=True)
-
-    # Screen recording setup
-    screen_capture = mss.mss()
-    monitor = screen_capture.monitors[0]  # Capture the entire screen
+    When the sensor process publishes the shared ECG ring buffer, only the samples
+    added since the last call are fed to a StreamingHRV engine, which answers both
+    windows from its R-peak history. Otherwise each window is fetched from the
+    sensor database and run through biosppy.
+    """
 
-    while True:
-        # Capture a screenshot
-        screenshot = screen_capture.grab(monitor)
-        frame_screen = np.array(screenshot)
-        frame_screen_number += 1
-        frame_screen_path = os.path.join(
-            frames_screen_dir, f"frame_{frame_screen_number:04d}.jpg"
+    def __init__(self, sensor_db_path="sensor_data.db"):
+        self.sensor_db_path = sensor_db_path
+        self.engine = StreamingHRV(ECG_SAMPLING_RATE)
+        self.position = 0
+
+    def stats(self, instance, stats_fn):
+        """
+        Args:
+            instance (str): "short" or "long" window.
+            stats_fn: short_instance_stats or long_instance_stats, for the database fallback.
+
+        Returns:
+            dict with HRV metrics
+        """
+        ring = SharedRingBuffer.attach(ECG_RING_NAME)
+        if ring is None:
+            return stats_fn(fetch_ecg(self.sensor_db_path, instance))
+        with ring:
+            if not 0 <= ring.total - self.position <= ring.capacity:
+                # Sensor restarted or samples were lost, don't join across the gap
+                self.engine = StreamingHRV(ECG_SAMPLING_RATE)
+                self.position = max(ring.total - ring.capacity, 0)
+            samples, self.position = ring.read_since(self.position)
+            self.engine.update(samples)
+            del samples
+        return self.engine.stats(ECG_WINDOWS_MS[instance] / 1000)
+
+
+# Seconds between vision captures
+VISION_INTERVAL = 60
+# Seconds of activity summarised by each timetable row
+TIMETABLE_PERIOD = 180
+# Ticks whose descriptions or ACS/HRV/DB work may still be pending before capture waits
+MAX_TICKS_IN_FLIGHT = 3
+# Screen crop before upload: None, "window" (foreground window) or "changed"
+SCREEN_CROP = None
+# Pack archived frames into segment files instead of one JPEG per frame
+ARCHIVE_SEGMENTS = False
+# Describe the frames of a tick with one multi-image VLM request; with FUSED_ACS
+# the screens go in the same request as the webcam description and ACS
+VLM_BATCH = True
+# Screen frames buffered and described together (1 = every tick)
+SCREEN_BATCH_FRAMES = 1
+# Webcam description and ACS from one JSON VLM call instead of VLM then LLM
+FUSED_ACS = True
+# Answer ACS with the local classifier when it is confident. Once it is trained,
+# with FUSED_ACS the webcam frame is only described and the fused call is made
+# just for the frames it is unsure about
+LOCAL_ACS = True
+# Ticks between retraining the local classifier on the vision table
+ACS_RETRAIN_FRAMES = 60
+# Replay temperature-0 VLM/LLM answers to identical requests from llm_cache.db
+RESPONSE_CACHE = True
+
+
+def split_future(future, count):
+    """
+    Futures for the elements of the sequence another future resolves to.
+
+    Args:
+        future (Future): Future of a sequence of `count` results.
+        count (int): Length of the sequence.
+
+    Returns:
+        list: One Future per element; all fail if `future` fails.
+    """
+    parts = [Future() for _ in range(count)]
+
+    def resolve(done):
+        error = done.exception()
+        for i, part in enumerate(parts):
+            if error is not None:
+                part.set_exception(error)
+            else:
+                part.set_result(done.result()[i])
+
+    future.add_done_callback(resolve)
+    return parts
+
+
+class VisionPipeline:
+    """
+    Vision loop on a fixed capture clock.
+
+    Screen and webcam frames are captured every `interval` seconds, measured from
+    the start of the loop so a slow tick does not shift later ones. The VLM
+    descriptions of a tick are requested concurrently (or as one multi-image
+    request with `batch_vlm`), and the ACS/HRV/DB and
+    timetable work runs on a single ordered worker, so API latency overlaps the
+    next capture instead of delaying it.
+    """
+
+    def __init__(
+        self,
+        client,
+        db_path,
+        interval=VISION_INTERVAL,
+        max_in_flight=MAX_TICKS_IN_FLIGHT,
+        screen_crop=SCREEN_CROP,
+        archive_segments=ARCHIVE_SEGMENTS,
+        batch_vlm=VLM_BATCH,
+        screen_batch=SCREEN_BATCH_FRAMES,
+        fused_acs=FUSED_ACS,
+        local_acs=LOCAL_ACS,
+        response_cache=RESPONSE_CACHE,
+    ):
+        self.client = client
+        self.db_path = db_path
+        self.interval = interval
+        self.timetable_frames = max(1, round(TIMETABLE_PERIOD / interval))
+        self.vlm_pool = ThreadPoolExecutor(max_workers=2 * max_in_flight)
+        self.post_pool = ThreadPoolExecutor(max_workers=1)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.screen_crop = screen_crop
+        self.previous_screen = None
+        self.upload_bytes = 0
+        self.archiver = FrameArchiver(segments=archive_segments)
+        self.batch_vlm = batch_vlm
+        self.screen_batch = screen_batch
+        self.fused_acs = fused_acs
+        self.response_cache = get_response_cache() if response_cache else None
+        self.local_acs = (
+            HybridACS(client, cache=self.response_cache) if local_acs else None
+        )
+        self.pending_screens = []
+
+        # State below is only touched by the ordered post worker
+        self.pre_frame_act = ""
+        self.activity_class_data = []
+        self.screen_capture_data = []
+        self.last_timetable_push_time = time.time()
+        self.ecg_monitor = EcgMonitor()
+
+        # Near-identical frames reuse earlier descriptions (and ACS results)
+        self.screen_cache = FrameCache()
+        self.webcam_cache = FrameCache()
+        self.saved_calls = 0
+
+        self.max_drift = 0.0
+        self.dropped_ticks = 0
+
+    def run(self):
+        create_table(self.db_path)
+        if self.local_acs is not None:
+            self.local_acs.retrain(self.db_path)
+
+        cap = cv2.VideoCapture(1, cv2.CAP_DSHOW)
+        if not cap.isOpened():
+            print("Error: Unable to open video capture device.")
+            self.archiver.close()
+            return
+        # Screen recording setup
+        screen_capture = mss.mss()
+        monitor = screen_capture.monitors[0]  # Capture the entire screen
+
+        start = time.monotonic()
+        frame_number = 0
+        slot = 0
+        try:
+            while True:
+                scheduled = start + slot * self.interval
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                # Back-pressure: wait here rather than queueing unbounded work
+                self.in_flight.acquire()
+                late = time.monotonic() - scheduled
+                if late >= self.interval:
+                    # After a stall, wait for the next slot still ahead instead
+                    # of firing every missed one back to back
+                    missed = int(late // self.interval) + 1
+                    slot += missed
+                    scheduled += missed * self.interval
+                    self.dropped_ticks += missed
+                    print(
+                        f"Capture stalled, skipped {missed} tick(s) "
+                        f"({self.dropped_ticks} in total)"
+                    )
+                    time.sleep(max(scheduled - time.monotonic(), 0))
+                drift = time.monotonic() - scheduled
+                slot += 1
+                frame_number += 1
+
+                try:
+                    # Capture a screenshot
+                    screenshot = screen_capture.grab(monitor)
+                    frame_screen = np.array(screenshot)
+                    capture_time = time.time()
+                    screen_buffer, _ = prepare_frame(
+                        frame_screen,
+                        SCREEN_MAX_SIDE,
+                        SCREEN_BYTE_BUDGET,
+                        crop=self.screen_region(frame_screen, monitor),
+                    )
+
+                    ret, frame = cap.read()
+                    if not ret:
+                        print("Error: Unable to capture image.")
+                        self.in_flight.release()
+                        break
+                    buffer, _ = prepare_frame(
+                        frame, WEBCAM_MAX_SIDE, WEBCAM_BYTE_BUDGET
+                    )
+                    self.archiver.submit(
+                        "frames_screen", frame_number, capture_time, screen_buffer
+                    )
+                    self.archiver.submit("frames", frame_number, capture_time, buffer)
+
+                    self.report_drift(frame_number, drift)
+                    screen_key = frame_hash(frame_screen)
+                    webcam_key = frame_hash(frame)
+                    screen_cached = self.screen_cache.lookup(screen_key)
+                    webcam_cached = self.webcam_cache.lookup(webcam_key)
+
+                    if screen_cached is not None:
+                        self.saved_calls += 1
+                    else:
+                        self.pending_screens.append((screen_key, screen_buffer))
+                    screens = []
+                    # A cached description is stored this tick, so screens still
+                    # waiting for a batch go first to keep the history in order
+                    if len(self.pending_screens) >= self.screen_batch or (
+                        screen_cached is not None and self.pending_screens
+                    ):
+                        screens, self.pending_screens = self.pending_screens, []
+                    if webcam_cached is not None:
+                        # Saves the description and the ACS call
+                        self.saved_calls += 2
+
+                    # A trained local classifier takes over the ACS of the
+                    # fused call, which is only made for frames it is unsure of
+                    fused = self.fused_acs and (
+                        self.local_acs is None or self.local_acs.classifier is None
+                    )
+                    # Descriptions are requested at once, the rest is ordered
+                    screen_futures, webcam_future = self.request_descriptions(
+                        [screen for _, screen in screens],
+                        buffer if webcam_cached is None else None,
+                        fused,
+                    )
+                    self.post_pool.submit(
+                        self.process_tick,
+                        frame_number,
+                        capture_time,
+                        (screen_cached, [key for key, _ in screens], screen_futures),
+                        (webcam_key, webcam_cached, webcam_future, buffer, fused),
+                    )
+                except Exception as e:
+                    # The tick never reached process_tick, which releases the permit
+                    print(f"Error capturing frame {frame_number}: {e}")
+                    self.in_flight.release()
+                    continue
+                if frame_number % 10 == 0:
+                    self.report_cache()
+                    get_gateway().metrics.report()
+        finally:
+            # Describe the screens still waiting for a batch
+            flushed = None
+            if self.pending_screens:
+                screens, self.pending_screens = self.pending_screens, []
+                screen_futures, _ = self.request_descriptions(
+                    [screen for _, screen in screens], None
+                )
+                flushed = self.post_pool.submit(
+                    self.store_screens, [key for key, _ in screens], screen_futures
+                )
+            self.post_pool.shutdown(wait=True)
+            if flushed is not None and flushed.exception() is not None:
+                print(f"Error describing pending screens: {flushed.exception()}")
+            self.vlm_pool.shutdown(wait=True)
+            self.archiver.close()
+            cap.release()
+
+    def report_drift(self, frame_number, drift):
+        """Log how late a capture ran against its scheduled time."""
+        self.max_drift = max(self.max_drift, drift)
+        print(
+            f"Frame number : {frame_number} "
+            f"(drift {drift * 1000:.0f} ms, max {self.max_drift * 1000:.0f} ms)"
         )
-        cv2.imwrite(frame_screen_path, frame_screen)
 
-        # Process the frame (same as webcam-based pipeline)
-        _, buffer = cv2.imencode(".jpg", frame_screen)
-        screen_img_desp = get_img_desp(client, buffer, pre_frame_act, is_screen=True)
-        screen_capture_data.append(screen_img_desp)
+    def report_cache(self):
+        """Log frame cache hit rates and the API calls they saved."""
+        print(
+            f"Frame cache: screen {self.screen_cache.hit_rate:.0%} hits, "
+            f"webcam {self.webcam_cache.hit_rate:.0%} hits, "
+            f"{self.saved_calls} VLM/LLM calls saved, "
+            f"{self.upload_bytes / 1e6:.1f} MB uploaded"
+        )
+        if self.response_cache is not None:
+            print(f"Response cache: {self.response_cache.hit_rate:.0%} hits")
 
-        ret, frame = cap.read()
-        _, buffer = cv2.imencode(".jpg", frame)
+    def screen_region(self, frame_screen, monitor):
+        """
+        Part of the screen to upload according to `screen_crop`.
 
-        frame_number += 1
-        frame_path = os.path.join(frames_dir, f"frame_{frame_number:04d}.jpg")
-        cv2.imwrite(frame_path, frame)
+        Args:
+            frame_screen (np.ndarray): Current screen grab.
+            monitor (dict): `mss` monitor the grab was taken from.
 
-        last_capture_time = time.time()
-        if not ret:
-            print("Error: Unable to capture image.")
-            break
-        img_desp = get_img_desp(client, buffer, pre_frame_act)
+        Returns:
+            tuple: (x, y, width, height) or None for the whole screen.
+        """
+        region = None
+        if self.screen_crop == "window":
+            region = active_window_rect(monitor)
+        elif self.screen_crop == "changed":
+            region = changed_region(frame_screen, self.previous_screen)
+            self.previous_screen = frame_screen
+        return region
+
+    def request_descriptions(self, screens, webcam_buffer, fused=False):
+        """
+        Submit the VLM requests of one tick, batched into multi-image requests
+        when `batch_vlm` is set. With `fused` the screens go in the same
+        request as the webcam description and ACS.
 
-        vision_output = get_acs(client, img_desp)
+        Args:
+            screens (list): Encoded screen frames to describe.
+            webcam_buffer: Encoded webcam frame, or None if it was cached.
+            fused (bool): Get the webcam ACS from the fused call.
 
-        activity_class_data.append(vision_output["activity_class"])
+        Returns:
+            tuple: (list of screen description futures, webcam future or None).
+                   With `fused` the webcam future resolves to (description, ACS).
+        """
+        frames = [(screen, True) for screen in screens]
+        fused_futures = []
+        if webcam_buffer is not None:
+            if fused:
+                fused_screens = []
+                if self.batch_vlm:
+                    fused_screens = screens[: MAX_BATCH_IMAGES - 1]
+                    frames = frames[len(fused_screens) :]
+                self.upload_bytes += webcam_buffer.nbytes + sum(
+                    img.nbytes for img in fused_screens
+                )
+                fused_future = self.vlm_pool.submit(
+                    get_img_acs_batch,
+                    self.client,
+                    fused_screens,
+                    webcam_buffer,
+                    self.pre_frame_act,
+                    self.response_cache,
+                )
+                fused_futures = split_future(fused_future, len(fused_screens) + 1)
+            else:
+                frames.append((webcam_buffer, False))
+        self.upload_bytes += sum(img.nbytes for img, _ in frames)
+
+        if self.batch_vlm and len(frames) > 1:
+            futures = []
+            for start in range(0, len(frames), MAX_BATCH_IMAGES):
+                batch = frames[start : start + MAX_BATCH_IMAGES]
+                batch_future = self.vlm_pool.submit(
+                    get_img_desp_batch,
+                    self.client,
+                    batch,
+                    self.pre_frame_act,
+                    self.response_cache,
+                )
+                futures.extend(split_future(batch_future, len(batch)))
+        else:
+            futures = [
+                self.vlm_pool.submit(
+                    get_img_desp,
+                    self.client,
+                    img,
+                    self.pre_frame_act,
+                    is_screen=is_screen,
+                    cache=self.response_cache,
+                )
+                for img, is_screen in frames
+            ]
+
+        if fused_futures:
+            # The fused request holds the first screens, in order
+            return fused_futures[:-1] + futures, fused_futures[-1]
+        if webcam_buffer is None:
+            return futures, None
+        return futures[:-1], futures[-1]
+
+    def process_tick(self, frame_number, capture_time, screen, webcam):
+        """
+        ACS, HRV and database work of one tick; runs on the ordered post worker.
+
+        Args:
+            frame_number (int): Tick number.
+            capture_time (float): Epoch time of the capture.
+            screen: (cached description or None, frame hashes of the screens
+                    described this tick, their description futures).
+            webcam: (frame hash, cached (description, ACS) or None, description
+                    future or None, encoded frame, whether the future is of the
+                    fused call).
+        """
+        try:
+            screen_cached, screen_keys, screen_futures = screen
+            self.store_screens(screen_keys, screen_futures)
+            if screen_cached is not None:
+                self.screen_capture_data.append(screen_cached)
+
+            webcam_key, webcam_cached, webcam_future, buffer, fused = webcam
+            if webcam_cached is not None:
+                img_desp, vision_output = webcam_cached
+            elif fused:
+                img_desp, vision_output = webcam_future.result()
+                self.webcam_cache.store(webcam_key, (img_desp, vision_output))
+            else:
+                img_desp = webcam_future.result()
+                if self.local_acs is not None:
+                    # Unsure frames go to the fused call instead of the LLM
+                    fallback = (
+                        partial(self.frame_acs, buffer) if self.fused_acs else None
+                    )
+                    vision_output = self.local_acs(img_desp, fallback)
+                else:
+                    vision_output = get_acs(self.client, img_desp, self.response_cache)
+                self.webcam_cache.store(webcam_key, (img_desp, vision_output))
+            self.store_tick(capture_time, img_desp, vision_output)
+            if self.local_acs is not None and frame_number % ACS_RETRAIN_FRAMES == 0:
+                self.local_acs.retrain(self.db_path)
+                self.local_acs.report()
+        except Exception as e:
+            print(f"Error processing frame {frame_number}: {e}")
+        finally:
+            self.in_flight.release()
+
+    def frame_acs(self, buffer):
+        """ACS of an encoded webcam frame from the fused VLM call."""
+        return get_img_acs(
+            self.client, buffer, self.pre_frame_act, self.response_cache
+        )[1]
+
+    def store_screens(self, screen_keys, screen_futures):
+        """
+        Add described screens to the screen history, in order; runs on the
+        ordered post worker.
 
-        print("Frame number :", frame_number)
+        Args:
+            screen_keys (list): Frame hashes of the screens.
+            screen_futures (list): Their description futures.
+        """
+        for screen_key, screen_future in zip(screen_keys, screen_futures):
+            screen_img_desp = screen_future.result()
+            self.screen_cache.store(screen_key, screen_img_desp)
+            self.screen_capture_data.append(screen_img_desp)
+
+    def store_tick(self, capture_time, img_desp, vision_output):
+        """Push a tick's vision and HRV rows, and the timetable once a period is complete."""
+        self.pre_frame_act = vision_output["activity"]
+        self.activity_class_data.append(vision_output["activity_class"])
         push_to_table(
-            db_lock,
             """
-            INSERT INTO vision (timestamp, image_desp, activity, activity_class, criticality, surrounding)
-            VALUES (?, ?, ?, ?, ?, ?);
+            INSERT INTO vision (timestamp, image_desp, activity, activity_class, criticality, surrounding, acs_source)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
             """,
             (
-                vision_output["timestamp"],
+                int(capture_time),
                 img_desp,
                 vision_output["activity"],
                 vision_output["activity_class"],
                 vision_output["criticality"],
                 vision_output["surrounding"],
+                vision_output.get("source"),
             ),
-            db_path,
+            self.db_path,
         )
 
-        ecg_data = fetch_ecg("sensor_data.db", "short")
-        # print('ecg_data', ecg_data)
-        json_hrv = short_instance_stats(ecg_data)
+        json_hrv = self.ecg_monitor.stats("short", short_instance_stats)
         print("pnn50", json_hrv["metrics"]["pnn50"])
         push_to_table(
-            db_lock,
             """
-            INSERT INTO hrv_data (mean_rr, pnn50, pnn30, pnn20, heart_rate)
-            VALUES (?, ?, ?, ?, ?);
+            INSERT INTO hrv_data (timestamp, mean_rr, pnn50, pnn30, pnn20, heart_rate)
+            VALUES (?, ?, ?, ?, ?, ?);
             """,
             (
+                int(time.time()),
                 json_hrv["metrics"]["mean_rr"],
                 json_hrv["metrics"]["pnn50"],
                 json_hrv["metrics"]["pnn30"],
                 json_hrv["metrics"]["pnn20"],
                 json_hrv["metrics"]["hr"],
             ),
-            db_path,
+            self.db_path,
         )
 
-        time_diff = time.time() - last_capture_time
-        # For individual frames
-        if time_diff < 60:
-            time.sleep(60 - time_diff)
-
         # For collective frame processing
-        if len(activity_class_data) == 3:
-            start_time = time.strftime(
-                "%H:%M", time.localtime(last_timetable_push_time)
-            )
-            ecg_data = fetch_ecg("sensor_data.db", "long")
-            long_hrv = long_instance_stats(ecg_data)
-            print("pnn50 long", long_hrv["metrics"]["pnn50"])
-            end_time = time.strftime("%H:%M", time.localtime(time.time()))
-            time_interval = f"{start_time} - {end_time}"
-            push_to_table(
-                db_lock,
-                """
-                INSERT INTO timetable (time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50, heart_rate)
-                VALUES (?, ?, ?, ?, ?, ?, ?);
-                """,
-                (
-                    time_interval,
-                    Counter(activity_class_data).get("Desk_Work", 0),
-                    Counter(activity_class_data).get("Commuting", 0),
-                    Counter(activity_class_data).get("Eating", 0),
-                    Counter(activity_class_data).get("In_Meeting", 0),
-                    long_hrv["metrics"]["pnn50"],
-                    long_hrv["metrics"]["hr"],
-                ),
-                db_path,
-            )
-            pnn50 = long_hrv["metrics"]["pnn50"]
-            stress_level = (
-                "high" if pnn50 < 20 else "moderate" if 20 <= pnn50 < 50 else "low"
-            )
-            live_timetable = get_live_timetable(db_lock, db_path)
-            # print('timetable', live_timetable)
-            intervent_pipeline(
-                client,
-                live_timetable,
-                vision_output["surrounding"],
-                stress_level,
-                screen_capture_data,
-            )
-            last_timetable_push_time = time.time()
-            activity_class_data = []
+        if len(self.activity_class_data) >= self.timetable_frames:
+            self.push_timetable(vision_output["surrounding"])
+
+    def push_timetable(self, surrounding):
+        """Summarise the last period into the timetable and run the intervention pipeline."""
+        start_time = time.strftime(
+            "%H:%M", time.localtime(self.last_timetable_push_time)
+        )
+        long_hrv = self.ecg_monitor.stats("long", long_instance_stats)
+        print("pnn50 long", long_hrv["metrics"]["pnn50"])
+        end_timestamp = time.time()
+        end_time = time.strftime("%H:%M", time.localtime(end_timestamp))
+        time_interval = f"{start_time} - {end_time}"
+        # Minutes per activity class
+        counts = Counter(self.activity_class_data)
+        minutes = {
+            activity_class: round(counts.get(activity_class, 0) * self.interval / 60)
+            for activity_class in ("Desk_Work", "Commuting", "Eating", "In_Meeting")
+        }
+        push_to_table(
+            """
+            INSERT INTO timetable (start_time, end_time, time_interval, Desk_Work, Commuting, Eating, In_Meeting, pNN50, heart_rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            (
+                int(self.last_timetable_push_time),
+                int(end_timestamp),
+                time_interval,
+                minutes["Desk_Work"],
+                minutes["Commuting"],
+                minutes["Eating"],
+                minutes["In_Meeting"],
+                long_hrv["metrics"]["pnn50"],
+                long_hrv["metrics"]["hr"],
+            ),
+            self.db_path,
+        )
+        # "unknown" rather than a level when no beats were detected (NaN)
+        level = stress_level(long_hrv["metrics"]["pnn50"])
+        live_timetable = get_live_timetable(self.db_path)
+        intervent_pipeline(
+            self.client,
+            live_timetable,
+            surrounding,
+            level,
+            self.screen_capture_data,
+        )
+        self.last_timetable_push_time = time.time()
+        self.activity_class_data = []
+
+
+def vision_pipeline(client, db_path, interval=VISION_INTERVAL):
+    """Thread function to handle vision pipeline."""
+    VisionPipeline(client, db_path, interval).run()
+
+
+# Seconds of audio kept by AudioRecorder
+AUDIO_BUFFER_SECONDS = 600
+# Upload only the utterances found by voice activity detection
+VAD = True
+# Transcribe only the audio recorded since the last window, into a rolling
+# transcript; False re-sends the last `duration` seconds every window
+INCREMENTAL_TRANSCRIPTION = True
+# Seconds of the previous window sent again, so no word is cut between windows
+TRANSCRIPT_OVERLAP = 2.0
 
 
 class AudioRecorder:
-    def __init__(self, samplerate=48000, channels=1, device_index=11):
+    """
+    Records the microphone into a fixed-size ring buffer holding the last
+    `buffer_seconds` of audio. The PortAudio callback is the only writer and
+    takes no lock; readers get views that stay valid until the recording laps
+    them, i.e. for `buffer_seconds`.
+    """
+
+    def __init__(
+        self,
+        samplerate=48000,
+        channels=1,
+        device_index=11,
+        buffer_seconds=AUDIO_BUFFER_SECONDS,
+    ):
         self.samplerate = samplerate
         self.channels = channels
         self.device_index = device_index
-        self.buffer = np.array([], dtype=np.int16)
-        self.lock = threading.Lock()
+        self.buffer = RingBuffer(buffer_seconds * samplerate * channels, np.int16)
+        # Epoch time of the first sample, set by the first callback
+        self.started = None
         self.is_recording = False
 
     def start_recording(self):
@@ -265,35 +724,87 @@ class AudioRecorder:
             while self.is_recording:
                 time.sleep(0.1)
 
-    def _audio_callback(self, indata, frames, time, status):
+    def _audio_callback(self, indata, frames, time_info, status):
         if status:
             print(f"Stream status: {status}")
-        with self.lock:
-            self.buffer = np.append(self.buffer, indata)
+        if self.started is None:
+            self.started = time.time() - frames / self.samplerate
+        self.buffer.write(indata)
+
+    def read_since(self, position, overlap=0.0):
+        """
+        Get the audio recorded after a read cursor, plus `overlap` seconds before it.
+
+        Args:
+            position (int): Cursor returned by the previous call, 0 at first.
+            overlap (float): Seconds before the cursor to include again.
+
+        Returns:
+            tuple: (samples, a view into the ring buffer; epoch time of the first
+                    sample; new cursor). Audio older than the buffer is lost.
+        """
+        total = self.buffer.total
+        start = max(
+            min(position, total) - int(overlap * self.samplerate) * self.channels,
+            total - self.buffer.capacity,
+            0,
+        )
+        samples = self.buffer.latest(total - start, total)
+        started = self.started or time.time()
+        return samples, started + start / (self.samplerate * self.channels), total
 
     def get_audio_snapshot(self, use_full_buffer=False, duration=None):
         """
         Get audio data from the buffer.
 
         Args:
-            use_full_buffer (bool): If True, return the entire buffer.
+            use_full_buffer (bool): If True, return everything the buffer holds.
             duration (int): Number of seconds to retrieve (ignored if use_full_buffer is True).
 
         Returns:
-            np.ndarray: Audio data.
+            np.ndarray: Audio data, a view into the ring buffer; copy it to keep
+                        it longer than the buffer holds audio.
         """
-        with self.lock:
-            if use_full_buffer:
-                return self.buffer
-            elif duration:
-                num_samples = int(duration * self.samplerate * self.channels)
-                return (
-                    self.buffer[-num_samples:]
-                    if len(self.buffer) >= num_samples
-                    else self.buffer
-                )
-            else:
-                return np.array([], dtype=np.int16)
+        if use_full_buffer:
+            return self.buffer.latest(self.buffer.capacity)
+        elif duration:
+            return self.buffer.latest(int(duration * self.samplerate * self.channels))
+        else:
+            return np.array([], dtype=np.int16)
+
+
+def window_segments(client, recorder, gate, audio_data):
+    """
+    Timestamped transcript segments of one audio window.
+
+    Args:
+        client: The client object for transcription.
+        recorder: The `AudioRecorder` the samples come from.
+        gate: A `VoiceActivityGate`, or None to transcribe the whole window.
+        audio_data (np.ndarray): Samples of the window.
+
+    Returns:
+        list: (start, end, text) segments in seconds from the start of the
+              window; empty if it has no audio or speech, or transcription failed.
+    """
+    if len(audio_data) == 0:
+        print("No audio data available for processing.")
+        return []
+    if gate is not None:
+        audio_data = gate.filter(audio_data)
+        gate.report()
+        if audio_data is None:
+            print("No speech in the last window. Skipping transcription.")
+            return []
+    # Segment times are in the joined speech; map them back to the window
+    source_time = gate.source_time if gate is not None else (lambda seconds: seconds)
+    segments = transcribe_segments(
+        client, audio_data, recorder.samplerate, recorder.channels
+    )
+    return [
+        (source_time(start), source_time(end), text)
+        for start, end, text in segments or []
+    ]
 
 
 def audio_pipeline(client, db_path, recorder, duration=60):
@@ -306,22 +817,52 @@ def audio_pipeline(client, db_path, recorder, duration=60):
         recorder: An instance of `AudioRecorder`.
         duration: Duration in seconds for processing intervals.
     """
-    audio_file = "accumulated_audio.wav"
+    # The vision thread migrates the same database, but may not have yet
+    create_table(db_path)
+    gate = VoiceActivityGate(recorder.samplerate, recorder.channels) if VAD else None
+    transcript = RollingTranscript(db_path)
+    position = 0
 
     while True:
         time.sleep(duration)
 
-        # Extract the last `duration` seconds of audio and save to a file
-        audio_data = recorder.get_audio_snapshot(duration)
-        if len(audio_data) == 0:
-            print("No audio data available for processing.")
-            continue
-
-        write(audio_file, recorder.samplerate, audio_data)
-        print(f"Saved last {duration} seconds of audio to {audio_file}.")
-
-        # Process the audio file
-        transcription = audio_transcription(client, audio_file)
+        if INCREMENTAL_TRANSCRIPTION:
+            # Only the audio since the last window, plus a short overlap
+            audio_data, window_start, position = recorder.read_since(
+                position, TRANSCRIPT_OVERLAP
+            )
+            window_end = window_start + len(audio_data) / (
+                recorder.samplerate * recorder.channels
+            )
+            segments = window_segments(client, recorder, gate, audio_data)
+            # Added even when empty, so that a silent or failed window commits
+            # the tail held back from the previous one
+            added = transcript.add(
+                [
+                    (window_start + start, window_start + end, text)
+                    for start, end, text in segments
+                ],
+                # The end of this window is heard again at the start of the next
+                until=window_end - TRANSCRIPT_OVERLAP / 2,
+                since=window_start,
+            )
+            transcription = " ".join(text for _, _, text in added)
+        else:
+            # Extract the last `duration` seconds of audio
+            audio_data = recorder.get_audio_snapshot(duration=duration)
+            if len(audio_data) == 0:
+                print("No audio data available for processing.")
+                continue
+            if gate is not None:
+                audio_data = gate.filter(audio_data)
+                gate.report()
+                if audio_data is None:
+                    print("No speech in the last window. Skipping transcription.")
+                    continue
+            # Encoded and uploaded from memory
+            transcription = audio_transcription(
+                client, audio_data, recorder.samplerate, recorder.channels
+            )
         if not transcription:
             print("No transcription generated. Skipping.")
             continue
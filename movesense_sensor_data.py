@@ -5,19 +5,21 @@ This example is based on the examples in the Bleak repo: https://github.com/hbld
 
 import os
 import sys
-import struct
+import time
 import sqlite3
 import logging
 from typing import List
-from functools import reduce
 from datetime import datetime, timedelta, timezone
 
 import signal
 import asyncio
+import numpy as np
 from bleak import BleakClient
 from bleak import _logger as logger
 from bleak import discover
 
+from ring_buffer import SharedRingBuffer, ECG_RING_NAME, ECG_RING_SECONDS
+
 DEVICE_BOOT_TIME = None
 WRITE_CHARACTERISTIC_UUID = "34800001-7185-4d5d-b431-630e7050e8f0"
 NOTIFY_CHARACTERISTIC_UUID = "34800002-7185-4d5d-b431-630e7050e8f0"
@@ -69,11 +71,47 @@ def initialize_database(db_name="sensor_data.db"):
         CREATE TABLE IF NOT EXISTS ecg_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp_system TEXT,  -- Store IST timestamp as ISO-formatted string
-            timestamp_sensor TEXT,       
+            timestamp_sensor INTEGER,
             value REAL
         )
     """
     )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ecg_data_timestamp_sensor ON ecg_data (timestamp_sensor)"
+    )
+
+    # Create table for chunked ECG data (ECG_STORAGE = "chunks"). Sensor time
+    # restarts when the device reboots, so rows are keyed on insertion order
+    columns = cursor.execute("PRAGMA table_info(ecg_chunks)").fetchall()
+    keyed_on_sensor_time = any(
+        name == "timestamp_sensor" and pk for _, name, _, _, _, pk in columns
+    )
+    if keyed_on_sensor_time:
+        cursor.execute("ALTER TABLE ecg_chunks RENAME TO ecg_chunks_legacy")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ecg_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp_sensor INTEGER,  -- Sensor time (ms) of the first sample
+            timestamp_end INTEGER,  -- Sensor time (ms) of the last sample
+            timestamp_system TEXT,
+            n_samples INTEGER,
+            samples BLOB  -- Little-endian float32 values in mV
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ecg_chunks_timestamp_sensor ON ecg_chunks (timestamp_sensor)"
+    )
+    if keyed_on_sensor_time:
+        cursor.execute(
+            """
+            INSERT INTO ecg_chunks (timestamp_sensor, timestamp_end, timestamp_system, n_samples, samples)
+            SELECT timestamp_sensor, timestamp_end, timestamp_system, n_samples, samples
+            FROM ecg_chunks_legacy ORDER BY timestamp_sensor
+        """
+        )
+        cursor.execute("DROP TABLE ecg_chunks_legacy")
 
     # Create table for IMU data
     cursor.execute(
@@ -81,7 +119,7 @@ def initialize_database(db_name="sensor_data.db"):
         CREATE TABLE IF NOT EXISTS imu_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp_system TEXT,  -- Store IST timestamp as ISO-formatted string
-            timestamp_sensor TEXT, 
+            timestamp_sensor INTEGER,
             acc_x REAL,
             acc_y REAL,
             acc_z REAL,
@@ -101,128 +139,336 @@ def initialize_database(db_name="sensor_data.db"):
     print(f"Database '{db_name}' is ready.")
 
 
-def insert_data(data, db_name="sensor_data.db"):
+def open_connection(db_name="sensor_data.db"):
     """
-    Insert a data string into the SQLite database based on its type.
+    Open a long-lived SQLite connection tuned for continuous ingest.
+
+    WAL mode lets readers (e.g. main.py fetching ECG windows) run while the
+    ingest writer holds the database, and synchronous=NORMAL only fsyncs at
+    checkpoints instead of on every commit.
 
     Args:
-        data (str): The data string, either ECG or IMU type, comma-separated.
         db_name (str): Name of the SQLite database file.
-    """
-    # Split the data string into components
-    columns = data.split(",")
-    data_type = columns[0]
 
-    # Connect to the database
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
     conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Raw notification layouts. ECG (reference 100) fits in one packet: type, ref,
+# timestamp and 16 int32 samples. IMU9 (reference 99) arrives in two parts which
+# are joined before decoding: type, ref, timestamp and then three arrays of
+# 8 xyz float32 triplets (acc, gyro, magn).
+ECG_PACKET_DTYPE = np.dtype(
+    [
+        ("packet_type", "u1"),
+        ("reference", "u1"),
+        ("timestamp", "<u4"),
+        ("samples", "<i4", (16,)),
+    ]
+)
+IMU9_PACKET_DTYPE = np.dtype(
+    [
+        ("packet_type", "u1"),
+        ("reference", "u1"),
+        ("timestamp", "<u4"),
+        ("acc", "<f4", (8, 3)),
+        ("gyro", "<f4", (8, 3)),
+        ("magn", "<f4", (8, 3)),
+    ]
+)
+
+# Decoded sample blocks passed down the pipeline, one row per sample
+ECG_SAMPLE_DTYPE = np.dtype([("timestamp", "<i8"), ("value", "<f8")])
+IMU9_SAMPLE_DTYPE = np.dtype(
+    [("timestamp", "<i8")]
+    + [
+        (f"{sensor}_{axis}", "<f8")
+        for sensor in ("acc", "gyro", "magn")
+        for axis in ("x", "y", "z")
+    ]
+)
+
+# Sample scaling is 0.38 uV/sample
+ECG_SCALE_MV = 0.38 * 0.001
+# Interpolated timestamp offsets (ms) of each sample within a notification
+ECG_TIME_OFFSETS = np.array([int(i * 1000 / 200) for i in range(16)])
+IMU9_TIME_OFFSETS = np.array([int(i * 1000 / 104) for i in range(8)])
+
+
+def decode_ecg_packet(data):
+    """
+    Decode an ECG notification into a block of samples.
 
-    try:
-        if data_type == "ECG":
-            # Parse ECG data: ECG, timestamp, value
-            timestamp = int(columns[1])
-            value = float(columns[2])
+    Args:
+        data (bytes | bytearray): The raw ECG notification.
 
-            # Convert timestamp to IST
-            ist_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    Returns:
+        np.ndarray: 16 samples with ECG_SAMPLE_DTYPE (sensor timestamp in ms, value in mV).
+    """
+    packet = np.frombuffer(data, dtype=ECG_PACKET_DTYPE, count=1)[0]
+    block = np.empty(16, dtype=ECG_SAMPLE_DTYPE)
+    block["timestamp"] = packet["timestamp"] + ECG_TIME_OFFSETS
+    block["value"] = packet["samples"] * ECG_SCALE_MV
+    return block
 
-            # Insert into ecg_data table
-            cursor.execute(
-                "INSERT INTO ecg_data (timestamp_system, timestamp_sensor , value) VALUES (?, ?, ?)",
-                (ist_time, timestamp, value),
-            )
-            print(f"Inserted ECG data: timestamp={ist_time}, value={value}")
 
-        elif data_type == "IMU9":
-            # Parse IMU data: IMU9, timestamp, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, magn_x, magn_y, magn_z
-            timestamp = int(columns[1])
-            imu_values = [float(val) for val in columns[2:]]
-
-            # Convert timestamp to IST
-            ist_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-
-            # Insert into imu_data table
-            cursor.execute(
-                """
-                INSERT INTO imu_data (timestamp_system, timestamp_sensor, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, magn_x, magn_y, magn_z)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (ist_time, timestamp, *imu_values),
-            )
-            print(f"Inserted IMU data: timestamp={ist_time}, values={imu_values}")
+def decode_imu9_packet(data):
+    """
+    Decode a joined IMU9 notification (both parts) into a block of samples.
 
-        else:
-            print(f"Unknown data type: {data_type}")
+    Args:
+        data (bytes | bytearray): Part 1 followed by part 2 without its type and reference bytes.
+
+    Returns:
+        np.ndarray: 8 samples with IMU9_SAMPLE_DTYPE.
+    """
+    packet = np.frombuffer(data, dtype=IMU9_PACKET_DTYPE, count=1)[0]
+    values = np.concatenate((packet["acc"], packet["gyro"], packet["magn"]), axis=1)
+    block = np.empty(8, dtype=IMU9_SAMPLE_DTYPE)
+    block["timestamp"] = packet["timestamp"] + IMU9_TIME_OFFSETS
+    for i, name in enumerate(IMU9_SAMPLE_DTYPE.names[1:]):
+        block[name] = values[:, i]
+    return block
+
+
+ECG_INSERT_QUERY = (
+    "INSERT INTO ecg_data (timestamp_system, timestamp_sensor, value) VALUES (?, ?, ?)"
+)
+ECG_CHUNK_INSERT_QUERY = """
+    INSERT INTO ecg_chunks (timestamp_sensor, timestamp_end, timestamp_system, n_samples, samples)
+    VALUES (?, ?, ?, ?, ?)
+"""
+IMU_INSERT_QUERY = """
+    INSERT INTO imu_data (timestamp_system, timestamp_sensor, acc_x, acc_y, acc_z, gyro_x, gyro_y, gyro_z, magn_x, magn_y, magn_z)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-        # Commit changes
-        conn.commit()
+# "rows" stores one ecg_data row per sample, "chunks" stores one ecg_chunks
+# row of float32 samples per ECG_CHUNK_SAMPLES (one second at 200 Hz)
+ECG_STORAGE = "chunks"
+ECG_CHUNK_SAMPLES = 200
+# Also publish ECG to a shared-memory ring buffer for main.py's HRV windows
+USE_ECG_RING = True
 
-    except Exception as e:
-        print(f"Error inserting data: {e}")
+# Flush once this many rows are pending, or after FLUSH_INTERVAL seconds
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 1.0
+# How often (seconds) to log queue depth and flush latency
+STATS_INTERVAL = 30.0
 
-    finally:
-        # Close the database connection
-        conn.close()
 
+class BatchWriter:
+    """
+    Buffers incoming sensor rows and writes them in batches with executemany
+    on a single long-lived connection.
+    """
 
-# https://stackoverflow.com/a/56243296
-class DataView:
-    def __init__(self, array, bytes_per_element=1):
-        """
-        bytes_per_element is the size of each element in bytes.
-        By default we are assume the array is one byte per element.
+    def __init__(
+        self,
+        db_name="sensor_data.db",
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        stats_interval=STATS_INTERVAL,
+        ecg_storage=ECG_STORAGE,
+        ecg_ring=None,
+    ):
+        self.conn = open_connection(db_name)
+        self.ecg_storage = ecg_storage
+        self.ecg_ring = ecg_ring
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.ecg_blocks = []
+        self.imu_blocks = []
+        self.pending = 0
+        # ECG samples held back until they fill a whole chunk
+        self.ecg_carry = np.empty(0, dtype=ECG_SAMPLE_DTYPE)
+        self.last_flush_time = time.monotonic()
+
+        # Stats since the last report
+        self.last_stats_time = self.last_flush_time
+        self.rows_written = 0
+        self.flush_count = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.max_queue_depth = 0
+
+    def add(self, data_type, block):
         """
-        self.array = array
-        self.bytes_per_element = 1
-
-    def __get_binary(self, start_index, byte_count, signed=False):
-        integers = [self.array[start_index + x] for x in range(byte_count)]
-        _bytes = [
-            integer.to_bytes(self.bytes_per_element, byteorder="little", signed=signed)
-            for integer in integers
-        ]
-        return reduce(lambda a, b: a + b, _bytes)
-
-    def get_uint_16(self, start_index):
-        bytes_to_read = 2
-        return int.from_bytes(
-            self.__get_binary(start_index, bytes_to_read), byteorder="little"
-        )
+        Buffer a decoded sample block for the next flush.
 
-    def get_uint_8(self, start_index):
-        bytes_to_read = 1
-        return int.from_bytes(
-            self.__get_binary(start_index, bytes_to_read), byteorder="little"
-        )
+        Args:
+            data_type (str): "ECG" or "IMU9".
+            block (np.ndarray): Samples with ECG_SAMPLE_DTYPE or IMU9_SAMPLE_DTYPE.
+        """
+        if data_type == "ECG":
+            self.ecg_blocks.append(block)
+            if self.ecg_ring is not None:
+                # Readers see new samples right away, before the batch is flushed
+                self.ecg_ring.write(block["value"])
+        elif data_type == "IMU9":
+            self.imu_blocks.append(block)
+        else:
+            print(f"Unknown data type: {data_type}")
+            return
+        self.pending += len(block)
 
-    def get_uint_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<I", binary)[0]  # <f for little endian
+    def time_until_flush(self):
+        """Seconds left before the pending rows are due to be flushed."""
+        elapsed = time.monotonic() - self.last_flush_time
+        return max(self.flush_interval - elapsed, 0.0)
 
-    def get_int_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<i", binary)[0]  # < for little endian
+    def should_flush(self):
+        return self.pending >= self.batch_size or (
+            self.pending > 0 and self.time_until_flush() == 0.0
+        )
 
-    def get_float_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<f", binary)[0]  # <f for little endian
+    def flush(self, queue_depth=0, final=False):
+        """
+        Write all pending rows in one transaction.
 
+        Args:
+            queue_depth (int): Current size of the ingest queue, for reporting.
+            final (bool): Also write a trailing partial ECG chunk.
+        """
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        now = time.monotonic()
+        if self.pending or (final and len(self.ecg_carry)):
+            try:
+                with self.conn:
+                    if self.ecg_storage == "chunks":
+                        self.conn.executemany(
+                            ECG_CHUNK_INSERT_QUERY, self._chunk_rows(final)
+                        )
+                    elif self.ecg_blocks:
+                        self.conn.executemany(
+                            ECG_INSERT_QUERY, self._rows(self.ecg_blocks)
+                        )
+                    if self.imu_blocks:
+                        self.conn.executemany(
+                            IMU_INSERT_QUERY, self._rows(self.imu_blocks)
+                        )
+                self.rows_written += self.pending
+            except sqlite3.Error as e:
+                print(f"Error inserting data: {e}")
+
+            flush_time = time.monotonic() - now
+            self.flush_count += 1
+            self.flush_time_total += flush_time
+            self.flush_time_max = max(self.flush_time_max, flush_time)
+            self.ecg_blocks = []
+            self.imu_blocks = []
+            self.pending = 0
+        self.last_flush_time = now
+
+        if now - self.last_stats_time >= self.stats_interval:
+            self.report()
+
+    @staticmethod
+    def _rows(blocks):
+        """Yield insert rows for a list of sample blocks, stamped with the system time."""
+        ist_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        for row in np.concatenate(blocks).tolist():
+            yield (ist_time, *row)
+
+    def _chunk_rows(self, final=False):
+        """Split pending ECG samples into whole chunks, carrying the remainder over."""
+        samples = np.concatenate([self.ecg_carry, *self.ecg_blocks])
+        n_chunks = len(samples) // ECG_CHUNK_SAMPLES
+        if final and len(samples) % ECG_CHUNK_SAMPLES:
+            n_chunks += 1
+        self.ecg_carry = samples[n_chunks * ECG_CHUNK_SAMPLES :]
+
+        ist_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        rows = []
+        for i in range(n_chunks):
+            chunk = samples[i * ECG_CHUNK_SAMPLES : (i + 1) * ECG_CHUNK_SAMPLES]
+            rows.append(
+                (
+                    int(chunk["timestamp"][0]),
+                    int(chunk["timestamp"][-1]),
+                    ist_time,
+                    len(chunk),
+                    chunk["value"].astype("<f4").tobytes(),
+                )
+            )
+        return rows
 
-async def run_queue_consumer(queue: asyncio.Queue):
-    while True:
-        data = await queue.get()
-        if data is None:
-            logger.info(
-                "Got message from client about disconnection. Exiting consumer loop..."
+    def report(self):
+        """Log ingest throughput, queue depth and flush latency since the last report."""
+        elapsed = time.monotonic() - self.last_stats_time
+        mean_ms = (
+            self.flush_time_total / self.flush_count * 1000 if self.flush_count else 0.0
+        )
+        logger.info(
+            "Ingest: {} rows in {} flushes ({:.0f} rows/s), max queue depth {}, "
+            "flush latency mean {:.1f} ms / max {:.1f} ms".format(
+                self.rows_written,
+                self.flush_count,
+                self.rows_written / elapsed if elapsed else 0.0,
+                self.max_queue_depth,
+                mean_ms,
+                self.flush_time_max * 1000,
             )
-            break
-        else:
-            # print to stdout
-            # print(data)
-            insert_data(data)
+        )
+        self.last_stats_time = time.monotonic()
+        self.rows_written = 0
+        self.flush_count = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.max_queue_depth = 0
+
+    def close(self):
+        """Flush anything still pending and close the connection."""
+        self.flush(final=True)
+        self.report()
+        self.conn.close()
+
+
+async def run_queue_consumer(
+    queue: asyncio.Queue,
+    db_name="sensor_data.db",
+    batch_size=BATCH_SIZE,
+    flush_interval=FLUSH_INTERVAL,
+    ecg_ring=None,
+):
+    writer = BatchWriter(db_name, batch_size, flush_interval, ecg_ring=ecg_ring)
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    queue.get(), timeout=writer.time_until_flush() or flush_interval
+                )
+            except asyncio.TimeoutError:
+                writer.flush(queue.qsize())
+                continue
+
+            if data is None:
+                logger.info(
+                    "Got message from client about disconnection. Exiting consumer loop..."
+                )
+                break
+            writer.add(*data)
+
+            # Drain whatever is already queued without yielding to the event loop
+            while writer.pending < batch_size and not queue.empty():
+                data = queue.get_nowait()
+                if data is None:
+                    logger.info(
+                        "Got message from client about disconnection. Exiting consumer loop..."
+                    )
+                    return
+                writer.add(*data)
+
+            if writer.should_flush():
+                writer.flush(queue.qsize())
+    finally:
+        writer.close()
 
 
 PACKET_TYPE_DATA = 2
@@ -257,68 +503,26 @@ async def run_ble_client(
         disconnected_event.set()
 
     async def notification_handler(sender, data):
-        """Simple notification handler which prints the data received."""
-        d = DataView(data)
-
-        packet_type = d.get_uint_8(0)
-        reference = d.get_uint_8(1)
+        """Decode a notification into a sample block and queue it for the writer."""
+        packet_type = data[0]
+        reference = data[1]
 
         global ongoing_data_update
-        # print("packet ", packet_type, ", ongoing:",ongoing_data_update)
         if packet_type == PACKET_TYPE_DATA:
             # ECG (reference 100) fits in one packet
             if reference == 100:
-                timestamp = d.get_uint_32(2)
-
-                for i in range(0, 16):
-                    # Interpolate timestamp within the data notification
-                    row_timestamp = timestamp + int(i * 1000 / 200)
-                    ## ECG package starts with timestamp and then array of 16 samples
-                    # Sample scaling is 0.38 uV/sample
-                    sample_mV = d.get_int_32(6 + i * 4) * 0.38 * 0.001
-                    msg_row = "ECG,{},{:.3f}".format(row_timestamp, sample_mV)
-
-                    # queue message for later consumption (output)
-                    await queue.put(msg_row)
-
+                await queue.put(("ECG", decode_ecg_packet(data)))
             else:
-                # print("PACKET_TYPE_DATA")
                 # Store 1st part of the incoming data
-                ongoing_data_update = d
+                ongoing_data_update = bytes(data)
 
         elif packet_type == PACKET_TYPE_DATA_PART2:
-            # print("PACKET_TYPE_DATA_PART2. len:",len(data))
-
-            # Create combined DataView that contains the whole data packet
-            # (skip type_id + ref num of the data_part2)
-            d = DataView(ongoing_data_update.array + data[2:])
+            if ongoing_data_update is None:
+                return
+            # Join both parts (skip type_id + ref num of the data_part2)
+            packet = ongoing_data_update + data[2:]
             ongoing_data_update = None
-
-            # Dig data from the binary
-            # msg = "Data: offset: {}, len: {}".format(d.get_uint_32(2),
-            #     len(d.array))
-            timestamp = d.get_uint_32(2)
-            for i in range(0, 8):
-                # Interpolate timestamp within the data notification
-                row_timestamp = timestamp + int(i * 1000 / 104)
-                ## IMU9 package starts with timestamp and then three arrays (len 8*4 bytes) of xyz's
-                ## Each "row" therefore starts (3*4 bytes after each other interleaving to acc, gyro and magn)
-                offset = 6 + i * 3 * 4
-                skip = 3 * 8 * 4
-                msg_row = "IMU9,{},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f}".format(
-                    row_timestamp,
-                    d.get_float_32(offset),
-                    d.get_float_32(offset + 4),
-                    d.get_float_32(offset + 8),
-                    d.get_float_32(offset + skip + 0),
-                    d.get_float_32(offset + skip + 4),
-                    d.get_float_32(offset + skip + 8),
-                    d.get_float_32(offset + 2 * skip + 0),
-                    d.get_float_32(offset + 2 * skip + 4),
-                    d.get_float_32(offset + 2 * skip + 8),
-                )
-                # queue message for later consumption (output)
-                await queue.put(msg_row)
+            await queue.put(("IMU9", decode_imu9_packet(packet)))
 
     if found:
         async with BleakClient(
@@ -388,10 +592,17 @@ async def run_ble_client(
 async def main(end_of_serial: str, sensor_types: List[str]):
 
     queue = asyncio.Queue()
+    ecg_ring = None
+    if USE_ECG_RING and "ECG" in sensor_types:
+        ecg_ring = SharedRingBuffer.create(ECG_RING_NAME, ECG_RING_SECONDS * 200)
 
-    client_task = run_ble_client(end_of_serial, sensor_types, queue)
-    consumer_task = run_queue_consumer(queue)
-    await asyncio.gather(client_task, consumer_task)
+    try:
+        client_task = run_ble_client(end_of_serial, sensor_types, queue)
+        consumer_task = run_queue_consumer(queue, ecg_ring=ecg_ring)
+        await asyncio.gather(client_task, consumer_task)
+    finally:
+        if ecg_ring is not None:
+            ecg_ring.close()
     logger.info("Main method done.")
 
 
@@ -302,3 +302,59 @@ SCREEN_CAPTURE_PROMPT = """
     2. Ensure the description is clear, concise, and accurate.
     3. Do not include any additional commentary, metadata, or formatting outside of the description.
 """
+
+BATCH_DESCRIPTION_PROMPT = PromptTemplate(
+    input_variables=["n_frames", "pre_frame_act"],
+    template="""
+    You are given {n_frames} images, each preceded by a label saying whether it is a SCREEN capture or an egocentric WEBCAM frame. Describe every image separately.
+    1. **SCREEN images**: In one or two lines, state the specific activity visible on the screen. Be precise about the exact task (e.g., writing a report, solving a Sudoku puzzle, debugging code).
+    2. **WEBCAM images**: Describe the scene from the first-person perspective, only what is directly visible: visible actions, lighting conditions, time of day if discernible and location context. Do not speculate about unseen objects or body parts, and do not add opinions.
+    **Previous frame detected activity:**"{pre_frame_act}"
+    **Output Requirements**:
+    - Return a JSON object with a single key "descriptions" holding a list of exactly {n_frames} strings, one per image, in the order the images were given.
+    - Do not add any other keys or text.
+    """,
+)
+
+FUSED_ACS_PROMPT = PromptTemplate(
+    input_variables=["pre_frame_act"],
+    template="""
+    You are given an image from an egocentric (first-person) perspective. Describe it and extract activity, criticality, and surrounding context in one answer.
+    1. **Description**: Describe only what is directly visible: visible actions, lighting conditions, time of day if discernible and location context. Do not speculate about unseen objects or body parts, and do not add opinions.
+    2. **Activity**: The action the person appears to be performing. Clear and concise.
+    3. **Activity Class**: Exactly one of "Desk_Work" (any work-related), "Commuting" (walking), "Eating" (having lunch, coffee break), "In_Meeting" (socializing, physical meeting, presentations), "Other".
+    4. **Criticality**: Exactly one of:
+        - "Low": Routine or minimal focus tasks (e.g., drinking water, organizing papers).
+        - "Mid": Tasks requiring moderate focus (e.g., walking in a crowded space, typing).
+        - "High": Demanding tasks requiring significant focus (e.g., driving, playing sports, presenting to an audience).
+    5. **Surrounding**: The visible environment, with notable objects relevant to understanding the scene.
+    **Previous frame detected activity:**"{pre_frame_act}"
+    **Output Requirements**:
+    - Return a JSON object with exactly the string keys "description", "activity", "activity_class", "criticality" and "surrounding".
+    - Do not add any other text.
+    **Example Output**:
+    {{"description": "A brightly lit office desk with a laptop open and a coffee cup nearby; hands are typing on the keyboard.", "activity": "typing on a laptop", "activity_class": "Desk_Work", "criticality": "Mid", "surrounding": "office desk with papers and a coffee cup"}}
+    """,
+)
+
+FUSED_BATCH_ACS_PROMPT = PromptTemplate(
+    input_variables=["n_screens", "pre_frame_act"],
+    template="""
+    You are given an egocentric (first-person) WEBCAM frame followed by {n_screens} SCREEN captures, each image preceded by its label. Describe the webcam frame and extract activity, criticality, and surrounding context from it, and describe every screen capture separately.
+    1. **Description**: Describe only what is directly visible in the WEBCAM frame: visible actions, lighting conditions, time of day if discernible and location context. Do not speculate about unseen objects or body parts, and do not add opinions.
+    2. **Activity**: The action the person appears to be performing. Clear and concise.
+    3. **Activity Class**: Exactly one of "Desk_Work" (any work-related), "Commuting" (walking), "Eating" (having lunch, coffee break), "In_Meeting" (socializing, physical meeting, presentations), "Other".
+    4. **Criticality**: Exactly one of:
+        - "Low": Routine or minimal focus tasks (e.g., drinking water, organizing papers).
+        - "Mid": Tasks requiring moderate focus (e.g., walking in a crowded space, typing).
+        - "High": Demanding tasks requiring significant focus (e.g., driving, playing sports, presenting to an audience).
+    5. **Surrounding**: The visible environment, with notable objects relevant to understanding the scene.
+    6. **Screen Descriptions**: For each SCREEN capture, in one or two lines, the specific activity visible on the screen. Be precise about the exact task (e.g., writing a report, solving a Sudoku puzzle, debugging code).
+    **Previous frame detected activity:**"{pre_frame_act}"
+    **Output Requirements**:
+    - Return a JSON object with exactly the string keys "description", "activity", "activity_class", "criticality" and "surrounding", and the key "screen_descriptions" holding a list of exactly {n_screens} strings, one per screen capture, in the order they were given.
+    - Do not add any other text.
+    **Example Output** (one screen capture):
+    {{"description": "A brightly lit office desk with a laptop open and a coffee cup nearby; hands are typing on the keyboard.", "activity": "typing on a laptop", "activity_class": "Desk_Work", "criticality": "Mid", "surrounding": "office desk with papers and a coffee cup", "screen_descriptions": ["Writing a quarterly sales report in a word processor."]}}
+    """,
+)
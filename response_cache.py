@@ -0,0 +1,142 @@
+"""
+Persistent cache of deterministic (temperature 0) LLM answers in SQLite, keyed
+on a hash of the model, the prompt and the request parameters, with a TTL and
+least-recently-used eviction beyond a maximum number of entries.
+"""
+
+import json
+import time
+import hashlib
+import threading
+
+from crud_db import get_connection_manager
+
+RESPONSE_CACHE_PATH = "llm_cache.db"
+RESPONSE_CACHE_ENTRIES = 20000
+RESPONSE_CACHE_TTL = 30 * 24 * 3600
+# Hits refresh their LRU position at most this often, to keep reads write-free
+TOUCH_INTERVAL = 60
+
+CREATE_RESPONSE_CACHE_TABLE = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    response TEXT,
+    created REAL,
+    accessed REAL
+);
+"""
+
+
+def _content(message):
+    """Text of a chat message given as a dict or a LangChain message."""
+    if isinstance(message, dict):
+        return [message.get("role"), message.get("content")]
+    return [type(message).__name__, getattr(message, "content", str(message))]
+
+
+class ResponseCache:
+    """
+    Model answers stored by request hash.
+
+    Callers look up with get() and only put() an answer once it has passed their
+    own parsing, so a malformed answer is never replayed.
+    """
+
+    def __init__(
+        self,
+        db_path=RESPONSE_CACHE_PATH,
+        max_entries=RESPONSE_CACHE_ENTRIES,
+        ttl=RESPONSE_CACHE_TTL,
+    ):
+        self.manager = get_connection_manager(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.manager.execute(CREATE_RESPONSE_CACHE_TABLE)
+        self.manager.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_accessed "
+            "ON response_cache (accessed);"
+        )
+
+    @staticmethod
+    def key(model, messages, **params):
+        """
+        Hash of a request.
+
+        Args:
+            model (str): Model name.
+            messages (list | str): Prompt messages or prompt text.
+            **params: Parameters that change the answer (temperature, max_tokens...).
+
+        Returns:
+            str: Hex digest.
+        """
+        if isinstance(messages, str):
+            messages = [messages]
+        payload = json.dumps(
+            [model, [_content(m) for m in messages], params],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the stored answer, or None if missing or expired."""
+        now = time.time()
+        rows = self.manager.fetchall(
+            "SELECT response, created, accessed FROM response_cache WHERE key = ?;",
+            (key,),
+        )
+        if not rows or now - rows[0][1] > self.ttl:
+            with self.lock:
+                self.misses += 1
+            return None
+        response, _, accessed = rows[0]
+        if now - accessed > TOUCH_INTERVAL:
+            self.manager.execute(
+                "UPDATE response_cache SET accessed = ? WHERE key = ?;", (now, key)
+            )
+        with self.lock:
+            self.hits += 1
+        return response
+
+    def put(self, key, response, model=None):
+        """Store an answer and evict expired and least recently used entries."""
+        now = time.time()
+        with self.manager.writer() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?);",
+                (key, model, response, now, now),
+            )
+            connection.execute(
+                "DELETE FROM response_cache WHERE created < ?;", (now - self.ttl,)
+            )
+            connection.execute(
+                """
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY accessed DESC
+                    LIMIT -1 OFFSET ?
+                );
+                """,
+                (self.max_entries,),
+            )
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(db_path=RESPONSE_CACHE_PATH):
+    """Return the process-wide ResponseCache for a database file."""
+    with _caches_lock:
+        if db_path not in _caches:
+            _caches[db_path] = ResponseCache(db_path)
+        return _caches[db_path]
@@ -0,0 +1,178 @@
+"""
+Fixed-capacity ring buffers backed by NumPy arrays, optionally living in shared
+memory so that the sensor process can publish ECG samples to the main pipeline.
+"""
+
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Shared ECG ring written by movesense_sensor_data.py and read by main.py
+ECG_RING_NAME = "adaptai_ecg"
+ECG_RING_SECONDS = 600
+
+# Shared memory header: total samples written, capacity (both int64)
+_HEADER_BYTES = 16
+
+
+class RingBuffer:
+    """
+    Mirrored ring buffer: every sample is stored twice, at i and i + capacity,
+    so any trailing window of up to `capacity` samples is one contiguous slice
+    and can be returned as a view without copying.
+
+    There is a single writer. Readers see a sample once `total` has been bumped
+    past it; a view stays valid until the writer laps it, i.e. for `capacity`
+    more samples.
+    """
+
+    def __init__(self, capacity, dtype=np.float32, buffer=None, counter=None):
+        """
+        Args:
+            capacity (int): Number of samples kept.
+            dtype: NumPy dtype of the samples.
+            buffer: Optional memory to place the 2 * capacity samples in.
+            counter (np.ndarray): Optional int64 array of shape (1,) holding the total.
+        """
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        if buffer is None:
+            self.data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        else:
+            self.data = np.ndarray(2 * self.capacity, dtype=self.dtype, buffer=buffer)
+        self._count = np.zeros(1, dtype=np.int64) if counter is None else counter
+
+    @property
+    def total(self):
+        """Number of samples written since the buffer was created."""
+        return int(self._count[0])
+
+    def write(self, samples):
+        """
+        Append samples, overwriting the oldest ones once the buffer is full.
+
+        Args:
+            samples (array-like): Samples to append, flattened.
+        """
+        samples = np.asarray(samples, dtype=self.dtype).reshape(-1)
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity :]
+        start = (self.total + n - len(samples)) % self.capacity
+        first = min(len(samples), self.capacity - start)
+        for offset in (0, self.capacity):
+            self.data[offset + start : offset + start + first] = samples[:first]
+            self.data[offset : offset + len(samples) - first] = samples[first:]
+        # Publish only after the samples are in place
+        self._count[0] += n
+
+    def latest(self, n, total=None):
+        """
+        Return the most recent samples as a view.
+
+        Args:
+            n (int): Number of samples wanted; capped by what is available.
+            total (int): Optional snapshot of `total` to read up to.
+
+        Returns:
+            np.ndarray: Up to n samples, oldest first.
+        """
+        total = self.total if total is None else total
+        n = max(min(int(n), total, self.capacity), 0)
+        end = total % self.capacity + self.capacity
+        return self.data[end - n : end]
+
+    def read_since(self, position):
+        """
+        Return the samples written after `position`.
+
+        Args:
+            position (int): A value previously returned as the new position.
+
+        Returns:
+            tuple: (samples view, new position). Samples older than `capacity`
+                   are lost; a position ahead of `total` (writer restarted)
+                   restarts from the oldest sample kept.
+        """
+        total = self.total
+        if position > total:
+            position = 0
+        return self.latest(total - position, total), total
+
+
+class SharedRingBuffer(RingBuffer):
+    """RingBuffer stored in a named multiprocessing.shared_memory block."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray(2, dtype=np.int64, buffer=shm.buf[:_HEADER_BYTES])
+        super().__init__(
+            int(header[1]),
+            np.float32,
+            buffer=shm.buf[_HEADER_BYTES:],
+            counter=header[:1],
+        )
+
+    @classmethod
+    def create(cls, name, capacity):
+        """
+        Create the shared block, replacing one left behind by a crashed writer.
+
+        Args:
+            name (str): Shared memory name.
+            capacity (int): Number of float32 samples kept.
+        """
+        size = _HEADER_BYTES + 2 * capacity * np.dtype(np.float32).itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(2, dtype=np.int64, buffer=shm.buf[:_HEADER_BYTES])
+        header[:] = (0, capacity)
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a block created by another process.
+
+        Returns:
+            SharedRingBuffer or None if no writer has created it.
+        """
+        try:
+            if sys.version_info >= (3, 13):
+                shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                shm = shared_memory.SharedMemory(name=name)
+                # Before 3.13 the resource tracker would unlink the writer's
+                # block when this reader exits
+                if sys.platform != "win32":
+                    from multiprocessing import resource_tracker
+
+                    resource_tracker.unregister(shm._name, "shared_memory")
+        except FileNotFoundError:
+            return None
+        return cls(shm, owner=False)
+
+    def close(self):
+        """Detach, and remove the block if this process created it."""
+        del self.data, self._count
+        try:
+            self.shm.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with it
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
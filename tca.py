@@ -2,6 +2,7 @@
 Tone-Adaptive Conversational Agent main pipeline file.
 """
 
+import time
 import sqlite3
 import streamlit as st
 from langchain_core.prompts import (
@@ -11,11 +12,87 @@ from langchain_core.prompts import (
 )
 from langchain_core.messages import SystemMessage
 from langchain_groq import ChatGroq
-from langchain.chains import LLMChain
 from langchain.chains.conversation.memory import ConversationBufferWindowMemory
 
 from prompts import PERSONALIZED_LLM_PROMPT
-from crud_db import get_timetable_w_stress_lvl
+from crud_db import (
+    get_timetable_last_id,
+    get_timetable_stress_lines,
+    TIMETABLE_STRESS_HEADER,
+)
+from llm_client import RateLimitedChatModel
+
+TASK_DB = "task.db"
+# Seconds between checks for new timetable rows
+TIMETABLE_CHECK_TTL = 10
+
+
+@st.cache_resource
+def get_chat_model(groq_api_key, model):
+    """One rate-limited ChatGroq client per API key and model, shared across reruns."""
+    return RateLimitedChatModel(
+        ChatGroq(groq_api_key=groq_api_key, model_name=model, max_retries=0)
+    )
+
+
+@st.cache_data(ttl=TIMETABLE_CHECK_TTL)
+def timetable_last_id(db_path):
+    """Newest timetable row id, re-read at most every TIMETABLE_CHECK_TTL seconds."""
+    return get_timetable_last_id(db_path)
+
+
+def timetable_context(db_path):
+    """
+    Today's timetable with stress levels as CSV, kept in the session and only
+    extended with the rows added since the last rerun.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+    """
+    today = time.strftime("%Y-%m-%d")
+    state = st.session_state.get("timetable")
+    last_id = timetable_last_id(db_path)
+    # A new day, or a database that was replaced, starts from scratch
+    if state is None or state["day"] != today or last_id < state["last_id"]:
+        state = {"day": today, "last_id": 0, "lines": []}
+        st.session_state.timetable = state
+    if last_id != state["last_id"]:
+        state["last_id"], lines = get_timetable_stress_lines(db_path, state["last_id"])
+        state["lines"].extend(lines)
+    return TIMETABLE_STRESS_HEADER + "\n".join(state["lines"])
+
+
+def stream_reply(chat_model, messages, stats):
+    """
+    Yield the answer text as it arrives and time it.
+
+    Args:
+        chat_model: Chat model with a LangChain-style `stream` method.
+        messages (list): Prompt messages.
+        stats (dict): Filled with "ttft" (seconds to the first token), "tokens"
+                      and "tokens_per_s" once the stream ends.
+    """
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    usage = None
+    for chunk in chat_model.stream(messages):
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        if chunk.content:
+            if first is None:
+                first = time.perf_counter()
+            tokens += 1
+            yield chunk.content
+    end = time.perf_counter()
+
+    if first is None:
+        return
+    # Chunks are roughly one token each; prefer the usage the API reports
+    if usage and usage.get("output_tokens"):
+        tokens = usage["output_tokens"]
+    stats["ttft"] = first - start
+    stats["tokens"] = tokens
+    stats["tokens_per_s"] = tokens / (end - first) if end > first else float("nan")
 
 
 def tca(groq_api_key):
@@ -36,25 +113,25 @@ def tca(groq_api_key):
         "Conversational memory length:", 1, 10, value=5
     )
 
-    # Memory for conversation history
-    memory = ConversationBufferWindowMemory(
-        k=conversational_memory_length, memory_key="chat_history", return_messages=True
-    )
+    # Memory for conversation history, kept across reruns; the window only
+    # limits what is loaded, so changing its length needs no replay
+    if "memory" not in st.session_state:
+        st.session_state.memory = ConversationBufferWindowMemory(
+            k=conversational_memory_length,
+            memory_key="chat_history",
+            return_messages=True,
+        )
+        st.session_state.chat_history = []
+    memory = st.session_state.memory
+    memory.k = conversational_memory_length
 
     user_question = st.text_input("Ask a question:")
 
-    # Restore chat history if available
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    else:
-        for message in st.session_state.chat_history:
-            memory.save_context({"input": message["human"]}, {"output": message["AI"]})
-
     # Initialize Groq chat model
-    groq_chat = ChatGroq(groq_api_key=groq_api_key, model_name=model)
+    groq_chat = get_chat_model(groq_api_key, model)
 
     # Fetch timetable data
-    tables = get_timetable_w_stress_lvl("task.db")
+    tables = timetable_context(TASK_DB)
 
     if user_question:
         # Format query with context
@@ -67,16 +144,25 @@ def tca(groq_api_key):
             ]
         )
 
-        # Create conversation chain
-        conversation = LLMChain(
-            llm=groq_chat, prompt=prompt, verbose=True, memory=memory
+        # Fill the prompt with the remembered turns and get chatbot response
+        messages = prompt.format_messages(
+            chat_history=memory.load_memory_variables({})["chat_history"],
+            human_input=user_question,
         )
-
-        # Get chatbot response
-        response = conversation.predict(human_input=user_question)
+        st.write("Chatbot:")
+        stats = {}
+        response = st.write_stream(stream_reply(groq_chat, messages, stats))
+        if stats:
+            latency = (
+                f"First token after {stats['ttft']:.2f} s, "
+                f"{stats['tokens']} tokens at {stats['tokens_per_s']:.0f} tokens/s"
+            )
+            st.caption(latency)
+            print(f"TCA turn: {latency}")
+
+        memory.save_context({"input": user_question}, {"output": response})
         message = {"human": user_question, "AI": response}
         st.session_state.chat_history.append(message)
-        st.write("Chatbot:", response)
 
 
 if __name__ == "_main_":
@@ -0,0 +1,105 @@
+"""
+Callback cost and memory of the audio recording buffer over a simulated session:
+the old np.append buffer against the ring buffer now used by main.AudioRecorder.
+The np.append path grows quadratically, so it is only run for its first minutes.
+
+With the defaults (8 h ring buffer, 5 min np.append; 48 kHz mono, 1024-frame
+blocks): np.append p99 callback 2.8 ms after 1 min, 10.7 ms after 5 min,
+~346 MB/h; ring buffer p99 0.007-0.009 ms over 8 h, fixed 115 MB, ~0.6 kB
+allocated per 10 min once full.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ring_buffer import RingBuffer
+
+SAMPLERATE = 48000
+BLOCK = 1024  # frames per PortAudio callback
+BUFFER_SECONDS = 600
+
+
+def simulate(write, seconds, report_every=3600, trace=False):
+    """
+    Feed `seconds` of random int16 blocks to `write`.
+
+    Returns:
+        tuple: (callback times in seconds, [(session seconds, p99 callback ms)],
+                peak bytes allocated by the writes if `trace`, else None)
+    """
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(-2000, 2000, (64, BLOCK, 1), dtype=np.int16)
+    n_callbacks = int(seconds * SAMPLERATE / BLOCK)
+    times = np.empty(n_callbacks)
+    checkpoints = []
+    per_report = int(report_every * SAMPLERATE / BLOCK)
+    # Traced runs are slower; their timings are not reported
+    if trace:
+        tracemalloc.start()
+    for i in range(n_callbacks):
+        start = time.perf_counter()
+        write(blocks[i % len(blocks)])
+        times[i] = time.perf_counter() - start
+        if (i + 1) % per_report == 0:
+            recent = times[i + 1 - per_report : i + 1]
+            checkpoints.append(
+                ((i + 1) * BLOCK / SAMPLERATE, np.percentile(recent, 99) * 1000)
+            )
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return times, checkpoints, peak
+
+
+def legacy_writer():
+    state = {"buffer": np.array([], dtype=np.int16)}
+
+    def write(indata):
+        state["buffer"] = np.append(state["buffer"], indata)
+
+    return write, state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--legacy-minutes", type=float, default=5.0)
+    args = parser.parse_args()
+
+    write, state = legacy_writer()
+    times, checkpoints, _ = simulate(write, args.legacy_minutes * 60, 60)
+    write, _ = legacy_writer()
+    _, _, peak = simulate(write, args.legacy_minutes * 60, 60, trace=True)
+    print(f"np.append, first {args.legacy_minutes:g} min:")
+    for seconds, p99 in checkpoints:
+        print(f"  t={seconds / 60:5.1f} min  p99 callback {p99:8.3f} ms")
+    print(
+        f"  mean callback {times.mean() * 1e6:.1f} us, "
+        f"buffer {state['buffer'].nbytes / 1e6:.1f} MB, "
+        f"peak allocated {peak / 1e6:.1f} MB "
+        f"(grows without bound: ~{SAMPLERATE * 2 * 3600 / 1e6:.0f} MB/h)"
+    )
+
+    buffer = RingBuffer(BUFFER_SECONDS * SAMPLERATE, np.int16)
+    times, checkpoints, _ = simulate(buffer.write, args.hours * 3600)
+    # The buffer is full by now; another traced 10 minutes shows it allocates nothing
+    _, _, peak = simulate(buffer.write, BUFFER_SECONDS, trace=True)
+    print(f"ring buffer, {args.hours:g} h:")
+    for seconds, p99 in checkpoints:
+        print(f"  t={seconds / 3600:4.1f} h  p99 callback {p99:8.3f} ms")
+    print(
+        f"  mean callback {times.mean() * 1e6:.1f} us, "
+        f"buffer {buffer.data.nbytes / 1e6:.1f} MB (fixed), "
+        f"allocated per 10 min once full {peak / 1e3:.1f} kB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Upload size of a screen grab before and after frame_prep: the old full-resolution
+default-quality JPEG against downscaling, the byte budget and a changed-region
+crop. With GROQ_API_KEY set, also times get_img_desp on each payload.
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from frame_prep import (
+    prepare_frame,
+    changed_region,
+    SCREEN_MAX_SIDE,
+    SCREEN_BYTE_BUDGET,
+)
+
+
+def synthetic_screen(width=5120, height=1440, seed=0):
+    """
+    Two-monitor BGRA desktop: windows full of text and a photo-like panel.
+
+    Returns:
+        np.ndarray: The screen grab.
+    """
+    rng = np.random.default_rng(seed)
+    screen = np.full((height, width, 4), (90, 60, 40, 255), dtype=np.uint8)
+    for x0 in range(40, width - 900, 1280):
+        cv2.rectangle(screen, (x0, 60), (x0 + 1150, height - 80), (245,) * 4, -1)
+        for line, y in enumerate(range(120, height - 120, 28)):
+            text = "".join(rng.choice(list("abcdefghij klmnopqrs tuvwxyz"), 70))
+            cv2.putText(
+                screen,
+                f"{line:3d}  {text}",
+                (x0 + 20, y),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (30, 30, 30, 255),
+                1,
+                cv2.LINE_AA,
+            )
+    photo = cv2.GaussianBlur(
+        rng.integers(0, 255, (600, 900, 4), dtype=np.uint8), (9, 9), 0
+    )
+    screen[400:1000, width - 1000 : width - 100] = photo
+    return screen
+
+
+def time_upload(client, buffer):
+    from acs_detection import get_img_desp
+
+    start = time.perf_counter()
+    get_img_desp(client, buffer, "", is_screen=True)
+    return time.perf_counter() - start
+
+
+def main(repeat=5):
+    screen = synthetic_screen()
+    # Next tick: one window scrolled a few lines
+    scrolled = screen.copy()
+    scrolled[100:900, 1320:2420] = np.roll(screen[100:900, 1320:2420], -56, axis=0)
+
+    variants = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        _, variants["full, default quality"] = cv2.imencode(".jpg", scrolled)
+    encode_times = {"full, default quality": (time.perf_counter() - start) / repeat}
+
+    crops = {
+        "max side + budget": None,
+        "changed region + budget": changed_region(scrolled, screen),
+    }
+    for name, crop in crops.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            variants[name], quality = prepare_frame(
+                scrolled, SCREEN_MAX_SIDE, SCREEN_BYTE_BUDGET, crop=crop
+            )
+        encode_times[name] = (time.perf_counter() - start) / repeat
+        print(f"{name}: crop {crop}, JPEG quality {quality}")
+
+    client = None
+    if os.environ.get("GROQ_API_KEY"):
+        from groq import Groq
+
+        client = Groq(api_key=os.environ["GROQ_API_KEY"])
+
+    print(f"screen: {screen.shape[1]}x{screen.shape[0]}")
+    for name, buffer in variants.items():
+        line = (
+            f"{name:26s} {buffer.nbytes / 1e3:8.1f} kB  "
+            f"encode {encode_times[name] * 1000:6.1f} ms"
+        )
+        if client is not None:
+            line += f"  request {time_upload(client, buffer):6.2f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Micro-benchmark of Movesense packet decoding: the old DataView + CSV string
+path against the NumPy structured-dtype decoders in movesense_sensor_data.py.
+"""
+
+import os
+import sys
+import struct
+import timeit
+from functools import reduce
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from movesense_sensor_data import decode_ecg_packet, decode_imu9_packet
+
+
+# https://stackoverflow.com/a/56243296
+class DataView:
+    """The byte-by-byte reader the notification handler used before."""
+
+    def __init__(self, array, bytes_per_element=1):
+        self.array = array
+        self.bytes_per_element = 1
+
+    def __get_binary(self, start_index, byte_count, signed=False):
+        integers = [self.array[start_index + x] for x in range(byte_count)]
+        _bytes = [
+            integer.to_bytes(self.bytes_per_element, byteorder="little", signed=signed)
+            for integer in integers
+        ]
+        return reduce(lambda a, b: a + b, _bytes)
+
+    def get_uint_32(self, start_index):
+        return struct.unpack("<I", self.__get_binary(start_index, 4))[0]
+
+    def get_int_32(self, start_index):
+        return struct.unpack("<i", self.__get_binary(start_index, 4))[0]
+
+    def get_float_32(self, start_index):
+        return struct.unpack("<f", self.__get_binary(start_index, 4))[0]
+
+
+def legacy_ecg(data):
+    """DataView decode, CSV formatting and the split(",") parse in insert_data."""
+    d = DataView(data)
+    timestamp = d.get_uint_32(2)
+    rows = []
+    for i in range(0, 16):
+        row_timestamp = timestamp + int(i * 1000 / 200)
+        sample_mV = d.get_int_32(6 + i * 4) * 0.38 * 0.001
+        msg_row = "ECG,{},{:.3f}".format(row_timestamp, sample_mV)
+        columns = msg_row.split(",")
+        rows.append((int(columns[1]), float(columns[2])))
+    return rows
+
+
+def legacy_imu9(data):
+    d = DataView(data)
+    timestamp = d.get_uint_32(2)
+    rows = []
+    for i in range(0, 8):
+        row_timestamp = timestamp + int(i * 1000 / 104)
+        offset = 6 + i * 3 * 4
+        skip = 3 * 8 * 4
+        msg_row = "IMU9,{},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f}".format(
+            row_timestamp,
+            d.get_float_32(offset),
+            d.get_float_32(offset + 4),
+            d.get_float_32(offset + 8),
+            d.get_float_32(offset + skip + 0),
+            d.get_float_32(offset + skip + 4),
+            d.get_float_32(offset + skip + 8),
+            d.get_float_32(offset + 2 * skip + 0),
+            d.get_float_32(offset + 2 * skip + 4),
+            d.get_float_32(offset + 2 * skip + 8),
+        )
+        columns = msg_row.split(",")
+        rows.append((int(columns[1]), *[float(val) for val in columns[2:]]))
+    return rows
+
+
+def make_packets(rng):
+    """Build a random ECG packet and a joined IMU9 packet."""
+    ecg = bytearray([2, 100]) + struct.pack("<I", 123456)
+    ecg += rng.integers(-5000, 5000, 16, dtype="<i4").tobytes()
+    imu = bytearray([2, 99]) + struct.pack("<I", 123456)
+    imu += rng.normal(0, 10, 72).astype("<f4").tobytes()
+    return ecg, imu
+
+
+def main(number=20000):
+    ecg, imu = make_packets(np.random.default_rng(0))
+
+    # Both paths must agree on the decoded values
+    new_ecg = decode_ecg_packet(ecg)
+    assert np.allclose([row[1] for row in legacy_ecg(ecg)], new_ecg["value"], atol=1e-3)
+    assert np.array_equal([row[0] for row in legacy_ecg(ecg)], new_ecg["timestamp"])
+    new_imu = decode_imu9_packet(imu)
+    assert np.allclose(
+        [row[1:] for row in legacy_imu9(imu)],
+        [list(row)[1:] for row in new_imu.tolist()],
+        atol=1e-2,
+    )
+
+    for name, legacy, vectorized, packet in (
+        ("ECG", legacy_ecg, decode_ecg_packet, ecg),
+        ("IMU9", legacy_imu9, decode_imu9_packet, imu),
+    ):
+        t_legacy = timeit.timeit(lambda: legacy(packet), number=number) / number
+        t_new = timeit.timeit(lambda: vectorized(packet), number=number) / number
+        print(
+            f"{name:5s} DataView: {t_legacy * 1e6:8.2f} us/packet  "
+            f"np.frombuffer: {t_new * 1e6:8.2f} us/packet  "
+            f"speedup: {t_legacy / t_new:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Audio uploaded by audio_pipeline with and without the voice activity gate over a
+simulated workday: one minute windows of room noise, keyboard clicks and a low
+hum, with speech-like bursts (harmonics of a pitch, syllable-rate envelope) in
+a given share of the minutes. Also times the gate per window.
+
+Pass a WAV file to run the gate on a real recording instead.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from scipy.io import wavfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from voice_activity import VoiceActivityGate
+
+SAMPLERATE = 48000
+WINDOW_SECONDS = 60
+
+
+def synthetic_window(rng, speech_seconds):
+    """
+    One window of int16 audio with `speech_seconds` of speech in 2-6 s bursts.
+
+    Returns:
+        np.ndarray: The samples.
+    """
+    n = WINDOW_SECONDS * SAMPLERATE
+    t = np.arange(n) / SAMPLERATE
+    audio = rng.normal(0, 30, n) + 60 * np.sin(2 * np.pi * 50 * t)
+    for _ in range(rng.integers(0, 20)):
+        start = rng.integers(0, n - 480)
+        audio[start : start + 480] += rng.normal(0, 3000, 480)
+
+    remaining = speech_seconds
+    while remaining >= 0.5:
+        length = int(min(remaining, rng.uniform(2, 6)) * SAMPLERATE)
+        start = rng.integers(0, n - length)
+        burst_t = np.arange(length) / SAMPLERATE
+        pitch = rng.uniform(100, 220)
+        voiced = sum(
+            np.sin(2 * np.pi * pitch * k * burst_t) / k
+            for k in range(2, int(3400 / pitch))
+        )
+        envelope = np.clip(np.sin(2 * np.pi * rng.uniform(3, 6) * burst_t), 0, 1)
+        audio[start : start + length] += 3000 * voiced * envelope
+        remaining -= length / SAMPLERATE
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="?", help="Mono 16-bit recording to gate")
+    parser.add_argument("--minutes", type=int, default=120)
+    parser.add_argument(
+        "--speech-share",
+        type=float,
+        default=0.15,
+        help="Share of the minutes with someone talking",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.wav:
+        samplerate, recording = wavfile.read(args.wav)
+        step = WINDOW_SECONDS * samplerate
+        windows = (
+            recording[i : i + step] for i in range(0, len(recording) - step + 1, step)
+        )
+    else:
+        samplerate = SAMPLERATE
+        windows = (
+            synthetic_window(
+                rng,
+                rng.uniform(5, 40) if rng.random() < args.speech_share else 0,
+            )
+            for _ in range(args.minutes)
+        )
+
+    gate = VoiceActivityGate(samplerate)
+    uploaded, calls, seconds = 0, 0, []
+    total = 0
+    for window in windows:
+        total += window.nbytes
+        start = time.perf_counter()
+        speech = gate.filter(window)
+        seconds.append(time.perf_counter() - start)
+        if speech is not None:
+            calls += 1
+            uploaded += speech.nbytes
+
+    print(f"without VAD: {gate.windows} calls, {total / 1e6:.1f} MB uploaded")
+    print(f"with VAD:    {calls} calls, {uploaded / 1e6:.1f} MB uploaded")
+    gate.report()
+    print(
+        f"gate per {WINDOW_SECONDS} s window: mean {np.mean(seconds) * 1000:.1f} ms, "
+        f"max {np.max(seconds) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Energy and spectral voice activity detection on the CPU, run in front of
+audio_transcription so that silent windows are never uploaded.
+
+Audio is cut into short frames; a frame is speech when it is louder than the
+noise floor of its window and most of its energy lies in the speech band.
+Speech frames are grouped into segments, padded, and segments separated by
+short pauses are merged into utterances.
+"""
+
+import numpy as np
+
+VAD_FRAME_MS = 30
+# Frequency band holding most of the energy of speech (Hz)
+SPEECH_BAND = (300, 3400)
+MIN_SPEECH_BAND_RATIO = 0.5
+# A frame must be this far above the noise floor of its window...
+ENERGY_MARGIN_DB = 10.0
+# ...and above this absolute level (dBFS); the margin is capped at
+# MAX_THRESHOLD_DB so a window that is speech throughout still passes
+MIN_ENERGY_DB = -55.0
+MAX_THRESHOLD_DB = -35.0
+NOISE_FLOOR_PERCENTILE = 10
+# Gaps between speech frames shorter than this (syllables, plosives) are bridged
+HANGOVER_MS = 200
+MIN_SPEECH_MS = 250
+SPEECH_PAD_MS = 200
+# Pauses shorter than this stay inside one utterance
+MAX_PAUSE_MS = 1000
+# Frames analysed per FFT batch, to bound memory on long buffers
+FRAMES_PER_BATCH = 512
+
+
+def _to_mono(audio):
+    """Float mono signal in [-1, 1] from int16 or float audio, (n,) or (n, channels)."""
+    audio = np.asarray(audio)
+    scale = 1.0
+    if np.issubdtype(audio.dtype, np.integer):
+        scale = 1.0 / np.iinfo(audio.dtype).max
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    return audio.astype(np.float32) * np.float32(scale)
+
+
+def speech_frames(audio, samplerate, frame_ms=VAD_FRAME_MS):
+    """
+    Classify fixed-length frames as speech or silence.
+
+    Args:
+        audio (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        frame_ms (int): Frame length in milliseconds.
+
+    Returns:
+        tuple: (boolean array with one entry per frame, frame length in samples)
+    """
+    mono = _to_mono(audio)
+    frame_len = max(int(samplerate * frame_ms / 1000), 1)
+    n_frames = len(mono) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool), frame_len
+    frames = mono[: n_frames * frame_len].reshape(n_frames, frame_len)
+
+    energy_db = np.empty(n_frames, dtype=np.float32)
+    band_ratio = np.empty(n_frames, dtype=np.float32)
+    window = np.hanning(frame_len).astype(np.float32)
+    freqs = np.fft.rfftfreq(frame_len, 1 / samplerate)
+    in_band = (freqs >= SPEECH_BAND[0]) & (freqs <= SPEECH_BAND[1])
+    for start in range(0, n_frames, FRAMES_PER_BATCH):
+        batch = frames[start : start + FRAMES_PER_BATCH]
+        rms = np.sqrt(np.mean(batch**2, axis=1))
+        energy_db[start : start + len(batch)] = 20 * np.log10(rms + 1e-10)
+        power = np.abs(np.fft.rfft(batch * window, axis=1)) ** 2
+        band_ratio[start : start + len(batch)] = power[:, in_band].sum(axis=1) / (
+            power.sum(axis=1) + 1e-20
+        )
+
+    noise_floor = np.percentile(energy_db, NOISE_FLOOR_PERCENTILE)
+    threshold = max(
+        MIN_ENERGY_DB, min(noise_floor + ENERGY_MARGIN_DB, MAX_THRESHOLD_DB)
+    )
+    return (energy_db > threshold) & (band_ratio > MIN_SPEECH_BAND_RATIO), frame_len
+
+
+def detect_utterances(
+    audio,
+    samplerate,
+    hangover_ms=HANGOVER_MS,
+    min_speech_ms=MIN_SPEECH_MS,
+    pad_ms=SPEECH_PAD_MS,
+    max_pause_ms=MAX_PAUSE_MS,
+):
+    """
+    Find the utterances in a recording.
+
+    Args:
+        audio (np.ndarray): Samples, (n,) or (n, channels).
+        samplerate (int): Sample rate in Hz.
+        hangover_ms (int): Gaps between speech frames shorter than this are bridged.
+        min_speech_ms (int): Bridged runs shorter than this are dropped.
+        pad_ms (int): Audio kept before and after each run.
+        max_pause_ms (int): Runs closer than this are merged into one utterance.
+
+    Returns:
+        list: (start, end) sample indices of the utterances, in order.
+    """
+    is_speech, frame_len = speech_frames(audio, samplerate)
+    if not is_speech.any():
+        return []
+    # Edges of the runs of speech frames
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_speech.view(np.int8), [0]))))
+    hangover = samplerate * hangover_ms // 1000
+    runs = []
+    for start, end in edges.reshape(-1, 2) * frame_len:
+        if runs and start - runs[-1][1] <= hangover:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    min_len = samplerate * min_speech_ms // 1000
+    pad = samplerate * pad_ms // 1000
+    max_pause = samplerate * max_pause_ms // 1000
+    utterances = []
+    for start, end in runs:
+        if end - start < min_len:
+            continue
+        start, end = max(start - pad, 0), min(end + pad, len(audio))
+        if utterances and start - utterances[-1][1] <= max_pause:
+            utterances[-1][1] = end
+        else:
+            utterances.append([start, end])
+    return [(int(start), int(end)) for start, end in utterances]
+
+
+class VoiceActivityGate:
+    """
+    Keeps the utterances of each audio window and drops the rest, counting the
+    skipped audio and the upload bytes saved.
+    """
+
+    def __init__(self, samplerate, channels=1, gap_ms=300):
+        """
+        Args:
+            samplerate (int): Sample rate in Hz.
+            channels (int): Interleaved channels in the audio passed in.
+            gap_ms (int): Silence left between utterances when they are joined.
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.gap = samplerate * gap_ms // 1000
+        self.windows = 0
+        self.skipped_windows = 0
+        self.seconds_in = 0.0
+        self.seconds_kept = 0.0
+        self.bytes_saved = 0
+        # (start in the output, start in the input, length) per utterance, in frames
+        self.layout = []
+
+    def filter(self, audio):
+        """
+        Args:
+            audio (np.ndarray): Samples of one window, interleaved if multichannel.
+
+        Returns:
+            np.ndarray: The utterances joined by short gaps, interleaved like the
+                        input, or None if the window holds no speech.
+        """
+        frames = np.asarray(audio).reshape(-1, self.channels)
+        utterances = detect_utterances(frames, self.samplerate)
+        kept = sum(end - start for start, end in utterances)
+        self.windows += 1
+        self.seconds_in += len(frames) / self.samplerate
+        self.seconds_kept += kept / self.samplerate
+        self.layout = []
+        if not utterances:
+            self.skipped_windows += 1
+            self.bytes_saved += frames.nbytes
+            return None
+
+        gap = np.zeros((self.gap, self.channels), dtype=frames.dtype)
+        parts = []
+        position = 0
+        for start, end in utterances:
+            if parts:
+                parts.append(gap)
+                position += self.gap
+            parts.append(frames[start:end])
+            self.layout.append((position, start, end - start))
+            position += end - start
+        speech = np.concatenate(parts)
+        self.bytes_saved += frames.nbytes - speech.nbytes
+        return speech.reshape(-1) if np.ndim(audio) == 1 else speech
+
+    def source_time(self, seconds):
+        """
+        Map a time in the last output of filter() back to the input window.
+
+        Args:
+            seconds (float): Seconds from the start of the output.
+
+        Returns:
+            float: Seconds from the start of the input; times inside a gap map
+                   to the end of the utterance before it.
+        """
+        frame = seconds * self.samplerate
+        for output_start, input_start, length in reversed(self.layout):
+            if frame >= output_start:
+                return (
+                    input_start + min(frame - output_start, length)
+                ) / self.samplerate
+        return seconds
+
+    def report(self):
+        """Log the share of audio and of windows that was not uploaded."""
+        if not self.windows:
+            return
+        skipped = self.seconds_in - self.seconds_kept
+        print(
+            f"VAD: skipped {skipped:.0f} of {self.seconds_in:.0f} s "
+            f"({skipped / max(self.seconds_in, 1e-9):.0%}), "
+            f"{self.skipped_windows}/{self.windows} windows without speech, "
+            f"{self.bytes_saved / 1e6:.1f} MB not uploaded"
+        )